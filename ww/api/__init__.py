@@ -0,0 +1,3 @@
+"""
+HTTP API 服务模块
+"""
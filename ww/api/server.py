@@ -0,0 +1,250 @@
+"""
+无界面的 HTTP API 服务
+
+基于 core 包提供检索、流式对话（SSE）、批量入库与删除接口。
+批量入库只接受 ingest_root 下的文件，提交到后台任务队列后立即返回任务 ID，可通过 /jobs/{job_id} 查询进度。
+服务以单进程运行，所有请求共享各知识库的 VectorStore 与嵌入模型；
+并发由事件循环与线程池承担，同一时间窗口内到达的查询向量合并计算。
+检索与对话可通过 knowledge_bases 指定多个知识库，文档管理接口通过 knowledge_base 参数指定知识库。
+"""
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+from fastapi import FastAPI, HTTPException, Header
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from pydantic import BaseModel
+from core.config import (
+    API_SETTINGS, DEFAULT_MODEL, AVAILABLE_MODELS, DEFAULT_MODEL_PARAMS, DEFAULT_SEARCH_PARAMS,
+    DEFAULT_KNOWLEDGE_BASE, initialize
+)
+from core.embeddings import EmbeddingBatcher
+from core.ingest import find_documents
+from core.knowledge_base import (
+    list_knowledge_bases, knowledge_base_settings, validate_knowledge_bases, search_knowledge_bases
+)
+from core.memory import ConversationMemory
+from core.metrics import metrics, trace, span
+from core.resources import (
+    get_vector_store, get_vector_stores, get_chat_manager, get_embedding_provider, get_reranker, get_job_queue
+)
+from core.logger import logger, log_error, set_chat_session
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """启动时打开共享资源，并创建查询向量的微批处理器"""
+    initialize()
+    vector_store = await asyncio.to_thread(get_vector_store)
+    await asyncio.to_thread(get_chat_manager)
+    app.state.batcher = EmbeddingBatcher(
+        get_embedding_provider(),
+        window=API_SETTINGS["embedding_batch_window"],
+        max_batch=API_SETTINGS["embedding_max_batch"]
+    )
+    files = await asyncio.to_thread(vector_store.get_all_files)
+    logger.info(f"API 服务已启动，已存储文件 {len(files)} 个")
+    yield
+
+app = FastAPI(title="智能文档问答系统 API", lifespan=lifespan)
+
+class SearchRequest(BaseModel):
+    query: str
+    n_results: int = DEFAULT_SEARCH_PARAMS["n_results"]
+    mode: str = DEFAULT_SEARCH_PARAMS["mode"]
+    similarity_threshold: Optional[float] = DEFAULT_SEARCH_PARAMS["similarity_threshold"]
+    knowledge_bases: List[str] = DEFAULT_SEARCH_PARAMS["knowledge_bases"]
+    rerank: bool = DEFAULT_SEARCH_PARAMS["rerank"]
+
+class ChatRequest(SearchRequest):
+    """对话请求；history 为此前的对话消息（role 为 user/assistant），由客户端保存；
+    session_id 用于在对话日志中区分会话"""
+    model: str = DEFAULT_MODEL
+    model_params: Dict[str, Any] = {}
+    use_knowledge_base: bool = True
+    history: List[Dict[str, str]] = []
+    session_id: Optional[str] = None
+
+class IngestRequest(BaseModel):
+    paths: List[str] = []
+    directory: Optional[str] = None
+    recursive: bool = True
+    knowledge_base: str = DEFAULT_KNOWLEDGE_BASE
+
+def _knowledge_base(name: str) -> Dict[str, Any]:
+    """知识库配置，名称无效时返回 400"""
+    try:
+        return knowledge_base_settings(name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _check_ingest_token(api_key: Optional[str]):
+    """设置了 ingest_token 时校验 X-API-Key（入库与删除文档），不符时返回 401"""
+    token = API_SETTINGS["ingest_token"]
+    if token and api_key != token:
+        raise HTTPException(status_code=401, detail="缺少或错误的 X-API-Key")
+
+async def _search(request: SearchRequest) -> List[Dict[str, Any]]:
+    """合并计算查询向量后在线程池中检索（多个知识库并行检索）"""
+    stores = await asyncio.to_thread(get_vector_stores, validate_knowledge_bases(request.knowledge_bases))
+    query_embeddings = {}
+    batcher = app.state.batcher
+    # 微批处理器使用默认嵌入模型，只有使用相同模型的知识库能复用其查询向量
+    if request.mode != "keyword" and any(
+        store.embedding_provider.model_name == batcher.provider.model_name for store in stores.values()
+    ):
+        with span("query_embedding"):
+            query_embeddings[batcher.provider.model_name] = await batcher.embed(request.query)
+    return await asyncio.to_thread(
+        search_knowledge_bases,
+        stores,
+        request.query,
+        request.n_results,
+        request.mode,
+        request.similarity_threshold,
+        query_embeddings,
+        get_reranker() if request.rerank else None
+    )
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+@app.get("/knowledge_bases")
+async def knowledge_bases():
+    return {
+        "knowledge_bases": [
+            {key: knowledge_base_settings(name)[key] for key in ("name", "title", "chunking")}
+            for name in list_knowledge_bases()
+        ],
+        "default": DEFAULT_KNOWLEDGE_BASE
+    }
+
+@app.post("/search")
+async def search(request: SearchRequest):
+    try:
+        with trace("search", mode=request.mode, source="api"):
+            return {"documents": await _search(request)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/chat")
+async def chat(request: ChatRequest):
+    """流式对话，以 SSE 返回：token 事件逐段返回回答，done 事件返回引用的文档"""
+    if request.model not in AVAILABLE_MODELS:
+        raise HTTPException(status_code=400, detail=f"不支持的模型: {request.model}")
+    try:
+        validate_knowledge_bases(request.knowledge_bases)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    params = {**DEFAULT_MODEL_PARAMS, **request.model_params}
+    memory = ConversationMemory.from_messages(request.history)
+
+    async def events():
+        set_chat_session(request.session_id)
+        with trace("chat", model=request.model, source="api") as record:
+            try:
+                relevant_docs = await _search(request) if request.use_knowledge_base else None
+                async for token in get_chat_manager().achat(
+                    request.query,
+                    relevant_docs,
+                    model_name=request.model,
+                    model_params=params,
+                    memory=memory
+                ):
+                    yield f"event: token\ndata: {json.dumps({'token': token}, ensure_ascii=False)}\n\n"
+                sources = [
+                    {
+                        "knowledge_base": doc['metadata'].get('knowledge_base'),
+                        "filename": doc['metadata']['filename'],
+                        "chunk_id": doc['metadata'].get('chunk_id')
+                    }
+                    for doc in relevant_docs or []
+                ]
+                yield f"event: done\ndata: {json.dumps({'documents': sources}, ensure_ascii=False)}\n\n"
+            except asyncio.CancelledError:
+                # 客户端断开连接，achat 会关闭与 Ollama 的流
+                raise
+            except Exception as e:
+                log_error(e, "API 对话失败")
+                record.set(error=str(e))
+                yield f"event: error\ndata: {json.dumps({'error': str(e)}, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.get("/documents")
+async def list_documents(knowledge_base: str = DEFAULT_KNOWLEDGE_BASE):
+    _knowledge_base(knowledge_base)
+    vector_store = await asyncio.to_thread(get_vector_store, knowledge_base)
+    return {"knowledge_base": knowledge_base, "files": await asyncio.to_thread(vector_store.get_all_files)}
+
+@app.delete("/documents/{filename}")
+async def delete_document(filename: str, knowledge_base: str = DEFAULT_KNOWLEDGE_BASE,
+                          x_api_key: Optional[str] = Header(None)):
+    _check_ingest_token(x_api_key)
+    _knowledge_base(knowledge_base)
+    vector_store = await asyncio.to_thread(get_vector_store, knowledge_base)
+    await asyncio.to_thread(vector_store.delete_documents, filename)
+    return {"knowledge_base": knowledge_base, "deleted": filename}
+
+def _ingest_path(path: str) -> Path:
+    """解析入库路径（相对路径以 ingest_root 为基准），不在 ingest_root 下时返回 403"""
+    root = Path(API_SETTINGS["ingest_root"]).resolve()
+    resolved = (root / path).resolve()
+    if not resolved.is_relative_to(root):
+        raise HTTPException(status_code=403, detail=f"只能入库 {root} 下的文件: {path}")
+    return resolved
+
+@app.post("/ingest")
+async def ingest(request: IngestRequest, x_api_key: Optional[str] = Header(None)):
+    """把 ingest_root 下的文件或目录提交到后台入库任务队列，立即返回任务 ID
+
+    同一文件已在排队或执行相同内容时合并到已有任务，不会重复入库。
+    """
+    _check_ingest_token(x_api_key)
+    _knowledge_base(request.knowledge_base)
+    if request.directory:
+        directory = _ingest_path(request.directory)
+        if not directory.is_dir():
+            raise HTTPException(status_code=400, detail=f"目录不存在: {request.directory}")
+        paths = await asyncio.to_thread(find_documents, directory, request.recursive)
+    elif request.paths:
+        paths = [_ingest_path(p) for p in request.paths]
+        missing = [str(path) for path in paths if not path.is_file()]
+        if missing:
+            raise HTTPException(status_code=400, detail=f"文件不存在: {', '.join(missing)}")
+    else:
+        raise HTTPException(status_code=400, detail="需要提供 paths 或 directory")
+    queue = await asyncio.to_thread(get_job_queue)
+    jobs = await asyncio.to_thread(queue.submit_many, paths, request.knowledge_base)
+    return {
+        "knowledge_base": request.knowledge_base,
+        "jobs": [
+            {"id": job["id"], "filename": job["filename"], "status": job["status"],
+             "deduplicated": job["deduplicated"]}
+            for job in jobs
+        ]
+    }
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: int):
+    """查询入库任务的状态与结果"""
+    job = await asyncio.to_thread(lambda: get_job_queue().get(job_id))
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务不存在: {job_id}")
+    return job
+
+@app.get("/stats")
+async def stats():
+    vector_store = await asyncio.to_thread(get_vector_store)
+    return {
+        "embedding": vector_store.embedding_provider.stats(),
+        "embedding_batcher": app.state.batcher.stats(),
+        "retrieval_cache": vector_store.retrieval_cache.stats() if vector_store.retrieval_cache else None,
+        "latency": metrics.summary()
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus 文本格式的延迟与吞吐指标"""
+    return PlainTextResponse(metrics.to_prometheus(), media_type="text/plain; version=0.0.4")
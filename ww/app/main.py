@@ -1,45 +1,56 @@
 import streamlit as st
-from pathlib import Path
-import shutil
 import sys
 import os
 
 # 添加项目根目录到Python路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from core.document_loader import DocumentLoader
-from core.vector_store import VectorStore
-from core.chat import ChatManager
+from core.resources import (
+    get_vector_store, get_vector_stores, get_chat_manager, get_model_manager, get_reranker, get_job_queue
+)
+from core.knowledge_base import (
+    list_knowledge_bases, knowledge_base_settings, knowledge_base_title, search_knowledge_bases
+)
+from core.memory import ConversationMemory
+from core.metrics import metrics, trace
+from core.streaming import StreamBuffer
 from core.config import (
-    DOCUMENTS_DIR, DEFAULT_MODEL, AVAILABLE_MODELS,
-    DEFAULT_MODEL_PARAMS, DEFAULT_UI_CONFIG, DEFAULT_SEARCH_PARAMS
+    DEFAULT_MODEL, AVAILABLE_MODELS,
+    DEFAULT_MODEL_PARAMS, DEFAULT_UI_CONFIG, DEFAULT_SEARCH_PARAMS, DEFAULT_KNOWLEDGE_BASE, RERANK_SETTINGS,
+    JOB_QUEUE_SETTINGS, initialize
 )
-from core.logger import logger, log_error, setup_chat_logger
+from core.logger import logger, log_error, setup_chat_logger, set_chat_session
 
-# 确保文档目录存在
-DOCUMENTS_DIR.mkdir(parents=True, exist_ok=True)
+# 加载 .env 并确保数据目录存在（每个进程只执行一次）
+initialize()
 
 # 初始化会话状态
 if "messages" not in st.session_state:
     st.session_state.messages = []
-    st.session_state.log_file = setup_chat_logger()
+    st.session_state.chat_session_id = setup_chat_logger()
     st.session_state.model_params = DEFAULT_MODEL_PARAMS.copy()
     st.session_state.ui_config = DEFAULT_UI_CONFIG.copy()
     st.session_state.search_params = DEFAULT_SEARCH_PARAMS.copy()
+    st.session_state.managed_knowledge_base = DEFAULT_KNOWLEDGE_BASE
     st.session_state.current_model = DEFAULT_MODEL
+    st.session_state.serving_model = DEFAULT_MODEL
+    st.session_state.memory = ConversationMemory()
 
-# 初始化组件
-document_loader = DocumentLoader()
-vector_store = VectorStore()
-chat_manager = ChatManager(
-    model_name=st.session_state.current_model,
-    model_params=st.session_state.model_params
-)
+# 本次运行中的对话记录归属于当前会话
+set_chat_session(st.session_state.chat_session_id)
+
+# 获取进程内共享的组件（只在进程首次运行时创建）
+chat_manager = get_chat_manager()
+model_manager = get_model_manager()
+job_queue = get_job_queue()
+knowledge_bases = list_knowledge_bases()
 
-def save_uploaded_file(uploaded_file):
-    """保存上传的文件"""
+def save_uploaded_file(uploaded_file, knowledge_base: str = DEFAULT_KNOWLEDGE_BASE):
+    """保存上传的文件到知识库的文档目录"""
     try:
-        file_path = DOCUMENTS_DIR / uploaded_file.name
+        documents_dir = knowledge_base_settings(knowledge_base)["documents_dir"]
+        documents_dir.mkdir(parents=True, exist_ok=True)
+        file_path = documents_dir / uploaded_file.name
         if file_path.exists():
             file_path.unlink()
         with open(file_path, "wb") as f:
@@ -50,23 +61,66 @@ def save_uploaded_file(uploaded_file):
         log_error(e, f"保存文件失败: {uploaded_file.name}")
         raise
 
-def process_file(file_path: Path):
-    """处理文件并添加到向量存储"""
-    try:
-        documents = document_loader.load_document(file_path)
-        vector_store.add_documents(documents)
-        return True
-    except Exception as e:
-        log_error(e, f"处理文件失败: {file_path}")
-        return False
+def submit_files(uploaded_files, knowledge_base: str = DEFAULT_KNOWLEDGE_BASE):
+    """保存上传的文件并提交后台入库任务，返回（新提交数, 已在队列中的文件数, 失败的文件名）"""
+    submitted, deduplicated, failed = 0, 0, []
+    for uploaded_file in uploaded_files:
+        try:
+            job = job_queue.submit(save_uploaded_file(uploaded_file, knowledge_base), knowledge_base)
+        except Exception as e:
+            log_error(e, f"提交入库任务失败: {uploaded_file.name}")
+            failed.append(uploaded_file.name)
+            continue
+        if job["deduplicated"]:
+            deduplicated += 1
+        else:
+            submitted += 1
+    return submitted, deduplicated, failed
 
-def delete_file(filename: str):
-    """删除文件及其向量存储"""
+def render_job_status(knowledge_base: str):
+    """知识库入库任务的数量、进度与失败原因"""
+    counts = job_queue.counts(knowledge_base)
+    active = counts["pending"] + counts["running"]
+    st.subheader("入库任务")
+    if any(counts.values()):
+        col1, col2, col3 = st.columns(3)
+        col1.metric("排队", counts["pending"])
+        col2.metric("执行中", counts["running"])
+        col3.metric("失败", counts["failed"])
+        for job in job_queue.list_jobs(knowledge_base, ["running"], limit=10):
+            st.progress(job["progress"], text=f"{job['filename']}：{job['stage'] or ''}")
+        for job in job_queue.list_jobs(knowledge_base, ["failed"], limit=10):
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                st.caption(f"{job['filename']}：{job['error']}")
+            with col2:
+                if st.button("重试", key=f"retry_job_{job['id']}"):
+                    job_queue.retry(job["id"])
+                    st.rerun()
+        if _fragment is None and active:
+            st.button("刷新任务状态", key=f"refresh_jobs_{knowledge_base}")
+    else:
+        st.caption("没有入库任务")
+
+    # 任务全部结束时重新运行整个页面，更新已存储的文件列表
+    done_key = f"jobs_done_{knowledge_base}"
+    previous_done = st.session_state.get(done_key)
+    st.session_state[done_key] = counts["done"]
+    if previous_done is not None and previous_done != counts["done"] and not active:
+        st.rerun()
+
+# Streamlit 支持 fragment 时只定期重新运行任务状态部分，旧版本时手动刷新
+_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+if _fragment is not None:
+    render_job_status = _fragment(run_every=JOB_QUEUE_SETTINGS["ui_refresh_interval"])(render_job_status)
+
+def delete_file(filename: str, knowledge_base: str = DEFAULT_KNOWLEDGE_BASE):
+    """删除知识库中的文件及其向量存储"""
     try:
-        file_path = DOCUMENTS_DIR / filename
+        file_path = knowledge_base_settings(knowledge_base)["documents_dir"] / filename
         if file_path.exists():
             file_path.unlink()
-        vector_store.delete_documents(filename)
+        get_vector_store(knowledge_base).delete_documents(filename)
         return True
     except Exception as e:
         log_error(e, f"删除文件失败: {filename}")
@@ -79,10 +133,20 @@ st.title("智能文档问答系统")
 # 创建侧边栏
 with st.sidebar:
     # 设置选项卡
-    tab1, tab2 = st.tabs(["文件管理", "系统设置"])
+    tab1, tab2, tab3 = st.tabs(["文件管理", "系统设置", "性能"])
     
     with tab1:
         st.header("文件管理")
+
+        # 上传、列出和删除的文件都属于所选知识库
+        managed_knowledge_base = st.selectbox(
+            "知识库",
+            knowledge_bases,
+            index=knowledge_bases.index(st.session_state.managed_knowledge_base)
+            if st.session_state.managed_knowledge_base in knowledge_bases else 0,
+            format_func=knowledge_base_title
+        )
+        st.session_state.managed_knowledge_base = managed_knowledge_base
         
         # 文件上传
         uploaded_files = st.file_uploader(
@@ -91,27 +155,30 @@ with st.sidebar:
             accept_multiple_files=True
         )
         
+        # 文件保存后提交到后台入库任务队列，立即返回；进度见下方“入库任务”
         if uploaded_files:
-            for uploaded_file in uploaded_files:
-                if st.button(f"处理 {uploaded_file.name}"):
-                    with st.spinner(f"正在处理 {uploaded_file.name}..."):
-                        file_path = save_uploaded_file(uploaded_file)
-                        if process_file(file_path):
-                            st.success(f"{uploaded_file.name} 处理成功！")
-                        else:
-                            st.error(f"{uploaded_file.name} 处理失败！")
+            if st.button(f"处理上传的 {len(uploaded_files)} 个文件", key=f"process_{managed_knowledge_base}"):
+                submitted, deduplicated, failed = submit_files(uploaded_files, managed_knowledge_base)
+                message = f"已提交 {submitted} 个入库任务"
+                if deduplicated:
+                    message += f"，{deduplicated} 个文件已在队列中"
+                st.success(message)
+                if failed:
+                    st.error(f"提交失败：{', '.join(failed)}")
+
+        render_job_status(managed_knowledge_base)
         
         # 显示已存储的文件
         st.subheader("已存储的文件")
-        stored_files = vector_store.get_all_files()
+        stored_files = get_vector_store(managed_knowledge_base).get_all_files()
         if stored_files:
             for filename in stored_files:
                 col1, col2 = st.columns([3, 1])
                 with col1:
                     st.write(filename)
                 with col2:
-                    if st.button("删除", key=f"delete_{filename}"):
-                        if delete_file(filename):
+                    if st.button("删除", key=f"delete_{managed_knowledge_base}_{filename}"):
+                        if delete_file(filename, managed_knowledge_base):
                             st.success(f"{filename} 删除成功！")
                             st.rerun()
                         else:
@@ -130,8 +197,34 @@ with st.sidebar:
         
         if selected_model != st.session_state.current_model:
             st.session_state.current_model = selected_model
-            chat_manager.update_model(selected_model, st.session_state.model_params)
+            # 在后台预热新模型，加载完成前由原模型继续回答
+            model_manager.warm(selected_model)
+            logger.info(f"会话模型已更新: {selected_model}")
             st.success(f"模型已更新为: {selected_model}")
+
+        model_status = model_manager.status(st.session_state.current_model)
+        if model_status == "loading":
+            st.info(f"{st.session_state.current_model} 正在加载，加载完成前由 {st.session_state.serving_model} 回答")
+        elif model_status == "failed":
+            st.error(f"{st.session_state.current_model} 加载失败")
+
+        with st.expander("驻留模型"):
+            resident_models = model_manager.resident_models()
+            if resident_models:
+                for model_info in resident_models:
+                    if model_info.get("status") == "loading":
+                        st.write(f"{model_info['name']}：加载中")
+                        continue
+                    size_gb = (model_info.get("size") or 0) / 1024 ** 3
+                    vram_gb = (model_info.get("size_vram") or 0) / 1024 ** 3
+                    load_seconds = model_info.get("load_seconds")
+                    st.write(
+                        f"{model_info['name']}：内存 {size_gb:.1f}GB（显存 {vram_gb:.1f}GB），"
+                        f"加载耗时 {f'{load_seconds}s' if load_seconds is not None else '未知'}，"
+                        f"保活 {model_info['keep_alive']}"
+                    )
+            else:
+                st.write("当前没有驻留的模型")
         
         # 模型参数设置
         st.subheader("模型参数")
@@ -176,7 +269,7 @@ with st.sidebar:
         }
         if new_params != st.session_state.model_params:
             st.session_state.model_params = new_params
-            chat_manager.update_model(st.session_state.current_model, new_params)
+            logger.info(f"会话模型参数已更新: {new_params}")
             st.success("模型参数已更新")
         
         # 界面设置
@@ -192,6 +285,20 @@ with st.sidebar:
         
         # 检索设置
         st.subheader("检索设置")
+        search_modes = {"hybrid": "混合检索", "vector": "向量检索", "keyword": "关键词检索"}
+        st.session_state.search_params["knowledge_bases"] = st.multiselect(
+            "检索的知识库",
+            knowledge_bases,
+            default=[name for name in st.session_state.search_params["knowledge_bases"] if name in knowledge_bases],
+            format_func=knowledge_base_title,
+            help="选择多个知识库时并行检索，按相关度合并结果"
+        )
+        st.session_state.search_params["mode"] = st.selectbox(
+            "检索模式",
+            list(search_modes),
+            index=list(search_modes).index(st.session_state.search_params["mode"]),
+            format_func=search_modes.get
+        )
         st.session_state.search_params["n_results"] = st.slider(
             "检索结果数量",
             min_value=1,
@@ -205,6 +312,59 @@ with st.sidebar:
             value=st.session_state.search_params["similarity_threshold"],
             step=0.1
         )
+        st.session_state.search_params["rerank"] = st.checkbox(
+            "重排序",
+            value=st.session_state.search_params["rerank"],
+            help=f"先取 {RERANK_SETTINGS['candidates']} 个候选，重新打分后只保留上面设置的数量；"
+                 f"超过 {RERANK_SETTINGS['timeout']} 秒时按原检索顺序返回"
+        )
+
+        # 嵌入模型与缓存
+        st.subheader("嵌入模型")
+        embedding_stats = get_vector_store(managed_knowledge_base).embedding_provider.stats()
+        st.caption(f"模型: {embedding_stats['model']}")
+        if "cache_hit_rate" in embedding_stats:
+            st.metric(
+                "向量缓存命中率",
+                f"{embedding_stats['cache_hit_rate']:.1%}",
+                help=f"命中 {embedding_stats['cache_hits']} / 未命中 {embedding_stats['cache_misses']}"
+            )
+
+    with tab3:
+        st.header("性能")
+        latency = metrics.summary()
+        if latency:
+            rows = []
+            for name, stat in sorted(latency.items()):
+                unit = "token/s" if name.startswith("decode_tokens_per_second") else "s"
+                rows.append({
+                    "指标": name,
+                    "次数": stat["count"],
+                    "p50": f"{stat['p50']:.3f} {unit}",
+                    "p95": f"{stat['p95']:.3f} {unit}",
+                    "均值": f"{stat['mean']:.3f} {unit}"
+                })
+            st.dataframe(rows, hide_index=True, use_container_width=True)
+
+            st.subheader("最近请求")
+            for record in metrics.recent_traces()[:10]:
+                generation = record.get("generation", {})
+                title = f"{record['started_at'][11:19]} {record.get('model', '')} 总耗时 {record['duration']:.2f}s"
+                if record.get("answer_cached"):
+                    title += "（缓存）"
+                with st.expander(title):
+                    for item in record["spans"]:
+                        st.write(f"{item['name']}：{item['duration'] * 1000:.0f}ms")
+                    if generation.get("ttft_seconds") is not None:
+                        st.write(f"首个 token：{generation['ttft_seconds'] * 1000:.0f}ms")
+                    if "tokens_per_second" in generation:
+                        st.write(
+                            f"生成 {generation['eval_count']} token，{generation['tokens_per_second']} token/s；"
+                            f"提示词 {generation['prompt_eval_count']} token，"
+                            f"处理 {generation['prompt_eval_seconds'] * 1000:.0f}ms"
+                        )
+        else:
+            st.write("还没有请求记录")
 
 # 主界面
 st.header("对话")
@@ -221,31 +381,53 @@ if prompt := st.chat_input("请输入您的问题"):
     with st.chat_message("user"):
         st.markdown(prompt)
     
-    # 搜索相关文档
-    relevant_docs = None
-    if st.session_state.ui_config["enable_knowledge_base"]:
-        relevant_docs = vector_store.search(
-            prompt,
-            n_results=st.session_state.search_params["n_results"]
-        )
-    
-    # 生成响应
-    with st.chat_message("assistant"):
-        message_placeholder = st.empty()
-        full_response = ""
-        
-        # 流式输出响应
-        for chunk in chat_manager.chat(prompt, relevant_docs):
-            full_response += chunk
-            message_placeholder.markdown(full_response + "▌")
-        
-        message_placeholder.markdown(full_response)
-        st.session_state.messages.append({"role": "assistant", "content": full_response})
+    # 新选择的模型未就绪时由原模型回答
+    st.session_state.serving_model = model_manager.serving_model(
+        st.session_state.current_model,
+        st.session_state.serving_model
+    )
+
+    # 检索与生成记录为一次请求的追踪（各阶段耗时见侧边栏“性能”）
+    with trace("chat", model=st.session_state.serving_model, source="ui"):
+        # 搜索相关文档
+        relevant_docs = None
+        if st.session_state.ui_config["enable_knowledge_base"] and st.session_state.search_params["knowledge_bases"]:
+            relevant_docs = search_knowledge_bases(
+                get_vector_stores(st.session_state.search_params["knowledge_bases"]),
+                prompt,
+                n_results=st.session_state.search_params["n_results"],
+                mode=st.session_state.search_params["mode"],
+                similarity_threshold=st.session_state.search_params["similarity_threshold"],
+                reranker=get_reranker() if st.session_state.search_params["rerank"] else None
+            )
+
+        # 生成响应
+        with st.chat_message("assistant"):
+            message_placeholder = st.empty()
+            buffer = StreamBuffer()
+            
+            # 流式输出响应（按时间或片段数合并后刷新，避免每个 token 都重新渲染整个回答）
+            for chunk in chat_manager.chat(
+                prompt,
+                relevant_docs,
+                model_name=st.session_state.serving_model,
+                model_params=st.session_state.model_params,
+                memory=st.session_state.memory
+            ):
+                if buffer.append(chunk):
+                    message_placeholder.markdown(buffer.flush() + "▌")
+            
+            full_response = buffer.flush()
+            message_placeholder.markdown(full_response)
+            st.session_state.messages.append({"role": "assistant", "content": full_response})
     
     # 显示相关文档
     if relevant_docs and st.session_state.ui_config["show_relevant_docs"]:
         with st.expander("查看相关文档"):
             for doc in relevant_docs:
-                st.markdown(f"**文档：{doc['metadata']['filename']}**")
+                source = doc['metadata']['filename']
+                if len(knowledge_bases) > 1:
+                    source += f"（{knowledge_base_title(doc['metadata'].get('knowledge_base', DEFAULT_KNOWLEDGE_BASE))}）"
+                st.markdown(f"**文档：{source}**")
                 st.markdown(doc['content'])
                 st.markdown("---") 
\ No newline at end of file
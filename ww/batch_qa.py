@@ -0,0 +1,72 @@
+"""
+批量问答命令行
+
+从 JSONL 读取问题（每行 {"id": ..., "question": ...}），分批检索后并发生成回答，
+结果逐条追加写入输出 JSONL（含各阶段耗时）。中断后用相同参数重新运行即从未完成的问题继续。
+
+用法: python batch_qa.py questions.jsonl answers.jsonl [--model 模型] [--knowledge-bases 名称 ...]
+      [--mode hybrid] [--n-results 5] [--rerank] [--no-knowledge-base] [--concurrency 4] [--batch-size 32] [--restart]
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent
+sys.path.append(str(project_root))
+
+from core.config import (
+    DEFAULT_MODEL, DEFAULT_SEARCH_PARAMS, BATCH_QA_SETTINGS, initialize
+)
+from core.batch_qa import BatchQARunner, run_batch
+from core.knowledge_base import list_knowledge_bases
+from core.logger import logger, setup_chat_logger, set_chat_session
+from core.resources import get_chat_manager, get_vector_stores, get_reranker
+from core.vector_store import SEARCH_MODES
+
+def main():
+    parser = argparse.ArgumentParser(description="批量问答")
+    parser.add_argument("input", type=Path, help="问题文件（JSONL）")
+    parser.add_argument("output", type=Path, help="结果文件（JSONL，追加写入）")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--knowledge-bases", nargs="+", default=DEFAULT_SEARCH_PARAMS["knowledge_bases"],
+                        choices=list_knowledge_bases(), help="检索的知识库")
+    parser.add_argument("--no-knowledge-base", action="store_true", help="不检索，直接回答")
+    parser.add_argument("--mode", default=DEFAULT_SEARCH_PARAMS["mode"], choices=SEARCH_MODES)
+    parser.add_argument("--n-results", type=int, default=DEFAULT_SEARCH_PARAMS["n_results"])
+    parser.add_argument("--similarity-threshold", type=float, default=DEFAULT_SEARCH_PARAMS["similarity_threshold"])
+    parser.add_argument("--rerank", action="store_true", help="多取候选后重排序")
+    parser.add_argument("--model-params", type=json.loads, default={}, help="模型参数（JSON），如 '{\"temperature\": 0}'")
+    parser.add_argument("--concurrency", type=int, default=BATCH_QA_SETTINGS["concurrency"], help="同时生成的问题数")
+    parser.add_argument("--batch-size", type=int, default=BATCH_QA_SETTINGS["retrieval_batch_size"],
+                        help="每批检索的问题数")
+    parser.add_argument("--restart", action="store_true", help="删除已有的结果文件，从头开始")
+    args = parser.parse_args()
+    initialize()
+    set_chat_session(setup_chat_logger())
+
+    runner = BatchQARunner(
+        get_chat_manager(),
+        {} if args.no_knowledge_base else get_vector_stores(args.knowledge_bases),
+        model=args.model,
+        model_params=args.model_params,
+        search_params={
+            "mode": args.mode,
+            "n_results": args.n_results,
+            "similarity_threshold": args.similarity_threshold
+        },
+        reranker=get_reranker() if args.rerank else None,
+        settings={"concurrency": args.concurrency, "retrieval_batch_size": args.batch_size}
+    )
+    summary = run_batch(runner, args.input, args.output, restart=args.restart)
+    logger.info(
+        f"批量问答完成: 成功 {summary['completed']} 个, 失败 {summary['failed']} 个, "
+        f"跳过已完成 {summary['skipped']} 个, 用时 {summary['elapsed']}s, "
+        f"{summary['questions_per_second']} 问/秒, 生成 {summary['eval_tokens_per_second']} token/秒"
+    )
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    return 1 if summary["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+"""
+分块策略基准
+
+用同一批文档比较不同分块配置（见 core/chunking.py）对索引与检索的影响：
+- 块数、平均长度（字符 / 估算 token）、重叠带来的文本膨胀（入库文本量 / 原文长度）
+- 加载与分块耗时、入库后的磁盘占用
+- 命中率：查询取自原文中的句子片段，检索结果（父子分块时为父块）包含该片段即为命中
+- 提示词大小：每次检索返回内容的估算 token 数
+
+默认使用合成语料写成的文本文件，也可用 --directory 指定真实文档目录。
+向量使用 HashEmbeddingProvider，命中率只用于比较各分块配置，不代表实际嵌入模型的效果。
+
+用法: python benchmarks/bench_chunking.py [--directory DIR] [--presets recursive_chars sentence_tokens ...]
+      [--config my_config.json]（JSON 对象：名称 → 分块配置，与 CHUNKING_SETTINGS["default"] 结构相同）
+"""
+import argparse
+import json
+import random
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent.parent))
+
+from benchmarks.common import Timer, parse_size, latency_stats, directory_size, write_result
+from benchmarks.corpus import SyntheticCorpus, HashEmbeddingProvider
+from core.chunking import split_sentences
+from core.config import CHUNKING_SETTINGS
+from core.context import estimate_tokens
+from core.document_loader import DocumentLoader
+from core.ingest import find_documents
+from core.vector_store import VectorStore, SEARCH_MODES
+
+PRESETS = {
+    "recursive_chars": {"strategy": "recursive", "length_unit": "chars", "chunk_size": 1000, "chunk_overlap": 200},
+    "recursive_tokens": {"strategy": "recursive", "length_unit": "tokens", "chunk_size": 400, "chunk_overlap": 40},
+    "sentence_tokens": {"strategy": "sentence", "length_unit": "tokens", "chunk_size": 400, "chunk_overlap": 40},
+    "markdown_tokens": {"strategy": "markdown", "length_unit": "tokens", "chunk_size": 400, "chunk_overlap": 40},
+    "parent_child": {"strategy": "sentence", "length_unit": "tokens", "chunk_size": 128, "chunk_overlap": 0,
+                     "parent_chunk_size": 512}
+}
+
+def load_texts(paths: List[Path]) -> List[str]:
+    """各文档的原文（用不重叠的分块读取后拼接）"""
+    loader = DocumentLoader(chunking={"default": {"chunk_overlap": 0}})
+    return ["".join(doc["content"] for doc in loader.load_document(path)) for path in paths]
+
+def make_queries(texts: List[str], n: int, seed: int, min_chars: int = 8) -> List[str]:
+    """从原文中随机取句子片段作为查询（与分块方式无关）"""
+    rng = random.Random(seed)
+    sentences = []
+    for text in texts:
+        sentences.extend(
+            text[start:end] for start, end in split_sentences(text) if end - start >= min_chars
+        )
+    queries = []
+    for sentence in rng.sample(sentences, min(n, len(sentences))):
+        start = rng.randrange(max(1, len(sentence) - min_chars))
+        queries.append(sentence[start:start + rng.randint(min_chars, max(min_chars, 24))].strip())
+    return queries
+
+def bench_config(name: str, settings: Dict[str, Any], paths: List[Path], source_chars: int,
+                 queries: List[str], provider: HashEmbeddingProvider, workdir: Path,
+                 k: int, mode: str) -> Dict[str, Any]:
+    """用一种分块配置加载、入库并检索"""
+    # 所有文件类型使用同一配置
+    chunking = {"default": {**CHUNKING_SETTINGS["default"], **settings}}
+    chunking.update({file_type: chunking["default"] for file_type in {path.suffix.lower() for path in paths}})
+    loader = DocumentLoader(chunking=chunking)
+    store = VectorStore(persist_directory=str(workdir / name), embedding_provider=provider)
+    store.retrieval_cache = None
+
+    chunks, indexed_chars, indexed_tokens = 0, 0, 0
+    load_seconds, ingest_seconds = 0.0, 0.0
+    for path in paths:
+        with Timer() as load:
+            documents = loader.load_document(path)
+        load_seconds += load.elapsed
+        with Timer() as ingest:
+            plan = store.plan_update(path.name, documents)
+            vectors = provider.embed_array([doc["content"] for doc in plan["add"]])
+            store.apply_update(plan, vectors.tolist())
+        ingest_seconds += ingest.elapsed
+        chunks += len(documents)
+        indexed_chars += sum(len(doc["content"]) for doc in documents)
+        indexed_tokens += sum(estimate_tokens(doc["content"]) for doc in documents)
+
+    timings, hits, context_tokens = [], 0, []
+    for query in queries:
+        with Timer() as timer:
+            documents = store.search(query, n_results=k, mode=mode)
+        timings.append(timer.elapsed)
+        hits += any(query in doc["content"] for doc in documents)
+        context_tokens.append(sum(estimate_tokens(doc["content"]) for doc in documents))
+
+    return {
+        "settings": chunking["default"],
+        "chunks": chunks,
+        "avg_chunk_chars": round(indexed_chars / chunks, 1) if chunks else None,
+        "avg_chunk_tokens": round(indexed_tokens / chunks, 1) if chunks else None,
+        "text_inflation": round(indexed_chars / source_chars, 3) if source_chars else None,
+        "load_seconds": round(load_seconds, 3),
+        "ingest_seconds": round(ingest_seconds, 3),
+        "disk_mb": directory_size(workdir / name),
+        f"hit@{k}": round(hits / len(queries), 4) if queries else None,
+        "avg_context_tokens": round(sum(context_tokens) / len(context_tokens), 1) if context_tokens else None,
+        "search": latency_stats(timings)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="分块策略基准")
+    parser.add_argument("--directory", type=Path, help="文档目录（默认使用合成语料）")
+    parser.add_argument("--size", default="2k", help="合成语料的规模（按 400 字一段计），如 2k")
+    parser.add_argument("--presets", nargs="+", default=list(PRESETS), choices=list(PRESETS))
+    parser.add_argument("--config", type=Path, help="额外的分块配置（JSON 文件：名称 → 配置）")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--mode", default="hybrid", choices=SEARCH_MODES)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="结果 JSON 文件（默认输出到标准输出）")
+    args = parser.parse_args()
+
+    configs = {name: PRESETS[name] for name in args.presets}
+    if args.config:
+        configs.update(json.loads(args.config.read_text(encoding="utf-8")))
+
+    workdir = Path(tempfile.mkdtemp(prefix="bench_chunking_"))
+    try:
+        if args.directory:
+            paths = find_documents(args.directory)
+        else:
+            corpus = SyntheticCorpus(parse_size(args.size), seed=args.seed)
+            paths = corpus.write_files(workdir / "files")
+        texts = load_texts(paths)
+        source_chars = sum(len(text) for text in texts)
+        queries = make_queries(texts, args.queries, args.seed)
+        provider = HashEmbeddingProvider(args.dim)
+        config = {**vars(args), "files": len(paths), "source_chars": source_chars,
+                  "embedding": provider.model_name}
+        results = {
+            name: bench_config(name, settings, paths, source_chars, queries, provider,
+                               workdir / "stores", args.k, args.mode)
+            for name, settings in configs.items()
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    write_result("chunking", config, results, args.output)
+
+if __name__ == "__main__":
+    main()
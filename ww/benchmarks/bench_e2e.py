@@ -0,0 +1,158 @@
+"""
+端到端基准
+
+用合成语料建库，对每个查询执行 检索 → 构建提示词 → 流式生成，测量：
+- 检索耗时、客户端观察到的首 token 耗时（TTFT）与总耗时、生成速度
+- 并发时的整体吞吐（查询/秒）
+- core.metrics 汇总的各阶段指标（含 Ollama 返回的 eval 统计）
+
+默认启动本地 Ollama 替身服务（按设定速度流式返回），也可用 --ollama-url 指向真实服务。
+
+用法: python benchmarks/bench_e2e.py --size 1k --queries 50 [--concurrency 4] [--tokens-per-second 30]
+"""
+import argparse
+import asyncio
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent.parent))
+
+import ollama
+from benchmarks.bench_retrieval import bench_ingest
+from benchmarks.common import Timer, parse_size, latency_stats, memory_usage, write_result
+from benchmarks.corpus import SyntheticCorpus, HashEmbeddingProvider
+from benchmarks.stub_ollama import StubOllamaServer, StubSettings
+from core.chat import ChatManager
+from core.config import DEFAULT_MODEL, METRICS_SETTINGS, CHAT_LOG_SETTINGS
+from core.memory import ConversationMemory
+from core.metrics import metrics, trace
+from core.vector_store import VectorStore, SEARCH_MODES
+
+def run_sequential(chat_manager: ChatManager, store: VectorStore, queries: List[Dict[str, Any]],
+                   args) -> List[Dict[str, Optional[float]]]:
+    """逐个执行查询（与界面中的调用方式相同）"""
+    samples = []
+    for query in queries:
+        with trace("chat", model=args.model, source="benchmark"):
+            start = time.perf_counter()
+            docs = store.search(query["text"], n_results=args.k, mode=args.mode)
+            retrieved = time.perf_counter()
+            first_token, pieces = None, 0
+            for _ in chat_manager.chat(query["text"], docs, model_name=args.model, memory=ConversationMemory()):
+                if first_token is None:
+                    first_token = time.perf_counter()
+                pieces += 1
+            end = time.perf_counter()
+        samples.append(_sample(start, retrieved, first_token, end, pieces))
+    return samples
+
+async def run_concurrent(chat_manager: ChatManager, store: VectorStore, queries: List[Dict[str, Any]],
+                         args) -> List[Dict[str, Optional[float]]]:
+    """以设定的并发数执行查询（与 HTTP API 的调用方式相同）"""
+    limit = asyncio.Semaphore(args.concurrency)
+
+    async def one(query: Dict[str, Any]) -> Dict[str, Optional[float]]:
+        async with limit:
+            with trace("chat", model=args.model, source="benchmark"):
+                start = time.perf_counter()
+                docs = await asyncio.to_thread(store.search, query["text"], args.k, args.mode)
+                retrieved = time.perf_counter()
+                first_token, pieces = None, 0
+                async for _ in chat_manager.achat(query["text"], docs, model_name=args.model,
+                                                  memory=ConversationMemory()):
+                    if first_token is None:
+                        first_token = time.perf_counter()
+                    pieces += 1
+                end = time.perf_counter()
+            return _sample(start, retrieved, first_token, end, pieces)
+
+    return await asyncio.gather(*(one(query) for query in queries))
+
+def _sample(start: float, retrieved: float, first_token: Optional[float],
+            end: float, pieces: int) -> Dict[str, Optional[float]]:
+    decode = end - first_token if first_token is not None else None
+    return {
+        "retrieval": retrieved - start,
+        "ttft": first_token - retrieved if first_token is not None else None,
+        "total": end - start,
+        "pieces": pieces,
+        "pieces_per_second": (pieces - 1) / decode if decode and pieces > 1 else None
+    }
+
+def summarize(samples: List[Dict[str, Optional[float]]], elapsed: float) -> Dict[str, Any]:
+    rates = [sample["pieces_per_second"] for sample in samples if sample["pieces_per_second"]]
+    return {
+        "retrieval": latency_stats([sample["retrieval"] for sample in samples]),
+        "ttft": latency_stats([sample["ttft"] for sample in samples if sample["ttft"] is not None]),
+        "total": latency_stats([sample["total"] for sample in samples]),
+        "client_pieces_per_second": round(sum(rates) / len(rates), 2) if rates else None,
+        "queries_per_second": round(len(samples) / elapsed, 3) if elapsed else None,
+        "seconds": round(elapsed, 3)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端基准（合成语料 + Ollama 替身服务）")
+    parser.add_argument("--size", default="1k", help="语料块数，如 1k、100k、1m")
+    parser.add_argument("--chunks-per-file", type=int, default=100)
+    parser.add_argument("--chunk-chars", type=int, default=400)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--mode", default="hybrid", choices=SEARCH_MODES)
+    parser.add_argument("--concurrency", type=int, default=1, help="并发数，大于 1 时使用 achat")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--ollama-url", help="使用真实的 Ollama 服务（默认启动替身服务）")
+    parser.add_argument("--tokens-per-second", type=float, default=30.0, help="替身服务的生成速度")
+    parser.add_argument("--ttft", type=float, default=0.2, help="替身服务首个 token 前的延迟（秒）")
+    parser.add_argument("--response-tokens", type=int, default=64, help="替身服务每次回答的 token 数")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="结果 JSON 文件（默认输出到标准输出）")
+    args = parser.parse_args()
+
+    n_chunks = parse_size(args.size)
+    corpus = SyntheticCorpus(n_chunks, args.chunks_per_file, args.chunk_chars, args.seed)
+    provider = HashEmbeddingProvider(args.dim)
+    workdir = Path(tempfile.mkdtemp(prefix="bench_e2e_"))
+    # 追踪记录和对话日志写到临时目录，不混入正式日志
+    METRICS_SETTINGS["trace_file"] = workdir / "traces.jsonl"
+    CHAT_LOG_SETTINGS["file"] = workdir / "chat.jsonl"
+    config = {**vars(args), "n_chunks": n_chunks, "embedding": provider.model_name}
+
+    server = None
+    if not args.ollama_url:
+        server = StubOllamaServer(settings=StubSettings(
+            args.tokens_per_second, args.ttft, args.response_tokens
+        )).start()
+    url = args.ollama_url or server.url
+    try:
+        store = VectorStore(persist_directory=str(workdir / "store"), embedding_provider=provider)
+        store.retrieval_cache = None
+        results: Dict[str, Any] = {}
+        results["ingest"], _, _ = bench_ingest(corpus, store, provider)
+
+        chat_manager = ChatManager(args.model, client=ollama.Client(host=url), host=url)
+        queries = corpus.queries(args.queries, seed=args.seed + 1)
+        metrics.reset()
+        with Timer() as timer:
+            if args.concurrency > 1:
+                samples = asyncio.run(run_concurrent(chat_manager, store, queries, args))
+            else:
+                samples = run_sequential(chat_manager, store, queries, args)
+        results["chat"] = summarize(samples, timer.elapsed)
+        results["stages"] = metrics.summary()
+        results["counters"] = metrics.counters()
+        results["memory"] = memory_usage()
+    finally:
+        if server is not None:
+            server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    write_result("e2e", config, results, args.output)
+
+if __name__ == "__main__":
+    main()
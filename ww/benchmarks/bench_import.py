@@ -0,0 +1,115 @@
+"""
+导入耗时基准
+
+在新的子进程中导入指定模块（python -X importtime），统计：
+- 导入的总耗时（多次运行取中位数）与 -X importtime 记录的累计耗时
+- 耗时最多的若干个顶层包（按包内各模块自身的导入耗时汇总）
+- 是否导入了应当按需加载的重量级依赖（chromadb、langchain、pypdf、docx、ollama、httpx、numpy 等）
+
+Streamlit 每次重新运行脚本、API 与命令行每次启动都要付出这部分开销。
+用 benchmarks/compare.py 比较两次结果即可发现退化；--check 时导入了重量级依赖或
+超过 --max-ms 则以非零状态退出，可用于 CI。
+
+用法: python benchmarks/bench_import.py [--modules core.resources api.server] [--repeat 5] [--check]
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import Any, Dict, List
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent.parent))
+
+from benchmarks.common import write_result
+
+PROJECT_ROOT = Path(__file__).parent.parent
+
+DEFAULT_MODULES = [
+    "core.config", "core.document_loader", "core.vector_store", "core.knowledge_base", "core.resources"
+]
+# 只应在首次使用时导入的依赖
+LAZY_MODULES = [
+    "chromadb", "langchain", "langchain_community", "pypdf", "docx", "onnxruntime", "tokenizers",
+    # Ollama 客户端及其 HTTP 栈、numpy 在创建客户端或首次计算时才导入
+    "ollama", "httpx", "numpy"
+]
+
+def parse_importtime(stderr: str) -> List[Dict[str, Any]]:
+    """解析 -X importtime 的输出：每行为 self [us] | cumulative [us] | 模块名"""
+    records = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        records.append({
+            "module": name.strip(),
+            "self_us": int(self_us),
+            "cumulative_us": int(cumulative_us)
+        })
+    return records
+
+def _run(module: str, importtime: bool) -> subprocess.CompletedProcess:
+    code = (
+        "import time, sys; start = time.perf_counter(); "
+        f"import {module}; "
+        "print((time.perf_counter() - start) * 1000); "
+        "print(','.join(sorted(sys.modules)))"
+    )
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", code]
+    result = subprocess.run(command, cwd=PROJECT_ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{result.stderr[-2000:]}")
+    return result
+
+def bench_module(module: str, repeat: int, top: int) -> Dict[str, Any]:
+    """多次在新进程中导入模块，返回耗时与导入的依赖"""
+    timings = [float(_run(module, False).stdout.splitlines()[0]) for _ in range(repeat)]
+
+    result = _run(module, True)
+    loaded = set(result.stdout.splitlines()[1].split(","))
+    records = parse_importtime(result.stderr)
+    # 按顶层包汇总各模块自身的导入耗时（不含子依赖，避免重复计算）
+    packages: Dict[str, int] = {}
+    for record in records:
+        package = record["module"].split(".")[0]
+        packages[package] = packages.get(package, 0) + record["self_us"]
+    heaviest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+
+    return {
+        "wall_ms": round(statistics.median(timings), 2),
+        "wall_min_ms": round(min(timings), 2),
+        "importtime_ms": round(sum(record["self_us"] for record in records) / 1000, 2),
+        "modules_loaded": len(records),
+        # 列表不参与 compare.py 的逐项比较（各次结果中的包可能不同）
+        "heaviest": [[package, round(us / 1000, 2)] for package, us in heaviest],
+        "lazy_modules_loaded": [name for name in LAZY_MODULES if name in loaded]
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="导入耗时基准")
+    parser.add_argument("--modules", nargs="+", default=DEFAULT_MODULES, help="要导入的模块")
+    parser.add_argument("--repeat", type=int, default=5, help="每个模块导入的次数（取中位数）")
+    parser.add_argument("--top", type=int, default=10, help="列出耗时最多的顶层包个数")
+    parser.add_argument("--check", action="store_true", help="导入了重量级依赖或超过 --max-ms 时以非零状态退出")
+    parser.add_argument("--max-ms", type=float, help="--check 时单个模块导入耗时的上限（毫秒）")
+    parser.add_argument("--output", help="结果 JSON 文件（默认输出到标准输出）")
+    args = parser.parse_args()
+
+    results = {module: bench_module(module, args.repeat, args.top) for module in args.modules}
+    write_result("import", vars(args), results, args.output)
+
+    if args.check:
+        failures = []
+        for module, result in results.items():
+            if result["lazy_modules_loaded"]:
+                failures.append(f"{module} 导入了应按需加载的依赖: {', '.join(result['lazy_modules_loaded'])}")
+            if args.max_ms is not None and result["wall_ms"] > args.max_ms:
+                failures.append(f"{module} 导入耗时 {result['wall_ms']}ms 超过上限 {args.max_ms}ms")
+        for failure in failures:
+            print(failure, file=sys.stderr)
+        sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
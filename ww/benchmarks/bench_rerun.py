@@ -0,0 +1,66 @@
+"""
+Streamlit 重新运行开销基准
+
+对比两种初始化方式下每次脚本重新运行的耗时：
+- before: 每次重新运行都新建 DocumentLoader / VectorStore / ChatManager
+- after:  通过 core.resources 获取进程内共享实例
+
+用法: python benchmarks/bench_rerun.py [--runs 20]
+"""
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent.parent))
+
+from core.document_loader import DocumentLoader
+from core.vector_store import VectorStore
+from core.chat import ChatManager
+from core import resources
+
+def rerun_before():
+    """模拟旧版 app/main.py 的模块级初始化"""
+    DocumentLoader()
+    VectorStore()
+    ChatManager()
+
+def rerun_after():
+    """模拟使用共享资源后的模块级初始化"""
+    resources.get_document_loader()
+    resources.get_vector_store()
+    resources.get_chat_manager()
+
+def measure(func, runs: int) -> dict:
+    """执行多次并统计耗时（毫秒）"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "mean_ms": round(statistics.mean(timings), 3),
+        "p50_ms": round(timings[len(timings) // 2], 3),
+        "max_ms": round(timings[-1], 3),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Streamlit 重新运行开销基准")
+    parser.add_argument("--runs", type=int, default=20, help="模拟的重新运行次数")
+    args = parser.parse_args()
+
+    before = measure(rerun_before, args.runs)
+    resources.reset_resources()
+    after = measure(rerun_after, args.runs)
+
+    print(f"{'mode':<8}{'mean(ms)':>12}{'p50(ms)':>12}{'max(ms)':>12}")
+    for name, stats in (("before", before), ("after", after)):
+        print(f"{name:<8}{stats['mean_ms']:>12}{stats['p50_ms']:>12}{stats['max_ms']:>12}")
+    if after["mean_ms"] > 0:
+        print(f"speedup: {before['mean_ms'] / after['mean_ms']:.1f}x")
+
+if __name__ == "__main__":
+    main()
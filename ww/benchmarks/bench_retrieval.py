@@ -0,0 +1,183 @@
+"""
+检索基准
+
+在临时目录中用合成语料建库，测量：
+- 文档加载（DocumentLoader）与入库（VectorStore.plan_update/apply_update）的吞吐
+- 各检索模式下 search() 的 p50/p99 延迟（关闭检索缓存）
+- 向量检索相对暴力检索的 recall@k，以及各模式命中查询来源块的比例
+- 内存与磁盘占用
+- get_all_files / delete_documents 的耗时
+
+--backend mmap 测试内存映射的量化索引（core/mmap_index.py），可与默认的 chroma 后端比较
+召回率、延迟与内存（两次运行分别输出结果后用 compare.py 比较）。
+
+用法: python benchmarks/bench_retrieval.py --size 100k [--queries 200] [--k 5] [--output result.json]
+      [--backend mmap --mmap-dtype int8 --nlist 1024 --nprobe 16]
+"""
+import argparse
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+import numpy as np
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent.parent))
+
+from benchmarks.common import (
+    Timer, parse_size, latency_stats, memory_usage, directory_size, write_result
+)
+from benchmarks.corpus import SyntheticCorpus, HashEmbeddingProvider, brute_force_top_k
+from core.config import VECTOR_BACKENDS, MMAP_INDEX_SETTINGS
+from core.document_loader import DocumentLoader
+from core.vector_store import VectorStore, SEARCH_MODES
+
+def bench_loader(corpus: SyntheticCorpus, directory: Path, max_files: int) -> Dict[str, Any]:
+    """文档加载与分块的吞吐"""
+    paths = corpus.write_files(directory, max_files)
+    loader = DocumentLoader()
+    chunks = 0
+    with Timer() as timer:
+        for path in paths:
+            chunks += len(loader.load_document(path))
+    size_mb = sum(path.stat().st_size for path in paths) / 1024 ** 2
+    return {
+        "files": len(paths),
+        "chunks": chunks,
+        "seconds": round(timer.elapsed, 3),
+        "chunks_per_second": round(chunks / timer.elapsed, 1) if timer.elapsed else None,
+        "mb_per_second": round(size_mb / timer.elapsed, 2) if timer.elapsed else None
+    }
+
+def bench_ingest(corpus: SyntheticCorpus, store: VectorStore,
+                 provider: HashEmbeddingProvider) -> Tuple[Dict[str, Any], np.ndarray, List[str]]:
+    """入库吞吐；同时返回全部向量与块ID，用于计算暴力检索基准"""
+    embeddings = np.zeros((corpus.n_chunks, provider.dim), dtype=np.float32)
+    ids: List[str] = []
+    embed_seconds = 0.0
+    with Timer() as total:
+        for filename, documents in corpus.iter_files():
+            plan = store.plan_update(filename, documents)
+            with Timer() as embed:
+                vectors = provider.embed_array([doc["content"] for doc in plan["add"]])
+            embed_seconds += embed.elapsed
+            embeddings[len(ids):len(ids) + len(vectors)] = vectors
+            ids.extend(doc["id"] for doc in plan["add"])
+            store.apply_update(plan, vectors.tolist())
+    return {
+        "chunks": len(ids),
+        "seconds": round(total.elapsed, 3),
+        "embed_seconds": round(embed_seconds, 3),
+        "chunks_per_second": round(len(ids) / total.elapsed, 1) if total.elapsed else None,
+        "store_chunks_per_second": round(len(ids) / (total.elapsed - embed_seconds), 1)
+        if total.elapsed > embed_seconds else None
+    }, embeddings[:len(ids)], ids
+
+def bench_search(store: VectorStore, provider: HashEmbeddingProvider, queries: List[Dict[str, Any]],
+                 source_ids: List[str], ground_truth: List[List[str]], k: int,
+                 modes: List[str]) -> Dict[str, Any]:
+    """各检索模式的延迟、recall@k 与来源命中率"""
+    query_embeddings = provider.embed_array([query["text"] for query in queries])
+    results = {}
+    for mode in modes:
+        timings, recalls, source_hits = [], [], 0
+        for query, embedding, truth, source_id in zip(queries, query_embeddings, ground_truth, source_ids):
+            with Timer() as timer:
+                documents = store.search(
+                    query["text"], n_results=k, mode=mode,
+                    query_embedding=embedding.tolist() if mode != "keyword" else None
+                )
+            timings.append(timer.elapsed)
+            found = [doc["id"] for doc in documents]
+            if mode == "vector":
+                recalls.append(len(set(found) & set(truth)) / len(truth) if truth else 1.0)
+            source_hits += source_id in found
+        results[mode] = {
+            "latency": latency_stats(timings),
+            f"source_hit@{k}": round(source_hits / len(queries), 4) if queries else None
+        }
+        if recalls:
+            results[mode][f"recall@{k}"] = round(sum(recalls) / len(recalls), 4)
+    return results
+
+def bench_maintenance(store: VectorStore, corpus: SyntheticCorpus, delete_files: int) -> Dict[str, Any]:
+    """get_all_files 与 delete_documents 的耗时（删除放在最后，避免影响其他测量）"""
+    list_timings = []
+    for _ in range(5):
+        with Timer() as timer:
+            files = store.get_all_files()
+        list_timings.append(timer.elapsed)
+    delete_timings = []
+    for file_index in range(min(delete_files, corpus.n_files)):
+        with Timer() as timer:
+            store.delete_documents(corpus.filename(file_index))
+        delete_timings.append(timer.elapsed)
+    return {
+        "files": len(files),
+        "get_all_files": latency_stats(list_timings),
+        "delete_documents": latency_stats(delete_timings)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="检索基准（合成语料）")
+    parser.add_argument("--size", default="1k", help="语料块数，如 1k、100k、1m")
+    parser.add_argument("--chunks-per-file", type=int, default=100)
+    parser.add_argument("--chunk-chars", type=int, default=400, help="每块字数")
+    parser.add_argument("--dim", type=int, default=384, help="向量维度")
+    parser.add_argument("--queries", type=int, default=200, help="查询数")
+    parser.add_argument("--k", type=int, default=5, help="每次检索返回的结果数")
+    parser.add_argument("--modes", nargs="+", default=SEARCH_MODES, choices=SEARCH_MODES)
+    parser.add_argument("--loader-files", type=int, default=20, help="用于测试文档加载的文件数")
+    parser.add_argument("--delete-files", type=int, default=10, help="用于测试删除的文件数")
+    parser.add_argument("--backend", choices=VECTOR_BACKENDS, default="chroma", help="向量库后端")
+    parser.add_argument("--mmap-dtype", choices=["float16", "int8"], default=MMAP_INDEX_SETTINGS["dtype"])
+    parser.add_argument("--nlist", type=int, default=MMAP_INDEX_SETTINGS["nlist"], help="mmap 后端的分区数")
+    parser.add_argument("--nprobe", type=int, default=MMAP_INDEX_SETTINGS["nprobe"], help="mmap 后端扫描的分区数")
+    parser.add_argument("--no-rescore", action="store_true", help="mmap 后端不保存 float32 向量、不精确重算")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workdir", help="建库目录（默认使用临时目录并在结束后删除）")
+    parser.add_argument("--output", help="结果 JSON 文件（默认输出到标准输出）")
+    args = parser.parse_args()
+
+    MMAP_INDEX_SETTINGS.update(
+        dtype=args.mmap_dtype, nlist=args.nlist, nprobe=args.nprobe, rescore=not args.no_rescore
+    )
+    n_chunks = parse_size(args.size)
+    corpus = SyntheticCorpus(n_chunks, args.chunks_per_file, args.chunk_chars, args.seed)
+    provider = HashEmbeddingProvider(args.dim)
+    workdir = Path(args.workdir) if args.workdir else Path(tempfile.mkdtemp(prefix="bench_retrieval_"))
+    config = {**vars(args), "n_chunks": n_chunks, "n_files": corpus.n_files, "embedding": provider.model_name}
+
+    try:
+        results: Dict[str, Any] = {"memory_before": memory_usage()}
+        results["loader"] = bench_loader(corpus, workdir / "files", args.loader_files)
+
+        store = VectorStore(persist_directory=str(workdir / "store"), embedding_provider=provider,
+                            backend=args.backend)
+        # 查询互不相同，但关闭缓存以免重复运行时测到缓存命中
+        store.retrieval_cache = None
+        results["ingest"], embeddings, ids = bench_ingest(corpus, store, provider)
+        results["memory_after_ingest"] = memory_usage()
+        results["disk_mb"] = directory_size(workdir / "store")
+
+        queries = corpus.queries(args.queries, seed=args.seed + 1)
+        with Timer() as timer:
+            truth_rows = brute_force_top_k(
+                embeddings, provider.embed_array([query["text"] for query in queries]), args.k
+            )
+        results["brute_force_seconds"] = round(timer.elapsed, 3)
+        ground_truth = [[ids[row] for row in rows] for rows in truth_rows]
+        source_ids = [ids[query["source_index"]] for query in queries]
+        results["search"] = bench_search(store, provider, queries, source_ids, ground_truth, args.k, args.modes)
+        results["memory_after_search"] = memory_usage()
+
+        results["maintenance"] = bench_maintenance(store, corpus, args.delete_files)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    write_result("retrieval", config, results, args.output)
+
+if __name__ == "__main__":
+    main()
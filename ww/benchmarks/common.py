@@ -0,0 +1,109 @@
+"""
+基准测试的公共工具：耗时统计、内存与磁盘占用、结果输出
+"""
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+def parse_size(value: str) -> int:
+    """解析规模参数，如 1k、100k、1m、5000"""
+    value = value.strip().lower()
+    multipliers = {"k": 1_000, "m": 1_000_000}
+    if value[-1:] in multipliers:
+        return int(float(value[:-1]) * multipliers[value[-1]])
+    return int(value)
+
+def latency_stats(timings: List[float]) -> Dict[str, Optional[float]]:
+    """耗时列表（秒）的统计（毫秒）"""
+    if not timings:
+        return {"count": 0, "mean_ms": None, "p50_ms": None, "p99_ms": None, "max_ms": None}
+    values = sorted(timings)
+
+    def percentile(q: float) -> float:
+        return values[min(len(values) - 1, int(q * len(values)))] * 1000
+
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values) * 1000, 3),
+        "p50_ms": round(percentile(0.5), 3),
+        "p99_ms": round(percentile(0.99), 3),
+        "max_ms": round(values[-1] * 1000, 3)
+    }
+
+def memory_usage() -> Dict[str, Optional[float]]:
+    """当前进程的内存占用（MB）：优先用 psutil，没有时在 Unix 上读取峰值 RSS"""
+    usage: Dict[str, Optional[float]] = {"rss_mb": None, "peak_rss_mb": None}
+    try:
+        import psutil
+        usage["rss_mb"] = round(psutil.Process().memory_info().rss / 1024 ** 2, 1)
+    except ImportError:
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 以 KB 计，macOS 以字节计
+        usage["peak_rss_mb"] = round(peak / (1024 ** 2 if sys.platform == "darwin" else 1024), 1)
+    except ImportError:
+        pass
+    return usage
+
+def directory_size(path: Path) -> float:
+    """目录占用的磁盘空间（MB）"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return round(total / 1024 ** 2, 2)
+
+def environment() -> Dict[str, Any]:
+    """运行环境信息，便于比较不同机器上的结果"""
+    info = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count()
+    }
+    try:
+        import chromadb
+        info["chromadb"] = chromadb.__version__
+    except (ImportError, AttributeError):
+        pass
+    return info
+
+class Timer:
+    """with Timer() as t: ...; t.elapsed 为耗时（秒）"""
+
+    def __enter__(self) -> "Timer":
+        self.start = time.perf_counter()
+        self.elapsed = 0.0
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+
+def write_result(name: str, config: Dict[str, Any], results: Dict[str, Any],
+                 output: Optional[str] = None) -> Dict[str, Any]:
+    """输出 JSON 结果（标准输出，或写入文件）"""
+    report = {
+        "benchmark": name,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "environment": environment(),
+        "config": config,
+        "results": results
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2, default=str)
+    if output:
+        Path(output).parent.mkdir(parents=True, exist_ok=True)
+        Path(output).write_text(text, encoding="utf-8")
+        print(f"结果已写入 {output}", file=sys.stderr)
+    else:
+        print(text)
+    return report
@@ -0,0 +1,66 @@
+"""
+比较两次基准结果
+
+逐项比较两个结果 JSON 中的数值指标，列出变化超过阈值的项。
+耗时类指标（*_ms、*seconds）变大视为退化，其余（吞吐、召回率、命中率）变小视为退化。
+
+用法: python benchmarks/compare.py baseline.json current.json [--threshold 0.1]
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Any, Dict, Iterator, Tuple
+
+# 只比较这些部分，环境与配置信息不参与
+COMPARED_SECTIONS = ("results",)
+# 计数类字段不是性能指标
+SKIPPED_KEYS = {"count", "chunks", "files", "pieces", "counters", "modules_loaded"}
+
+def flatten(data: Any, prefix: str = "") -> Iterator[Tuple[str, float]]:
+    """展开嵌套字典中的数值项，键以 . 连接"""
+    if isinstance(data, dict):
+        for key, value in data.items():
+            yield from flatten(value, f"{prefix}.{key}" if prefix else str(key))
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        yield prefix, float(data)
+
+def lower_is_better(key: str) -> bool:
+    name = key.rsplit(".", 1)[-1]
+    if "per_second" in name:
+        return False
+    # stages 下的 xxx_seconds[标签].p50 等也是耗时
+    return name.endswith(("_ms", "seconds", "_mb")) or "_seconds[" in key
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float) -> Dict[str, Any]:
+    old = dict(item for section in COMPARED_SECTIONS for item in flatten(baseline.get(section, {}), section))
+    new = dict(item for section in COMPARED_SECTIONS for item in flatten(current.get(section, {}), section))
+    regressions, improvements = {}, {}
+    for key in sorted(old.keys() & new.keys()):
+        if old[key] == 0 or SKIPPED_KEYS & set(key.split(".")):
+            continue
+        change = (new[key] - old[key]) / abs(old[key])
+        if abs(change) < threshold:
+            continue
+        worse = change > 0 if lower_is_better(key) else change < 0
+        (regressions if worse else improvements)[key] = {
+            "baseline": old[key], "current": new[key], "change": round(change, 4)
+        }
+    return {"regressions": regressions, "improvements": improvements}
+
+def main():
+    parser = argparse.ArgumentParser(description="比较两次基准结果")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.1, help="视为变化的相对幅度")
+    args = parser.parse_args()
+
+    baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+    current = json.loads(Path(args.current).read_text(encoding="utf-8"))
+    report = compare(baseline, current, args.threshold)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    # 有退化时以非零状态退出，便于在脚本中使用
+    sys.exit(1 if report["regressions"] else 0)
+
+if __name__ == "__main__":
+    main()
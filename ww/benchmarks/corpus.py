@@ -0,0 +1,186 @@
+"""
+合成语料生成
+
+按固定随机种子生成可复现的中文（含少量英文编号）语料，规模可到百万块：
+- 句子取自 data/documents 中的文本文件（没有时使用内置句子），
+  每块再插入若干随机生成的“主题词”和唯一编号，使各块内容互不相同
+- 查询取自随机选中的块（主题词 + 句子片段，部分带编号），记录来源块用于评估
+- HashEmbeddingProvider：基于分词哈希的确定性向量，计算快，适合大规模测试；
+  召回率以同一向量的暴力检索结果为基准，与所用嵌入模型无关
+"""
+import hashlib
+import math
+import random
+import re
+import sys
+from pathlib import Path
+from typing import Any, Dict, Generator, List, Tuple
+import numpy as np
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent.parent))
+
+from core.config import DOCUMENTS_DIR
+from core.embeddings import EmbeddingProvider
+from core.keyword_index import tokenize
+
+FALLBACK_SENTENCES = [
+    "系统会定期检查所有节点的运行状态，并在异常时发出告警。",
+    "这份报告总结了第三季度的销售数据和主要客户的反馈。",
+    "在签订合同之前，双方需要确认交付时间和验收标准。",
+    "实验结果表明，新的算法在大规模数据上的检索速度明显提升。",
+    "他站在窗前，看着远处的城市灯火，沉默了很久。",
+    "请在提交申请时附上身份证明和最近三个月的收入证明。",
+    "设备的额定功率为两千瓦，连续运行时间不应超过八小时。",
+    "会议决定下周开始试运行新的审批流程。"
+]
+
+_SENTENCE_PATTERN = re.compile(r"[^。！？!?\n]+[。！？!?]?")
+
+def load_sentences(directory: Path = DOCUMENTS_DIR, min_chars: int = 6) -> List[str]:
+    """读取目录中文本文件的句子，作为语料素材"""
+    sentences = []
+    if directory.exists():
+        for path in sorted(directory.iterdir()):
+            if path.suffix.lower() not in (".txt", ".md"):
+                continue
+            try:
+                text = path.read_text(encoding="utf-8", errors="ignore")
+            except OSError:
+                continue
+            for match in _SENTENCE_PATTERN.finditer(text):
+                sentence = match.group().strip().strip("　")
+                if len(sentence) >= min_chars:
+                    sentences.append(sentence)
+    return sentences or list(FALLBACK_SENTENCES)
+
+class SyntheticCorpus:
+    """可复现的合成语料：相同的参数与种子总是生成相同的文件、块和查询"""
+
+    def __init__(self, n_chunks: int, chunks_per_file: int = 100, chunk_chars: int = 400,
+                 seed: int = 42, sentences: List[str] = None):
+        self.n_chunks = n_chunks
+        self.chunks_per_file = chunks_per_file
+        self.chunk_chars = chunk_chars
+        self.seed = seed
+        self.sentences = sentences or load_sentences()
+        rng = random.Random(seed)
+        # 主题词由素材中的汉字随机组合而成
+        chars = sorted({c for sentence in self.sentences for c in sentence if "\u4e00" <= c <= "\u9fff"})
+        self.topics = [
+            "".join(rng.choice(chars) for _ in range(rng.randint(2, 4)))
+            for _ in range(max(200, int(math.sqrt(n_chunks)) * 4))
+        ]
+
+    @property
+    def n_files(self) -> int:
+        return math.ceil(self.n_chunks / self.chunks_per_file)
+
+    @staticmethod
+    def filename(file_index: int) -> str:
+        return f"synthetic_{file_index:07d}.txt"
+
+    def chunk(self, index: int) -> Tuple[str, List[str]]:
+        """第 index 个块的内容及其主题词（只依赖种子和序号，可单独重新生成）"""
+        rng = random.Random(f"{self.seed}-{index}")
+        topics = rng.sample(self.topics, 3)
+        parts = [f"编号 QX-{index:07d}。"]
+        length = len(parts[0])
+        while length < self.chunk_chars:
+            sentence = rng.choice(self.sentences)
+            if rng.random() < 0.3:
+                sentence = f"{rng.choice(topics)}：{sentence}"
+            parts.append(sentence)
+            length += len(sentence)
+        return "".join(parts)[:self.chunk_chars], topics
+
+    def iter_files(self) -> Generator[Tuple[str, List[Dict[str, Any]]], None, None]:
+        """逐个文件产出 (文件名, 块列表)，块的格式与 DocumentLoader 的输出相同"""
+        for file_index in range(self.n_files):
+            filename = self.filename(file_index)
+            start = file_index * self.chunks_per_file
+            end = min(start + self.chunks_per_file, self.n_chunks)
+            contents = [self.chunk(index)[0] for index in range(start, end)]
+            file_hash = hashlib.sha256("\n".join(contents).encode("utf-8")).hexdigest()
+            documents = [
+                {
+                    "content": content,
+                    "metadata": {
+                        "source": filename,
+                        "filename": filename,
+                        "chunk_id": i,
+                        "file_hash": file_hash,
+                        "total_chunks": len(contents)
+                    }
+                }
+                for i, content in enumerate(contents)
+            ]
+            yield filename, documents
+
+    def write_files(self, directory: Path, max_files: int = None) -> List[Path]:
+        """把语料写成文本文件（用于测试文档加载与入库流程）"""
+        directory.mkdir(parents=True, exist_ok=True)
+        paths = []
+        for file_index, (filename, documents) in enumerate(self.iter_files()):
+            if max_files is not None and file_index >= max_files:
+                break
+            path = directory / filename
+            path.write_text("\n".join(doc["content"] for doc in documents), encoding="utf-8")
+            paths.append(path)
+        return paths
+
+    def queries(self, n: int, seed: int = None) -> List[Dict[str, Any]]:
+        """生成查询：主题词 + 来源块中的一段句子，约三分之一带编号（测试精确匹配）"""
+        rng = random.Random(self.seed if seed is None else seed)
+        queries = []
+        for index in rng.sample(range(self.n_chunks), min(n, self.n_chunks)):
+            content, topics = self.chunk(index)
+            body = content[content.index("。") + 1:]
+            start = rng.randrange(max(1, len(body) - 20))
+            text = f"{rng.choice(topics)} {body[start:start + rng.randint(8, 20)]}"
+            if rng.random() < 0.33:
+                text = f"QX-{index:07d} {text}"
+            queries.append({"text": text, "source_index": index})
+        return queries
+
+class HashEmbeddingProvider(EmbeddingProvider):
+    """分词哈希向量：每个词按哈希映射到一个维度并带符号，词频取对数后归一化"""
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+        self.model_name = f"hash-{dim}"
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_array(texts).tolist()
+
+    def embed_array(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts: Dict[str, int] = {}
+            for token in tokenize(text):
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                digest = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+                sign = 1.0 if digest & 1 else -1.0
+                vectors[row, (digest >> 1) % self.dim] += sign * (1.0 + math.log(count))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+def brute_force_top_k(corpus: np.ndarray, queries: np.ndarray, k: int,
+                      block_size: int = 100_000) -> np.ndarray:
+    """精确的余弦相似度 top-k（向量已归一化），分块计算以控制内存，返回行号"""
+    best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+    best_indexes = np.zeros((len(queries), 0), dtype=np.int64)
+    for start in range(0, len(corpus), block_size):
+        scores = queries @ corpus[start:start + block_size].T
+        take = min(k, scores.shape[1])
+        top = np.argpartition(-scores, take - 1, axis=1)[:, :take]
+        best_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+        best_indexes = np.concatenate([best_indexes, top + start], axis=1)
+        if best_scores.shape[1] > k:
+            keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(best_scores, keep, axis=1)
+            best_indexes = np.take_along_axis(best_indexes, keep, axis=1)
+    order = np.argsort(-best_scores, axis=1)
+    return np.take_along_axis(best_indexes, order, axis=1)
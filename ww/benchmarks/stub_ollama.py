@@ -0,0 +1,213 @@
+"""
+本地 Ollama 替身服务
+
+实现端到端基准用到的接口（/api/chat、/api/generate、/api/ps、/api/tags），
+按设定的首 token 延迟和生成速度流式返回固定内容，并返回与 Ollama 相同格式的
+eval_count / eval_duration 等统计，便于在没有 GPU 的机器上测试完整链路。
+
+单独运行: python benchmarks/stub_ollama.py --port 11435 --tokens-per-second 30
+"""
+import argparse
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+
+STUB_TOKENS = ["根据", "文档", "内容", "，", "这个", "问题", "的", "答案", "如下", "。"]
+
+class StubSettings:
+    def __init__(self, tokens_per_second: float = 30.0, ttft: float = 0.2,
+                 response_tokens: int = 64, load_seconds: float = 0.0):
+        self.tokens_per_second = tokens_per_second
+        self.ttft = ttft                      # 处理提示词的耗时（首个 token 之前）
+        self.response_tokens = response_tokens
+        self.load_seconds = load_seconds      # 模型首次使用时的加载耗时
+        self.loaded_models: Dict[str, datetime] = {}
+        self.lock = threading.Lock()
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+class StubHandler(BaseHTTPRequestHandler):
+    settings: StubSettings = StubSettings()
+
+    def log_message(self, format: str, *args):
+        # 不输出访问日志
+        pass
+
+    def do_GET(self):
+        if self.path == "/api/ps":
+            with self.settings.lock:
+                models = [
+                    {
+                        "name": name,
+                        "model": name,
+                        "size": 0,
+                        "size_vram": 0,
+                        "digest": "",
+                        "expires_at": (loaded_at + timedelta(minutes=10)).isoformat()
+                    }
+                    for name, loaded_at in self.settings.loaded_models.items()
+                ]
+            self._send_json({"models": models})
+        elif self.path == "/api/tags":
+            self._send_json({"models": []})
+        elif self.path in ("/", "/api/version"):
+            self._send_json({"version": "stub"})
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if self.path == "/api/chat":
+            self._generate(request, chat=True)
+        elif self.path == "/api/generate":
+            self._generate(request, chat=False)
+        else:
+            self.send_error(404)
+
+    def _generate(self, request: Dict[str, Any], chat: bool):
+        settings = self.settings
+        model = request.get("model", "stub")
+        start = time.perf_counter()
+        load_seconds = self._load(model)
+
+        # 空提示词只加载模型（预热）
+        prompt_empty = not request.get("messages") if chat else not request.get("prompt")
+        n_tokens = 0 if prompt_empty else settings.response_tokens
+        prompt_tokens = len(json.dumps(request.get("messages") or request.get("prompt") or "", ensure_ascii=False)) // 2
+
+        if n_tokens:
+            time.sleep(settings.ttft)
+        prompt_seconds = time.perf_counter() - start - load_seconds
+        interval = 1.0 / settings.tokens_per_second if settings.tokens_per_second > 0 else 0.0
+
+        if not request.get("stream", True):
+            time.sleep(interval * n_tokens)
+            text = "".join(STUB_TOKENS[i % len(STUB_TOKENS)] for i in range(n_tokens))
+            final = self._final_chunk(model, chat, "" if chat else text, start, load_seconds,
+                                      prompt_tokens, prompt_seconds, n_tokens)
+            if chat:
+                final["message"]["content"] = text
+            self._send_json(final)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        decode_start = time.perf_counter()
+        try:
+            for i in range(n_tokens):
+                token = STUB_TOKENS[i % len(STUB_TOKENS)]
+                chunk = {"model": model, "created_at": _now(), "done": False}
+                if chat:
+                    chunk["message"] = {"role": "assistant", "content": token}
+                else:
+                    chunk["response"] = token
+                self._write_line(chunk)
+                # 按设定速度输出，不累计误差
+                delay = decode_start + interval * (i + 1) - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            self._write_line(self._final_chunk(model, chat, "", start, load_seconds,
+                                               prompt_tokens, prompt_seconds, n_tokens))
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端提前断开
+            pass
+
+    def _load(self, model: str) -> float:
+        """模拟模型加载：首次使用时等待 load_seconds"""
+        with self.settings.lock:
+            loaded = model in self.settings.loaded_models
+            self.settings.loaded_models[model] = datetime.now(timezone.utc)
+        if loaded or not self.settings.load_seconds:
+            return 0.0
+        time.sleep(self.settings.load_seconds)
+        return self.settings.load_seconds
+
+    @staticmethod
+    def _final_chunk(model: str, chat: bool, text: str, start: float, load_seconds: float,
+                     prompt_tokens: int, prompt_seconds: float, n_tokens: int) -> Dict[str, Any]:
+        total = time.perf_counter() - start
+        chunk = {
+            "model": model,
+            "created_at": _now(),
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": int(total * 1e9),
+            "load_duration": int(load_seconds * 1e9),
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(max(prompt_seconds, 0.0) * 1e9),
+            "eval_count": n_tokens,
+            "eval_duration": int(max(total - load_seconds - prompt_seconds, 0.0) * 1e9)
+        }
+        if chat:
+            chunk["message"] = {"role": "assistant", "content": text}
+        else:
+            chunk["response"] = text
+        return chunk
+
+    def _write_line(self, data: Dict[str, Any]):
+        self.wfile.write((json.dumps(data, ensure_ascii=False) + "\n").encode("utf-8"))
+        self.wfile.flush()
+
+    def _send_json(self, data: Dict[str, Any]):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class StubOllamaServer:
+    """在后台线程中运行的替身服务；port 为 0 时自动选择空闲端口"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, settings: Optional[StubSettings] = None):
+        handler = type("Handler", (StubHandler,), {"settings": settings or StubSettings()})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubOllamaServer":
+        self._thread = threading.Thread(target=self.server.serve_forever, name="stub-ollama", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "StubOllamaServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 Ollama 替身服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--tokens-per-second", type=float, default=30.0)
+    parser.add_argument("--ttft", type=float, default=0.2, help="首个 token 前的延迟（秒）")
+    parser.add_argument("--response-tokens", type=int, default=64)
+    parser.add_argument("--load-seconds", type=float, default=0.0, help="模型首次使用时的加载耗时（秒）")
+    args = parser.parse_args()
+
+    settings = StubSettings(args.tokens_per_second, args.ttft, args.response_tokens, args.load_seconds)
+    server = StubOllamaServer(args.host, args.port, settings)
+    print(f"Ollama 替身服务运行于 {server.url}")
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
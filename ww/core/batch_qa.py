@@ -0,0 +1,233 @@
+"""
+批量问答
+
+离线处理成批的问题（评测、生成报告），检索与生成流水线执行：
+- 问题按 retrieval_batch_size 分批，每批一次计算查询向量、一次向量检索（见 search_knowledge_bases_batch），
+  检索在线程中进行，与生成同时进行
+- 检索结果放入有界队列，由 concurrency 个协程并发调用 ChatManager.achat 生成回答，
+  每个模型的并发上限同为 concurrency（显式传给 achat，不修改全局配置），吞吐只受 Ollama 的并行能力限制
+- 回答缓存默认只做精确匹配（semantic_cache），不会把相似问题的回答当作本题的回答，
+  也不为每个问题单独计算一次问题向量
+- 每个问题完成后立即以 JSONL 追加写出（含各阶段耗时与生成统计）；中断后重新运行时跳过已完成的问题，
+  失败的问题会重新执行（同一 id 以最后一条记录为准）
+
+输入每行一个 JSON 对象，如 {"id": "q1", "question": "..."}，其余字段原样带到输出中；
+没有 id 时以行号作为 id。配置见 BATCH_QA_SETTINGS。
+"""
+import asyncio
+import json
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from .config import BATCH_QA_SETTINGS, DEFAULT_MODEL, DEFAULT_MODEL_PARAMS, DEFAULT_SEARCH_PARAMS
+from .chat import ChatManager
+from .knowledge_base import search_knowledge_bases_batch
+from .memory import ConversationMemory
+from .metrics import trace
+from .rerank import Reranker
+from .vector_store import VectorStore
+from .logger import logger, log_error
+
+def read_questions(path: Path) -> List[Dict[str, Any]]:
+    """读取问题文件（JSONL），每项包含 id 与 question"""
+    items = []
+    with open(path, encoding="utf-8") as file:
+        for line_number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path} 第 {line_number} 行不是合法的 JSON: {e}")
+            question = item.get("question") if isinstance(item, dict) else None
+            if not isinstance(question, str) or not question.strip():
+                raise ValueError(f"{path} 第 {line_number} 行缺少 question")
+            items.append({"id": item.get("id", line_number), **item})
+    return items
+
+def completed_ids(path: Path) -> Set[str]:
+    """输出文件中已成功完成的问题 id（中断时写了一半的行忽略）"""
+    done: Set[str] = set()
+    if not path.exists():
+        return done
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "error" in record:
+                done.discard(str(record.get("id")))
+            else:
+                done.add(str(record.get("id")))
+    return done
+
+class BatchQARunner:
+    """批量问答的流水线：分批检索 → 有界队列 → 并发生成"""
+
+    def __init__(self, chat_manager: ChatManager, stores: Dict[str, VectorStore],
+                 model: str = DEFAULT_MODEL, model_params: Dict[str, Any] = None,
+                 search_params: Dict[str, Any] = None, reranker: Optional[Reranker] = None,
+                 settings: Dict[str, Any] = None):
+        self.chat_manager = chat_manager
+        # 为空时不检索，直接回答
+        self.stores = stores
+        self.model = model
+        self.model_params = {**DEFAULT_MODEL_PARAMS, **(model_params or {})}
+        self.search_params = {**DEFAULT_SEARCH_PARAMS, **(search_params or {})}
+        self.reranker = reranker
+        self.settings = {**BATCH_QA_SETTINGS, **(settings or {})}
+
+    async def run(self, items: List[Dict[str, Any]],
+                  on_result: Callable[[Dict[str, Any]], None]) -> Dict[str, Any]:
+        """处理所有问题，每完成一个调用 on_result（在事件循环线程中），返回汇总统计"""
+        concurrency = self.settings["concurrency"]
+        batch_size = self.settings["retrieval_batch_size"]
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.settings["queue_size"])
+        summary = {"total": len(items), "completed": 0, "failed": 0, "eval_tokens": 0}
+        started = time.perf_counter()
+
+        async def produce():
+            for start in range(0, len(items), batch_size):
+                batch = items[start:start + batch_size]
+                documents, error, seconds = await asyncio.to_thread(self._retrieve, batch)
+                retrieved_at = time.perf_counter()
+                for item, docs in zip(batch, documents):
+                    timings = {
+                        "retrieval_seconds": round(seconds / len(batch), 4),
+                        "retrieval_batch_seconds": round(seconds, 4)
+                    }
+                    # 队列已满时等待，检索最多领先生成 queue_size 个问题
+                    await queue.put((item, docs, error, timings, retrieved_at))
+            for _ in range(concurrency):
+                await queue.put(None)
+
+        async def consume():
+            while True:
+                entry = await queue.get()
+                if entry is None:
+                    return
+                result = await self._answer(*entry)
+                if "error" in result:
+                    summary["failed"] += 1
+                else:
+                    summary["completed"] += 1
+                    summary["eval_tokens"] += result.get("generation", {}).get("eval_count", 0)
+                on_result(result)
+
+        consumers = [asyncio.create_task(consume()) for _ in range(concurrency)]
+        try:
+            await asyncio.gather(produce(), *consumers)
+        finally:
+            for task in consumers:
+                task.cancel()
+
+        elapsed = time.perf_counter() - started
+        summary.update({
+            "elapsed": round(elapsed, 3),
+            "questions_per_second": round(len(items) / elapsed, 3) if elapsed else 0.0,
+            "eval_tokens_per_second": round(summary["eval_tokens"] / elapsed, 1) if elapsed else 0.0
+        })
+        return summary
+
+    def _retrieve(self, batch: List[Dict[str, Any]]) -> Tuple[List[Optional[List[Dict[str, Any]]]], Optional[str], float]:
+        """检索一批问题（在线程中执行）；失败时整批记录错误，不中断其他批次"""
+        start = time.perf_counter()
+        if not self.stores:
+            return [None] * len(batch), None, 0.0
+        try:
+            documents = search_knowledge_bases_batch(
+                self.stores,
+                [item["question"] for item in batch],
+                n_results=self.search_params["n_results"],
+                mode=self.search_params["mode"],
+                similarity_threshold=self.search_params["similarity_threshold"],
+                reranker=self.reranker
+            )
+            return documents, None, time.perf_counter() - start
+        except Exception as e:
+            log_error(e, f"批量检索失败: {len(batch)} 个问题")
+            return [None] * len(batch), f"检索失败: {e}", time.perf_counter() - start
+
+    async def _answer(self, item: Dict[str, Any], docs: Optional[List[Dict[str, Any]]], error: Optional[str],
+                      timings: Dict[str, float], retrieved_at: float) -> Dict[str, Any]:
+        """生成单个问题的回答，返回输出记录"""
+        result = {**item, "model": self.model}
+        if error is not None:
+            return {**result, "error": error, "timings": timings}
+
+        with trace("batch_qa", model=self.model, source="batch") as record:
+            start = time.perf_counter()
+            timings["queue_seconds"] = round(start - retrieved_at, 4)
+            parts, ttft = [], None
+            try:
+                # 每个问题独立回答，不带对话历史
+                async for piece in self.chat_manager.achat(
+                    item["question"],
+                    docs,
+                    model_name=self.model,
+                    model_params=self.model_params,
+                    memory=ConversationMemory(),
+                    concurrency=self.settings["concurrency"],
+                    semantic_cache=self.settings["semantic_cache"]
+                ):
+                    if ttft is None:
+                        ttft = time.perf_counter() - start
+                    parts.append(piece)
+            except Exception as e:
+                log_error(e, f"批量问答生成失败: {item['id']}")
+                record.set(error=str(e))
+                result["error"] = str(e)
+            timings["ttft_seconds"] = round(ttft, 4) if ttft is not None else None
+            timings["generation_seconds"] = round(time.perf_counter() - start, 4)
+            generation = record.attributes.get("generation", {})
+
+        result.update({
+            "answer": "".join(parts),
+            "answer_cached": bool(record.attributes.get("answer_cached")),
+            "documents": [
+                {
+                    "knowledge_base": doc['metadata'].get('knowledge_base'),
+                    "filename": doc['metadata']['filename'],
+                    "chunk_id": doc['metadata'].get('chunk_id')
+                }
+                for doc in docs or []
+            ],
+            "timings": timings,
+            "generation": generation
+        })
+        return result
+
+def run_batch(runner: BatchQARunner, input_path: Path, output_path: Path, restart: bool = False,
+              progress_every: int = 50) -> Dict[str, Any]:
+    """从 JSONL 读取问题、跳过已完成的问题，结果逐条追加写入 output_path，返回汇总统计"""
+    items = read_questions(input_path)
+    if restart and output_path.exists():
+        output_path.unlink()
+    done = completed_ids(output_path)
+    pending = [item for item in items if str(item["id"]) not in done]
+    logger.info(f"批量问答: 共 {len(items)} 个问题，已完成 {len(items) - len(pending)} 个，本次处理 {len(pending)} 个")
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    # 上次中断时最后一行可能只写了一半，补上换行使新记录从新的一行开始
+    needs_newline = False
+    if output_path.exists() and output_path.stat().st_size > 0:
+        with open(output_path, "rb") as file:
+            file.seek(-1, 2)
+            needs_newline = file.read(1) != b"\n"
+    with open(output_path, "a", encoding="utf-8") as output:
+        if needs_newline:
+            output.write("\n")
+        finished = 0
+
+        def write(result: Dict[str, Any]):
+            nonlocal finished
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+            finished += 1
+            if finished % progress_every == 0 or finished == len(pending):
+                logger.info(f"批量问答进度: {finished}/{len(pending)}")
+
+        summary = asyncio.run(runner.run(pending, write))
+    summary["skipped"] = len(items) - len(pending)
+    return summary
@@ -1,86 +1,385 @@
-from typing import List, Dict, Any, Generator
-import ollama
+import asyncio
+import json
+import time
+import weakref
+from typing import TYPE_CHECKING, List, Dict, Any, Generator, AsyncGenerator, Callable, Optional, Tuple
 from datetime import datetime
-from .config import DEFAULT_MODEL, OLLAMA_BASE_URL, DEFAULT_MODEL_PARAMS
+from .config import (
+    DEFAULT_MODEL, OLLAMA_BASE_URL, DEFAULT_MODEL_PARAMS,
+    ASYNC_CHAT_SETTINGS, MEMORY_SETTINGS, STREAM_RENDER_SETTINGS
+)
+from .context import ContextPacker, token_budget_for
+from .embeddings import EmbeddingProvider
+from .memory import ConversationMemory
+from .metrics import span, current_trace, record_generation
+from .models import ModelManager
+from .query_cache import AnswerCache
+from .streaming import coalesce
 from .logger import logger, log_error, log_chat
 
+if TYPE_CHECKING:
+    import ollama
+
+# 命中回答缓存时，每次产出的字符数
+CACHED_ANSWER_PIECE_SIZE = 16
+
+def create_async_client(host: str = OLLAMA_BASE_URL) -> "ollama.AsyncClient":
+    """创建带连接池的异步 Ollama 客户端（绑定到当前事件循环）"""
+    import httpx
+    import ollama
+    return ollama.AsyncClient(
+        host=host,
+        limits=httpx.Limits(
+            max_connections=ASYNC_CHAT_SETTINGS["max_connections"],
+            max_keepalive_connections=ASYNC_CHAT_SETTINGS["max_connections"]
+        ),
+        timeout=httpx.Timeout(ASYNC_CHAT_SETTINGS["total_timeout"], connect=10.0)
+    )
+
 class ChatManager:
-    def __init__(self, model_name: str = DEFAULT_MODEL, model_params: Dict = None):
+    def __init__(self, model_name: str = DEFAULT_MODEL, model_params: Dict = None,
+                 client: Optional["ollama.Client"] = None, answer_cache: Optional[AnswerCache] = None,
+                 embedding_provider: Optional[EmbeddingProvider] = None,
+                 model_manager: Optional[ModelManager] = None, host: str = OLLAMA_BASE_URL):
         self.model = model_name
-        self.model_params = model_params or DEFAULT_MODEL_PARAMS
-        # 设置ollama客户端
-        self.client = ollama.Client(host=OLLAMA_BASE_URL)
-        self.conversation_history = []
+        self.model_params = dict(model_params or DEFAULT_MODEL_PARAMS)
+        # 设置ollama客户端（可传入进程内共享的客户端）；host 同时用于异步客户端
+        self.host = host
+        if client is None:
+            import ollama
+            client = ollama.Client(host=host)
+        self.client = client
+        # 未按会话传入记忆时使用的默认会话记忆
+        self.memory = ConversationMemory()
+        # 回答缓存（可选），embedding_provider 用于按相似度查找近似问题
+        self.answer_cache = answer_cache
+        self.embedding_provider = embedding_provider
+        # 模型生命周期管理（可选），切换模型时在后台预热
+        self.model_manager = model_manager
+        # 异步客户端与并发限制按事件循环区分（httpx/asyncio 对象不能跨事件循环使用）
+        self._async_clients: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+        self._semaphores: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+        self._warmed_at: Dict[str, float] = {}
 
     def update_model(self, model_name: str, model_params: Dict = None):
         """更新模型和参数"""
+        if self.model_manager is not None and model_name != self.model:
+            self.model_manager.warm(model_name)
         self.model = model_name
         if model_params:
             self.model_params.update(model_params)
         logger.info(f"模型已更新: {model_name}, 参数: {self.model_params}")
 
-    def chat(self, user_input: str, relevant_docs: List[Dict[str, Any]] = None) -> Generator[str, None, None]:
-        """处理用户输入并生成流式响应"""
+    def chat(self, user_input: str, relevant_docs: List[Dict[str, Any]] = None,
+             model_name: str = None, model_params: Dict = None,
+             memory: ConversationMemory = None) -> Generator[str, None, None]:
+        """处理用户输入并生成流式响应
+
+        model_name/model_params/memory 为会话级状态，传入时覆盖实例上的默认值，
+        以便多个会话共享同一个 ChatManager。
+        """
+        model = model_name or self.model
+        params = model_params or self.model_params
+        if memory is None:
+            memory = self.memory
         try:
-            # 构建提示词
-            prompt = self._build_prompt(user_input, relevant_docs)
-            
-            # 调用模型生成流式响应
-            stream = self.client.generate(
-                model=self.model,
-                prompt=prompt,
-                stream=True,
-                options={
-                    "temperature": self.model_params["temperature"],
-                    "top_p": self.model_params["top_p"],
-                    "top_k": self.model_params["top_k"],
-                    "repeat_penalty": self.model_params["repeat_penalty"],
-                    "num_predict": self.model_params["max_tokens"]
-                }
-            )
+            # 构建本轮消息：系统指令与摘要、历史轮次、带文档的当前问题
+            messages = memory.build_messages(self._build_prompt(user_input, relevant_docs, model))
+
+            # 先查回答缓存，命中时按流式接口逐段返回
+            cached, cache_context = self._lookup_answer(user_input, relevant_docs, model, params, messages, memory)
+            if cached is not None:
+                self._mark_cached()
+                for start in range(0, len(cached), CACHED_ANSWER_PIECE_SIZE):
+                    yield cached[start:start + CACHED_ANSWER_PIECE_SIZE]
+                self._finish(user_input, cached, relevant_docs, memory, model, cached=True)
+                return
             
             # 收集完整响应用于日志记录
             full_response = ""
             
-            # 流式输出响应
-            for chunk in stream:
-                if chunk['response']:
-                    full_response += chunk['response']
-                    yield chunk['response']
-            
-            # 记录对话
-            log_chat(user_input, full_response, relevant_docs)
+            with span("generation", labels={"model": model}):
+                start = time.perf_counter()
+                # 调用模型生成流式响应（保持模型驻留，使相同的消息前缀可复用 KV 缓存）
+                stream = self.client.chat(
+                    model=model,
+                    messages=messages,
+                    stream=True,
+                    options=self._options(params),
+                    keep_alive=ModelManager.keep_alive_for(model)
+                )
+                
+                # 流式输出响应
+                ttft, final_chunk = None, None
+                for chunk in stream:
+                    content = chunk['message']['content']
+                    if content:
+                        if ttft is None:
+                            ttft = time.perf_counter() - start
+                        full_response += content
+                        yield content
+                    if chunk.get('done'):
+                        final_chunk = chunk
+            record_generation(model, final_chunk, ttft)
             
-            # 更新对话历史
-            self.conversation_history.append({
-                "role": "user",
-                "content": user_input
-            })
-            self.conversation_history.append({
-                "role": "assistant",
-                "content": full_response
-            })
+            # 记录对话、缓存回答并更新会话记忆
+            self._finish(user_input, full_response, relevant_docs, memory, model, cache_context)
             
         except Exception as e:
             log_error(e, "生成响应失败")
             raise
 
-    def _build_prompt(self, user_input: str, relevant_docs: List[Dict[str, Any]] = None) -> str:
-        """构建提示词"""
-        prompt = "你是一个智能助手，请基于以下信息回答用户的问题：\n\n"
-        
+    def chat_buffered(self, user_input: str, relevant_docs: List[Dict[str, Any]] = None,
+                      model_name: str = None, model_params: Dict = None,
+                      memory: ConversationMemory = None,
+                      interval: float = STREAM_RENDER_SETTINGS["interval"],
+                      max_pieces: int = STREAM_RENDER_SETTINGS["max_pieces"]) -> Generator[str, None, None]:
+        """与 chat 相同，但把逐 token 的输出按时间或片段数合并后再产出（见 core/streaming.py）"""
+        yield from coalesce(
+            self.chat(user_input, relevant_docs, model_name, model_params, memory),
+            interval, max_pieces
+        )
+
+    async def achat(self, user_input: str, relevant_docs: List[Dict[str, Any]] = None,
+                    model_name: str = None, model_params: Dict = None,
+                    memory: ConversationMemory = None,
+                    retrieve: Callable[[], List[Dict[str, Any]]] = None,
+                    concurrency: int = None, semantic_cache: bool = True) -> AsyncGenerator[str, None]:
+        """chat 的异步版本
+
+        - 使用进程内共享、带连接池的 ollama.AsyncClient
+        - 每个模型有并发上限（默认 max_concurrency_per_model，可由 concurrency 指定），超出的请求排队等待
+        - 传入 retrieve（同步检索函数）时，检索与提示词构建在线程中执行，同时预热模型
+        - semantic_cache=False 时回答缓存只做精确匹配，不计算问题向量、不查找近似问题
+        - 首个 token、相邻 token 间隔和总时长都有超时
+        - 调用方中途放弃（关闭生成器或取消任务）时，立即关闭与 Ollama 的流
+        """
+        model = model_name or self.model
+        params = model_params or self.model_params
+        if memory is None:
+            memory = self.memory
+        settings = ASYNC_CHAT_SETTINGS
+        client = self._get_async_client()
+        stream = None
+        try:
+            # 检索、构建提示词与模型预热并行进行
+            async def prepare():
+                docs = relevant_docs
+                if retrieve is not None:
+                    docs = await asyncio.to_thread(retrieve)
+                messages = memory.build_messages(self._build_prompt(user_input, docs, model))
+                cached, cache_context = await asyncio.to_thread(
+                    self._lookup_answer, user_input, docs, model, params, messages, memory, semantic_cache
+                )
+                return docs, messages, cached, cache_context
+
+            (docs, messages, cached, cache_context), _ = await asyncio.gather(
+                prepare(), self.awarm_up(model, client)
+            )
+            if cached is not None:
+                self._mark_cached()
+                for start in range(0, len(cached), CACHED_ANSWER_PIECE_SIZE):
+                    yield cached[start:start + CACHED_ANSWER_PIECE_SIZE]
+                self._finish(user_input, cached, docs, memory, model, cached=True)
+                return
+
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + settings["total_timeout"]
+            async with self._model_semaphore(model, concurrency):
+                # 排队等待并发名额的时间不计入生成耗时
+                with span("generation", labels={"model": model}):
+                    start = time.perf_counter()
+                    stream = await asyncio.wait_for(
+                        client.chat(
+                            model=model,
+                            messages=messages,
+                            stream=True,
+                            options=self._options(params),
+                            keep_alive=ModelManager.keep_alive_for(model)
+                        ),
+                        timeout=settings["first_token_timeout"]
+                    )
+                    parts = []
+                    ttft, final_chunk = None, None
+                    timeout = settings["first_token_timeout"]
+                    while True:
+                        remaining = deadline - loop.time()
+                        if remaining <= 0:
+                            raise asyncio.TimeoutError("生成总时长超时")
+                        try:
+                            chunk = await asyncio.wait_for(stream.__anext__(), timeout=min(timeout, remaining))
+                        except StopAsyncIteration:
+                            break
+                        timeout = settings["idle_timeout"]
+                        content = chunk['message']['content']
+                        if content:
+                            if ttft is None:
+                                ttft = time.perf_counter() - start
+                            parts.append(content)
+                            yield content
+                        if chunk.get('done'):
+                            final_chunk = chunk
+                record_generation(model, final_chunk, ttft)
+
+            self._finish(user_input, "".join(parts), docs, memory, model, cache_context)
+
+        except (asyncio.CancelledError, GeneratorExit):
+            logger.info(f"请求已被取消，停止生成: {model}")
+            raise
+        except Exception as e:
+            log_error(e, "异步生成响应失败")
+            raise
+        finally:
+            if stream is not None:
+                await stream.aclose()
+
+    async def awarm_up(self, model: str, client: "ollama.AsyncClient" = None):
+        """预热模型：发送空提示词让 Ollama 加载模型；最近预热过的模型跳过"""
+        now = time.monotonic()
+        if now - self._warmed_at.get(model, float("-inf")) < ASYNC_CHAT_SETTINGS["warm_up_interval"]:
+            return
+        self._warmed_at[model] = now
+        try:
+            await (client or self._get_async_client()).generate(
+                model=model, prompt="", keep_alive=ModelManager.keep_alive_for(model)
+            )
+        except Exception as e:
+            # 预热失败不影响正式请求
+            self._warmed_at.pop(model, None)
+            log_error(e, f"模型预热失败: {model}")
+
+    def _get_async_client(self) -> "ollama.AsyncClient":
+        """获取当前事件循环的异步客户端（同一事件循环内的请求共享连接池）"""
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = create_async_client(self.host)
+            self._async_clients[loop] = client
+        return client
+
+    def _model_semaphore(self, model: str, limit: int = None) -> asyncio.Semaphore:
+        """获取当前事件循环中该模型的并发限制（不同的上限各用一个信号量）"""
+        limit = limit or ASYNC_CHAT_SETTINGS["max_concurrency_per_model"]
+        semaphores = self._semaphores.setdefault(asyncio.get_running_loop(), {})
+        if (model, limit) not in semaphores:
+            semaphores[(model, limit)] = asyncio.Semaphore(limit)
+        return semaphores[(model, limit)]
+
+    def _lookup_answer(self, user_input: str, relevant_docs: Optional[List[Dict[str, Any]]],
+                       model: str, params: Dict, messages: List[Dict[str, str]],
+                       memory: ConversationMemory,
+                       semantic: bool = True) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """查询回答缓存，返回 (缓存的回答, 写入缓存所需的上下文)
+
+        近似问题查找只用于会话的第一轮（且 semantic 为 True），有历史时回答依赖上下文，只做精确匹配；
+        按检索的知识库区分范围，近似问题不会命中其他知识库的回答。
+        """
+        if self.answer_cache is None:
+            return None, None
+        first_turn = semantic and memory.is_empty()
         if relevant_docs:
-            prompt += "相关文档信息：\n"
-            for doc in relevant_docs:
-                prompt += f"文档：{doc['metadata']['filename']}\n"
-                prompt += f"内容：{doc['content']}\n\n"
-        
-        prompt += f"用户问题：{user_input}\n"
-        prompt += "请基于以上信息，给出准确、详细的回答。"
-        
-        return prompt
+            knowledge_bases = sorted({doc['metadata'].get('knowledge_base', '') for doc in relevant_docs})
+            scope = "docs:" + ",".join(knowledge_bases)
+        else:
+            scope = "none"
+        cache_context = {
+            "key": self.answer_cache.make_key(model, params, json.dumps(messages, ensure_ascii=False)),
+            "scope": self.answer_cache.make_scope(model, params, scope)
+            if first_turn else None,
+            "query_embedding": self._embed_query(user_input) if first_turn else None
+        }
+        cached = self.answer_cache.lookup(
+            cache_context["key"], cache_context["scope"], cache_context["query_embedding"]
+        )
+        if cached is not None:
+            logger.info("命中回答缓存")
+        return cached, cache_context
+
+    @staticmethod
+    def _mark_cached():
+        """在当前请求的追踪记录上标记命中了回答缓存"""
+        record = current_trace()
+        if record is not None:
+            record.set(answer_cached=True)
+
+    def _finish(self, user_input: str, response: str, relevant_docs: Optional[List[Dict[str, Any]]],
+                memory: ConversationMemory, model: str, cache_context: Optional[Dict[str, Any]] = None,
+                cached: bool = False):
+        """记录对话、写入回答缓存并更新会话记忆（超出预算时在后台摘要较早的轮次）"""
+        record = current_trace()
+        log_chat(user_input, response, relevant_docs, model=model,
+                 trace_id=record.trace_id if record is not None else None, cached=cached)
+        if cache_context is not None and response:
+            self.answer_cache.store(
+                cache_context["key"], response, cache_context["scope"], cache_context["query_embedding"]
+            )
+        memory.add_turn(user_input, response)
+        memory.summarize_in_background(lambda summary, messages: self.summarize(model, summary, messages))
+
+    def summarize(self, model: str, summary: str, messages: List[Dict[str, str]]) -> str:
+        """用模型把已有摘要和较早的对话折叠成新的摘要"""
+        dialogue = "\n".join(
+            f"{'用户' if message['role'] == 'user' else '助手'}：{message['content']}" for message in messages
+        )
+        prompt = (
+            "请把以下对话内容压缩成简洁的摘要，保留关键事实、结论和用户的需求，"
+            f"不超过{MEMORY_SETTINGS['summary_max_chars']}字。\n\n"
+            f"已有摘要：\n{summary or '无'}\n\n新的对话：\n{dialogue}\n\n摘要："
+        )
+        response = self.client.generate(
+            model=model,
+            prompt=prompt,
+            options={"temperature": 0.2, "num_predict": MEMORY_SETTINGS["summary_max_tokens"]},
+            keep_alive=ModelManager.keep_alive_for(model)
+        )
+        return response['response']
+
+    @staticmethod
+    def _options(params: Dict) -> Dict[str, Any]:
+        """模型参数转换为 Ollama options"""
+        return {
+            "temperature": params["temperature"],
+            "top_p": params["top_p"],
+            "top_k": params["top_k"],
+            "repeat_penalty": params["repeat_penalty"],
+            "num_predict": params["max_tokens"]
+        }
+
+    def _embed_query(self, user_input: str) -> Optional[List[float]]:
+        """计算问题向量，用于近似问题缓存查找"""
+        if self.embedding_provider is None:
+            return None
+        try:
+            return self.embedding_provider.embed([user_input])[0]
+        except Exception as e:
+            log_error(e, "计算问题向量失败")
+            return None
+
+    def _build_prompt(self, user_input: str, relevant_docs: List[Dict[str, Any]] = None,
+                      model: str = None) -> str:
+        """构建本轮的用户消息（文档按模型的 token 预算去重、合并后装入）"""
+        with span("build_prompt") as info:
+            prompt = ""
+            
+            if relevant_docs:
+                packer = ContextPacker(token_budget_for(model or self.model))
+                packed = packer.pack(relevant_docs)
+                info["packed_segments"] = len(packed)
+                prompt += "相关文档信息：\n"
+                for doc in packed:
+                    source = doc['metadata']['filename']
+                    if 'page' in doc['metadata']:
+                        source += f"（第{doc['metadata']['page']}页）"
+                    prompt += f"文档：{source}\n"
+                    prompt += f"内容：{doc['content']}\n\n"
+            
+            prompt += f"用户问题：{user_input}\n"
+            if relevant_docs:
+                prompt += "请基于以上信息，给出准确、详细的回答。"
+            
+            return prompt
 
     def clear_history(self):
         """清除对话历史"""
-        self.conversation_history = []
+        self.memory.clear()
         logger.info("对话历史已清除") 
\ No newline at end of file
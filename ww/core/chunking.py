@@ -0,0 +1,254 @@
+"""
+分块策略
+
+DocumentLoader 按文件类型选用分块器（配置见 CHUNKING_SETTINGS，知识库可覆盖）：
+- recursive: 按段落、换行、空格递归切分（原有方式）
+- sentence: 按句切分后装箱，识别中文句末标点（。！？；）与换行，块边界总在句末，重叠也以整句计
+- markdown: 按标题切分章节，过长的章节再按句切分；块的 metadata 中记录所在的标题路径（headings）
+
+长度单位可以是字符数（chars）或 token 数（tokens）。token 数用 tokenizer 指定的分词器
+（tokenizer.json，如生成模型对应的分词器）计算，未指定时按 estimate_tokens 估算；
+中文按字符计数会严重低估 token 数。
+
+parent_chunk_size 非空时启用父子分块：先切出父块，再把父块切成子块入库，
+检索命中子块后返回父块的内容（见 VectorStore.search）。
+"""
+import bisect
+import hashlib
+import re
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+from .config import CHUNKING_SETTINGS
+from .context import estimate_tokens
+
+CHUNKING_STRATEGIES = ["recursive", "sentence", "markdown"]
+LENGTH_UNITS = ["chars", "tokens"]
+
+# 句子边界：中英文句末标点（含其后的引号、括号）、英文句点后的空白、换行
+_SENTENCE_BOUNDARY = re.compile(r"[。！？!?；;…]+[”’」』）)\]]*|\.(?=\s)|\n+")
+# 超长句子按逗号、空格等继续切分
+_CLAUSE_SEPARATORS = ["，", "、", ",", " ", ""]
+_HEADING = re.compile(r"^(#{1,6})[ \t]+(.+?)[ \t#]*$", re.MULTILINE)
+_FENCE = re.compile(r"^[ \t]*(```|~~~)", re.MULTILINE)
+
+class Chunk(NamedTuple):
+    content: str
+    start: int                                  # 在输入文本中的起始位置
+    metadata: Optional[Dict[str, Any]] = None   # 附加到块元数据中的字段
+    context: Any = None                         # 块起始处的分块状态（如标题路径），流式切分时随剩余文本传回
+
+@lru_cache(maxsize=8)
+def _load_tokenizer(path: str):
+    # tokenizers 随 chromadb 安装
+    from tokenizers import Tokenizer
+    return Tokenizer.from_file(path)
+
+def length_function(unit: str = "chars", tokenizer: Optional[str] = None) -> Callable[[str], int]:
+    """按长度单位返回计算文本长度的函数"""
+    if unit == "chars":
+        return len
+    if unit != "tokens":
+        raise ValueError(f"不支持的长度单位: {unit}")
+    if tokenizer:
+        model = _load_tokenizer(str(tokenizer))
+        return lambda text: len(model.encode(text, add_special_tokens=False).ids)
+    return estimate_tokens
+
+def chunking_settings(file_type: str, overrides: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """文件类型（扩展名）的分块配置：全局 default < 全局该类型 < 覆盖的 default < 覆盖的该类型"""
+    overrides = overrides or {}
+    return {
+        **CHUNKING_SETTINGS["default"],
+        **CHUNKING_SETTINGS.get(file_type, {}),
+        **overrides.get("default", {}),
+        **overrides.get(file_type, {})
+    }
+
+class Chunker:
+    """分块器接口"""
+
+    def __init__(self, chunk_size: int, chunk_overlap: int = 0, length: Callable[[str], int] = len):
+        if chunk_overlap >= chunk_size:
+            raise ValueError(f"分块重叠 {chunk_overlap} 不能大于等于块大小 {chunk_size}")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.length = length
+
+    def split(self, text: str, context: Any = None) -> List[Chunk]:
+        """切分文本；context 为上一次切分留下的状态（流式切分时使用）"""
+        raise NotImplementedError
+
+class RecursiveChunker(Chunker):
+    """按分隔符递归切分（LangChain RecursiveCharacterTextSplitter）"""
+
+    def __init__(self, chunk_size: int, chunk_overlap: int = 0, length: Callable[[str], int] = len,
+                 separators: Optional[List[str]] = None):
+        super().__init__(chunk_size, chunk_overlap, length)
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        self.splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=length,
+            add_start_index=True,
+            **({"separators": separators} if separators else {})
+        )
+
+    def split(self, text: str, context: Any = None) -> List[Chunk]:
+        chunks = []
+        for doc in self.splitter.create_documents([text]):
+            start = doc.metadata["start_index"]
+            chunks.append(Chunk(doc.page_content, start if start >= 0 else 0))
+        return chunks
+
+def split_sentences(text: str) -> List[Tuple[int, int]]:
+    """句子在文本中的 (起, 止) 位置，不含首尾空白"""
+    spans = []
+    start = 0
+    for match in _SENTENCE_BOUNDARY.finditer(text):
+        spans.append((start, match.end()))
+        start = match.end()
+    spans.append((start, len(text)))
+
+    trimmed = []
+    for start, end in spans:
+        sentence = text[start:end]
+        stripped = sentence.strip()
+        if stripped:
+            offset = start + len(sentence) - len(sentence.lstrip())
+            trimmed.append((offset, offset + len(stripped)))
+    return trimmed
+
+class SentenceChunker(Chunker):
+    """按句装箱：块在句末切开，重叠部分由完整的句子组成"""
+
+    def __init__(self, chunk_size: int, chunk_overlap: int = 0, length: Callable[[str], int] = len):
+        super().__init__(chunk_size, chunk_overlap, length)
+        # 单句超过块大小时按逗号、空格等继续切分（不重叠）
+        self._clause_splitter = RecursiveChunker(chunk_size, 0, length, _CLAUSE_SEPARATORS)
+
+    def split(self, text: str, context: Any = None) -> List[Chunk]:
+        chunks: List[Chunk] = []
+        current: List[Tuple[int, int, int]] = []   # (起, 止, 长度)
+        size = 0
+
+        def emit():
+            chunks.append(Chunk(text[current[0][0]:current[-1][1]], current[0][0], context=context))
+
+        for start, end in split_sentences(text):
+            sentence_length = self.length(text[start:end])
+            if sentence_length > self.chunk_size:
+                if current:
+                    emit()
+                    current, size = [], 0
+                for piece in self._clause_splitter.split(text[start:end]):
+                    chunks.append(Chunk(piece.content, start + piece.start, context=context))
+                continue
+            if current and size + sentence_length > self.chunk_size:
+                emit()
+                # 末尾若干整句作为下一块的开头
+                kept, kept_size = [], 0
+                for item in reversed(current):
+                    if kept_size + item[2] > self.chunk_overlap or kept_size + item[2] + sentence_length > self.chunk_size:
+                        break
+                    kept.insert(0, item)
+                    kept_size += item[2]
+                current, size = kept, kept_size
+            current.append((start, end, sentence_length))
+            size += sentence_length
+        if current:
+            emit()
+        return chunks
+
+class MarkdownChunker(Chunker):
+    """按标题切分章节，相邻的短章节合并，过长的章节按句切分；代码块中的 # 不视为标题
+
+    context 为块起始处的 (标题路径, 是否在代码块中)。
+    """
+
+    def __init__(self, chunk_size: int, chunk_overlap: int = 0, length: Callable[[str], int] = len):
+        super().__init__(chunk_size, chunk_overlap, length)
+        self._section_chunker = SentenceChunker(chunk_size, chunk_overlap, length)
+
+    def split(self, text: str, context: Any = None) -> List[Chunk]:
+        headings, in_fence = context or ((), False)
+        headings = list(headings)
+
+        # 代码块的边界位置，用于判断任意位置是否在代码块中
+        fences = [match.start() for match in _FENCE.finditer(text)]
+
+        def fenced(position: int) -> bool:
+            return in_fence != (bisect.bisect_right(fences, position) % 2 == 1)
+
+        # 章节：(起, 止, 标题路径)
+        sections: List[Tuple[int, int, Tuple[Tuple[int, str], ...]]] = []
+        start = 0
+        for match in _HEADING.finditer(text):
+            if fenced(match.start()):
+                continue
+            if match.start() > start:
+                sections.append((start, match.start(), tuple(headings)))
+            level = len(match.group(1))
+            headings = [item for item in headings if item[0] < level] + [(level, match.group(2).strip())]
+            start = match.start()
+        sections.append((start, len(text), tuple(headings)))
+
+        chunks: List[Chunk] = []
+        merged_start, merged_end, merged_headings = None, None, None
+        merged_size = 0
+
+        def emit(section_start: int, section_end: int, path: Tuple[Tuple[int, str], ...]):
+            section = text[section_start:section_end]
+            if not section.strip():
+                return
+            metadata = {"headings": " > ".join(title for _, title in path)} if path else None
+            if self.length(section) <= self.chunk_size:
+                offset = section_start + len(section) - len(section.lstrip())
+                chunks.append(Chunk(section.strip(), offset, metadata, (path, fenced(offset))))
+                return
+            for piece in self._section_chunker.split(section):
+                position = section_start + piece.start
+                chunks.append(Chunk(piece.content, position, metadata, (path, fenced(position))))
+
+        for section_start, section_end, path in sections:
+            section_size = self.length(text[section_start:section_end])
+            if merged_start is not None and merged_size + section_size <= self.chunk_size:
+                merged_end = section_end
+                merged_size += section_size
+                continue
+            if merged_start is not None:
+                emit(merged_start, merged_end, merged_headings)
+            merged_start, merged_end, merged_headings, merged_size = section_start, section_end, path, section_size
+        if merged_start is not None:
+            emit(merged_start, merged_end, merged_headings)
+        return chunks
+
+def parent_id(content: str) -> str:
+    """父块ID（按内容哈希）"""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+
+def create_chunker(strategy: str, chunk_size: int, chunk_overlap: int = 0,
+                   length: Callable[[str], int] = len) -> Chunker:
+    """按策略名创建分块器"""
+    if strategy == "recursive":
+        return RecursiveChunker(chunk_size, chunk_overlap, length)
+    if strategy == "sentence":
+        return SentenceChunker(chunk_size, chunk_overlap, length)
+    if strategy == "markdown":
+        return MarkdownChunker(chunk_size, chunk_overlap, length)
+    raise ValueError(f"不支持的分块策略: {strategy}")
+
+def create_chunkers(settings: Dict[str, Any]) -> Tuple[Chunker, Optional[Chunker]]:
+    """按分块配置创建 (分块器, 子块分块器)；未启用父子分块时子块分块器为 None
+
+    启用父子分块时，第一个分块器切出父块（不重叠），子块分块器再把父块切成子块。
+    """
+    length = length_function(settings["length_unit"], settings.get("tokenizer"))
+    parent_size = settings.get("parent_chunk_size")
+    if not parent_size:
+        return create_chunker(settings["strategy"], settings["chunk_size"], settings["chunk_overlap"], length), None
+    if parent_size <= settings["chunk_size"]:
+        raise ValueError(f"父块大小 {parent_size} 应大于子块大小 {settings['chunk_size']}")
+    parent = create_chunker(settings["strategy"], parent_size, 0, length)
+    # 父块已按结构切分，子块只需按句切分
+    child = SentenceChunker(settings["chunk_size"], settings["chunk_overlap"], length)
+    return parent, child
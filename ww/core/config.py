@@ -1,9 +1,13 @@
+"""
+配置
+
+导入本模块没有副作用：.env 只读取、不写入进程环境变量，也不创建目录。
+入口脚本（界面、API 服务、命令行）在启动时调用 initialize()，
+把 .env 加载到环境变量（供第三方库读取）并创建数据目录。
+"""
 import os
 from pathlib import Path
-from dotenv import load_dotenv
-
-# 加载环境变量
-load_dotenv()
+from typing import Dict, Optional
 
 # 项目根目录
 ROOT_DIR = Path(__file__).parent.parent
@@ -14,9 +18,39 @@ DOCUMENTS_DIR = DATA_DIR / "documents"
 VECTOR_STORE_DIR = DATA_DIR / "vector_store"
 LOGS_DIR = DATA_DIR / "logs"
 
-# 确保目录存在
-for dir_path in [DOCUMENTS_DIR, VECTOR_STORE_DIR, LOGS_DIR]:
-    dir_path.mkdir(parents=True, exist_ok=True)
+def _find_dotenv() -> Optional[Path]:
+    """从项目根目录向上查找 .env"""
+    for directory in (ROOT_DIR, *ROOT_DIR.parents):
+        if (directory / ".env").is_file():
+            return directory / ".env"
+    return None
+
+DOTENV_FILE = _find_dotenv()
+
+def _read_dotenv() -> Dict[str, str]:
+    if DOTENV_FILE is None:
+        return {}
+    from dotenv import dotenv_values
+    return {name: value for name, value in dotenv_values(DOTENV_FILE).items() if value is not None}
+
+_DOTENV = _read_dotenv()
+
+def getenv(name: str, default: Optional[str] = None) -> Optional[str]:
+    """读取配置项：环境变量优先，其次 .env"""
+    return os.environ.get(name, _DOTENV.get(name, default))
+
+_initialized = False
+
+def initialize():
+    """加载 .env 到环境变量并创建数据目录；由入口脚本调用，重复调用无影响"""
+    global _initialized
+    if _initialized:
+        return
+    for name, value in _DOTENV.items():
+        os.environ.setdefault(name, value)
+    for dir_path in [DOCUMENTS_DIR, VECTOR_STORE_DIR, LOGS_DIR]:
+        dir_path.mkdir(parents=True, exist_ok=True)
+    _initialized = True
 
 # 模型配置
 DEFAULT_MODEL = "qwen2.5:7b"
@@ -33,7 +67,44 @@ AVAILABLE_MODELS = [
 ]
 
 # Ollama配置
-OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+OLLAMA_BASE_URL = getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+
+# 模型在 Ollama 中的保活时间，保持驻留可复用相同消息前缀的 KV 缓存
+DEFAULT_KEEP_ALIVE = "10m"
+
+# 按模型设置的保活时间（大模型加载慢，驻留更久）；-1 表示一直驻留
+MODEL_KEEP_ALIVE = {
+    "qwen2.5:72b": "60m",
+    "llama2:70b": "60m",
+    "mixtral:8x7b": "30m"
+}
+
+# 启动时预加载的模型
+PRELOAD_MODELS = [DEFAULT_MODEL]
+
+# 会话记忆配置
+MEMORY_SETTINGS = {
+    "token_budget": 2000,       # 历史消息（含摘要）的 token 上限，超出后折叠较早的轮次
+    "keep_recent_turns": 2,     # 始终原样保留的最近轮数
+    "summary_max_chars": 300,   # 摘要长度上限（字）
+    "summary_max_tokens": 512
+}
+
+# 异步对话配置
+ASYNC_CHAT_SETTINGS = {
+    "max_connections": 64,            # 与 Ollama 的连接池大小
+    "max_concurrency_per_model": 4,   # 每个模型同时生成的请求数上限
+    "first_token_timeout": 120,       # 等待首个 token 的超时（秒），包含模型加载时间
+    "idle_timeout": 60,               # 相邻 token 的最长间隔（秒）
+    "total_timeout": 600,             # 单次生成的总时长上限（秒）
+    "warm_up_interval": 300           # 同一模型两次预热的最小间隔（秒）
+}
+
+# 流式输出的合并节奏：攒够 max_pieces 个片段或距上次输出超过 interval 秒时输出一次
+STREAM_RENDER_SETTINGS = {
+    "interval": 0.05,
+    "max_pieces": 32
+}
 
 # 模型参数配置
 DEFAULT_MODEL_PARAMS = {
@@ -50,20 +121,244 @@ CHROMA_SETTINGS = {
     "anonymized_telemetry": False
 }
 
+# HNSW 索引配置
+# space、construction_ef、M 只在创建 collection 时生效，修改后需运行 python maintain.py rebuild 重建；
+# 其余为运行参数，下次打开向量库时更新到 collection
+HNSW_SETTINGS = {
+    "space": "cosine",
+    "construction_ef": 200,    # 建索引时的候选数，越大召回越高、入库越慢（Chroma 默认 100）
+    "M": 32,                   # 每个节点的邻居数，越大召回越高、占用内存越多（Chroma 默认 16）
+    "search_ef": 64,           # 检索时的候选数，越大召回越高、检索越慢（Chroma 默认 10）
+    "num_threads": None,       # 建索引线程数，None 表示使用 CPU 核数
+    "batch_size": 1000,        # 写入时先缓存在内存中的向量数（Chroma 默认 100）
+    "sync_threshold": 5000,    # 索引落盘的间隔向量数（Chroma 默认 1000）
+    "resize_factor": None      # 索引扩容倍数，None 表示使用默认值
+}
+# 只能在创建 collection 时指定的 HNSW 参数
+HNSW_BUILD_PARAMS = ("space", "construction_ef", "M")
+
+# 向量库后端（知识库可用 vector_backend 单独设置），更换后端需要重新入库：
+# - chroma: Chroma collection，HNSW 索引与 float32 向量常驻内存
+# - mmap: 量化向量矩阵按内存映射读取，元数据在 SQLite 中（见 core/mmap_index.py），
+#   内存占用小、打开快，多个进程共享同一份页缓存
+VECTOR_BACKENDS = ["chroma", "mmap"]
+VECTOR_BACKEND = getenv("VECTOR_BACKEND", "chroma")
+# mmap 后端的索引目录（在向量库目录下）
+MMAP_INDEX_NAME = "mmap_index"
+
+# mmap 后端配置；dtype、rescore 在创建索引时确定，nlist 修改后运行 python maintain.py rebuild 重新分区
+# 距离类型沿用 HNSW_SETTINGS["space"]
+MMAP_INDEX_SETTINGS = {
+    "dtype": "float16",         # float16（误差很小）或 int8（按向量缩放的对称量化，只占 float32 的 1/4）
+    "rescore": True,            # 另存 float32 向量（只在磁盘上），对量化打分的前若干候选精确重算距离
+    "rescore_factor": 4,        # 精确重算的候选数 = n_results × rescore_factor
+    "nlist": 0,                 # IVF 分区数，0 表示不分区（每次全量扫描）；块数很多时建议约为 4 × sqrt(块数)
+    "nprobe": 8,                # 每次检索扫描的分区数，越大召回越高、检索越慢
+    "train_sample": 100000,     # 训练分区中心使用的最大向量数
+    "scan_block_rows": 16384    # 扫描时每批读取的行数（限制临时内存）
+}
+
+# 嵌入模型配置
+EMBEDDING_SETTINGS = {
+    "backend": getenv("EMBEDDING_BACKEND", "default"),   # default: Chroma自带本地模型; ollama: Ollama嵌入接口
+    "model": getenv("EMBEDDING_MODEL", "nomic-embed-text"),  # backend 为 ollama 时使用的模型
+    "batch_size": 32
+}
+
+# 向量缓存配置
+EMBEDDING_CACHE_DIR = DATA_DIR / "embedding_cache"
+EMBEDDING_CACHE_SETTINGS = {
+    "enabled": True,
+    "max_entries": 500000,
+    "max_bytes": 1024 * 1024 * 1024,  # 1GB
+    # 命中时最近访问时间的精度（秒）：距上次记录不足该时长的不再更新，更新先在内存中累积，
+    # 攒够一批或超过该时长后一次写入
+    "touch_interval": 60
+}
+
+# 文件目录（记录每个文件的块ID、哈希等），保存在向量库目录下
+FILE_CATALOG_NAME = "file_catalog.sqlite3"
+# 关键词倒排索引，保存在向量库目录下
+KEYWORD_INDEX_NAME = "keyword_index.sqlite3"
+
 # 文档处理配置
 DEFAULT_CHUNK_SIZE = 1000
 DEFAULT_CHUNK_OVERLAP = 200
 
+# 分块配置：按文件类型（扩展名）选择分块方式，未列出的项使用 default 中的值
+# strategy: recursive（按段落/换行/空格递归切分）、sentence（按句切分，识别 。！？；）、markdown（按标题切分章节）
+# length_unit: chars（字符数）或 tokens（token 数）；中文按字符计数会严重低估 token 数
+# tokenizer: 计算 token 数的分词器（tokenizer.json 路径，如生成模型对应的分词器），None 表示按字符类别估算
+# parent_chunk_size: 非空时启用父子分块，按 chunk_size 切出的子块入库检索，命中后返回所在的父块
+# 修改后需重新入库；python benchmarks/bench_chunking.py 可比较不同配置的块数、索引大小与命中率
+CHUNKING_SETTINGS = {
+    "default": {
+        "strategy": "recursive",
+        "length_unit": "chars",
+        "chunk_size": DEFAULT_CHUNK_SIZE,
+        "chunk_overlap": DEFAULT_CHUNK_OVERLAP,
+        "tokenizer": None,
+        "parent_chunk_size": None
+    },
+    # 示例：
+    # ".md": {"strategy": "markdown", "length_unit": "tokens", "chunk_size": 300, "chunk_overlap": 30},
+    # ".pdf": {"strategy": "sentence", "length_unit": "tokens", "chunk_size": 128, "chunk_overlap": 0,
+    #          "parent_chunk_size": 512},
+}
+# 父子分块时检索的子块数为 n_results 的倍数（同一父块的子块只保留一个，再取前 n_results 个）
+PARENT_FETCH_FACTOR = 3
+
+# 知识库配置：每个知识库是独立的向量库（collection、文件目录、关键词索引）和文档目录，
+# 可单独设置分块方式（chunking，结构同 CHUNKING_SETTINGS，覆盖其中的项）、嵌入模型（embedding，覆盖 EMBEDDING_SETTINGS 中的项）
+# 与向量库后端（vector_backend，默认 VECTOR_BACKEND）。
+# 默认知识库沿用原有的 VECTOR_STORE_DIR 与 DOCUMENTS_DIR，其他知识库保存在 KNOWLEDGE_BASES_DIR/<名称> 下；
+# 名称用作目录名，只能包含字母、数字、下划线和连字符。修改已有知识库的分块或嵌入模型后需重新入库
+KNOWLEDGE_BASES_DIR = DATA_DIR / "knowledge_bases"
+DEFAULT_KNOWLEDGE_BASE = "default"
+KNOWLEDGE_BASES = {
+    DEFAULT_KNOWLEDGE_BASE: {"title": "默认知识库"},
+    # 示例：
+    # "legal": {"title": "法务", "chunking": {"default": {"strategy": "sentence", "length_unit": "tokens",
+    #                                                      "chunk_size": 256, "chunk_overlap": 32}}},
+    # "research": {"title": "研发", "embedding": {"backend": "ollama", "model": "nomic-embed-text"}},
+    # "archive": {"title": "归档", "vector_backend": "mmap"},
+}
+KNOWLEDGE_BASE_SEARCH_WORKERS = 8   # 同时检索多个知识库时的线程数
+
+# PDF 解析配置
+PDF_PARSE_WORKERS = 4           # 按页并行提取的进程数，1 表示不并行
+PDF_PARALLEL_MIN_PAGES = 200    # 页数达到该值时才启用并行提取
+PDF_PAGES_PER_TASK = 8          # 每个并行任务提取的页数
+
+# 批量入库配置
+SUPPORTED_FILE_TYPES = [".pdf", ".docx", ".txt", ".md"]
+DEFAULT_INGEST_PARAMS = {
+    "parse_workers": None,       # 解析进程数，None 表示使用CPU核数
+    "embed_workers": 4,          # 计算向量的线程数
+    "embed_batch_size": 64,      # 每批计算向量的块数
+    "insert_batch_size": 512,    # 每批写入向量库的块数
+    "max_pending_files": 16      # 同时在解析中的文件数上限，用于控制内存
+}
+
+# 后台入库任务队列：界面上传的文件写入 SQLite 任务表后立即返回，由后台线程解析并入库。
+# 任务表持久化保存，页面刷新或进程重启后未完成的任务继续执行；多个进程可共用同一任务表
+JOB_QUEUE_SETTINGS = {
+    "db_path": DATA_DIR / "ingest_jobs.sqlite3",
+    "workers": 2,                # 每个进程同时入库的文件数
+    "max_attempts": 3,           # 每个任务最多尝试的次数（含首次）
+    "retry_delay": 5.0,          # 首次重试前等待的秒数，之后每次翻倍
+    "poll_interval": 1.0,        # 空闲时检查新任务（含其他进程提交的任务）的间隔（秒）
+    "heartbeat_interval": 10.0,  # 执行中的任务刷新心跳的间隔（秒）
+    "stale_after": 60.0,         # 心跳超过该时长未刷新的任务视为进程已退出，重新排队
+    "keep_finished": 500,        # 保留的已结束（成功、失败、取消）任务数
+    "ui_refresh_interval": 2.0   # 侧边栏刷新任务状态的间隔（秒）
+}
+
 # 检索配置
 DEFAULT_SEARCH_PARAMS = {
     "n_results": 5,
-    "similarity_threshold": 0.7
+    "similarity_threshold": 0.7,
+    "mode": "hybrid",  # hybrid: 向量+关键词融合; vector: 纯向量; keyword: 纯关键词
+    "knowledge_bases": [DEFAULT_KNOWLEDGE_BASE],  # 检索的知识库，多个时并行检索后按相关度合并
+    "rerank": False   # 多取候选后重排序，只保留前 n_results 个（见 RERANK_SETTINGS）
+}
+
+# 重排序配置：先多取 candidates 个候选，用交叉编码器或 Ollama 重新打分后保留前 n_results 个，
+# 少而精的文档能明显缩短提示词处理时间。超过 timeout 时放弃重排序，按原检索顺序返回
+RERANK_SETTINGS = {
+    "backend": getenv("RERANK_BACKEND", "cross_encoder"),  # cross_encoder: 本地 ONNX 模型; ollama: Ollama 打分
+    # cross_encoder 使用的模型目录，需包含 model.onnx 与 tokenizer.json（如 bge-reranker-base 导出的 ONNX）
+    "model_path": getenv("RERANK_MODEL_PATH", str(DATA_DIR / "models" / "bge-reranker-base")),
+    "ollama_model": getenv("RERANK_OLLAMA_MODEL", "qwen2.5:0.5b"),  # backend 为 ollama 时使用的模型
+    "candidates": 50,        # 重排序的候选数
+    "timeout": 2.0,          # 重排序的耗时上限（秒）
+    "batch_size": 16,        # 交叉编码器每批打分的候选数
+    "max_length": 512,       # 交叉编码器输入的最大 token 数（问题+文档）
+    "num_threads": None,     # 交叉编码器的推理线程数，None 表示由 ONNX Runtime 决定
+    "ollama_workers": 4,     # Ollama 同时打分的请求数
+    "max_chars": 1000        # Ollama 打分时每个文档截取的字符数
+}
+
+# 上下文打包配置：检索到的文档在提示词中可占用的 token 预算
+DEFAULT_CONTEXT_TOKEN_BUDGET = 1500
+MODEL_CONTEXT_TOKEN_BUDGETS = {
+    "qwen2.5:14b": 3000,
+    "qwen2.5:72b": 6000,
+    "llama2:13b": 2000,
+    "llama2:70b": 2000,
+    "mixtral:8x7b": 6000
+}
+
+# 混合检索配置
+HYBRID_SEARCH_SETTINGS = {
+    "candidate_factor": 4,   # 每路召回 n_results 的倍数作为候选
+    "rrf_k": 60,             # 倒数排名融合常数
+    "bm25_k1": 1.5,
+    "bm25_b": 0.75,
+    # 关键词检索时跳过出现在超过该比例块中的词（如“的”“是”），这些词的 idf 很小，
+    # 却要读取几乎整个倒排表；查询中的词都很常见时只保留最少见的一个
+    "max_df_ratio": 0.3,
+    "max_query_terms": 32    # 查询词过多时只保留最少见的若干个
+}
+
+# 查询缓存配置
+QUERY_CACHE_SETTINGS = {
+    "enabled": True,
+    "retrieval_max_entries": 1000,   # 检索结果缓存条数
+    "retrieval_ttl": 600,            # 检索结果缓存有效期（秒）
+    "answer_max_entries": 500,       # 回答缓存条数
+    "answer_ttl": 3600,              # 回答缓存有效期（秒）
+    "semantic_threshold": 0.95       # 近似问题的向量相似度阈值，None 表示只做精确匹配
+}
+
+# 批量问答配置（batch_qa.py）：问题分批检索，检索结果经有界队列交给并发的生成协程
+BATCH_QA_SETTINGS = {
+    "retrieval_batch_size": 32,   # 每批检索的问题数（一次计算查询向量、一次向量检索）
+    "concurrency": 4,             # 同时生成的问题数，应与 Ollama 的 OLLAMA_NUM_PARALLEL 相当
+    "queue_size": 64,             # 已检索、等待生成的问题数上限
+    # 是否按相似度复用近似问题的回答；评测时每个问题都应独立生成，默认只做精确匹配
+    "semantic_cache": False
+}
+
+# HTTP API 服务配置
+API_SETTINGS = {
+    "host": getenv("API_HOST", "0.0.0.0"),
+    "port": int(getenv("API_PORT", "8000")),
+    "embedding_batch_window": 0.005,   # 查询向量合并计算的时间窗口（秒）
+    "embedding_max_batch": 64,         # 每批最多合并的查询数
+    # /ingest 只接受该目录下的文件；设置 API_INGEST_TOKEN 时入库与删除文档的请求需带 X-API-Key 头
+    "ingest_root": Path(getenv("API_INGEST_ROOT", str(DOCUMENTS_DIR))),
+    "ingest_token": getenv("API_INGEST_TOKEN")
+}
+
+# 延迟追踪与指标配置
+METRICS_SETTINGS = {
+    "enabled": True,
+    # 每个请求的各阶段耗时，与对话日志一样每个进程写入 traces.<进程名>.<PID>.jsonl；None 表示不写文件
+    "trace_file": LOGS_DIR / "traces.jsonl",
+    "recent_samples": 1000,                     # 每个指标保留用于计算分位数的最近样本数
+    "recent_traces": 50,                        # 看板中展示的最近请求数
+    # 耗时直方图的桶（秒）
+    "latency_buckets": [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0],
+    # 生成速度直方图的桶（token/秒）
+    "throughput_buckets": [1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200]
 }
 
 # 日志配置
 LOG_FILE = LOGS_DIR / "app.log"
 MAX_LOG_SIZE = 10 * 1024 * 1024  # 10MB
 BACKUP_COUNT = 5
+# 按进程区分的日志文件（对话、追踪）在最后一次写入后保留的天数，过期的在其他进程启动时删除
+PROCESS_LOG_MAX_AGE_DAYS = 30
+
+# 对话日志配置：各进程（界面、API、批量问答等）分别写入 chat.<进程名>.<PID>.jsonl，
+# 由本进程的后台线程写入并按大小轮转，进程之间不共用文件；同一进程内各会话以 session_id 区分
+CHAT_LOG_SETTINGS = {
+    "file": LOGS_DIR / "chat.jsonl",   # 基础文件名，实际文件名中插入进程名与 PID
+    "max_input_chars": 2000,      # 用户输入截断长度
+    "max_response_chars": 4000,   # 回答截断长度
+    "max_docs": 20                # 最多记录的相关文档数（只记录 ID 与分数，不记录内容）
+}
 
 # 界面配置
 DEFAULT_UI_CONFIG = {
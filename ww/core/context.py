@@ -0,0 +1,142 @@
+"""
+上下文打包
+
+把检索到的文档块装入模型的 token 预算：
+- 去掉完全重复的块
+- 同一文件中相邻的块合并，并去除分块时产生的重叠文本（只在分块配置了重叠时，
+  且重叠至少为配置值的一半，避免把恰好相同的边界字符当作重叠）
+- 按相关度排序，依次装入直到预算用完
+"""
+import re
+from pathlib import Path
+from typing import List, Dict, Any
+from .config import (
+    DEFAULT_CHUNK_OVERLAP, DEFAULT_CONTEXT_TOKEN_BUDGET, MODEL_CONTEXT_TOKEN_BUDGETS, KNOWLEDGE_BASES
+)
+from .keyword_index import CJK_RANGES
+
+_CJK_PATTERN = re.compile(rf"[{CJK_RANGES}]")
+
+# 预算剩余不足该 token 数时不再截断装入
+MIN_TRUNCATED_TOKENS = 64
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中日韩文字约每字 1 个 token，其他字符约每 4 个字符 1 个 token"""
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+def token_budget_for(model: str) -> int:
+    """模型可用于文档上下文的 token 预算"""
+    return MODEL_CONTEXT_TOKEN_BUDGETS.get(model, DEFAULT_CONTEXT_TOKEN_BUDGET)
+
+def relevance(doc: Dict[str, Any]) -> float:
+    """文档的相关度分数，越大越相关（重排序后以重排序分数为准）"""
+    if 'rerank_score' in doc:
+        return doc['rerank_score']
+    if 'score' in doc:
+        return doc['score']
+    if 'distance' in doc:
+        return 1.0 - doc['distance']
+    return doc.get('bm25_score', 0.0)
+
+def chunk_overlap_of(metadata: Dict[str, Any]) -> int:
+    """块入库时分块配置的重叠长度
+
+    新入库的块记录在元数据中；此前入库的块按所在知识库与文件类型的当前分块配置推断。
+    """
+    if 'chunk_overlap' in metadata:
+        return metadata['chunk_overlap'] or 0
+    # chunking 依赖本模块的 estimate_tokens，在这里导入避免循环导入
+    from .chunking import chunking_settings
+    overrides = KNOWLEDGE_BASES.get(metadata.get('knowledge_base'), {}).get("chunking")
+    file_type = Path(metadata.get('filename', '')).suffix.lower()
+    return chunking_settings(file_type, overrides)["chunk_overlap"] or 0
+
+def _merge_text(first: str, second: str, max_overlap: int, min_overlap: int = 1) -> str:
+    """拼接相邻块，去除 first 结尾与 second 开头至少 min_overlap 个字符的重叠部分"""
+    if min_overlap > 0:
+        for size in range(min(len(first), len(second), max_overlap), min_overlap - 1, -1):
+            if first.endswith(second[:size]):
+                return first + second[size:]
+    return first + "\n" + second
+
+class ContextPacker:
+    def __init__(self, token_budget: int = DEFAULT_CONTEXT_TOKEN_BUDGET,
+                 max_overlap: int = DEFAULT_CHUNK_OVERLAP * 2):
+        self.token_budget = token_budget
+        self.max_overlap = max_overlap
+
+    def pack(self, documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """返回装入预算的文档片段（合并后的 content、metadata、score），按相关度降序"""
+        segments = []
+        for group in self._group_adjacent(documents):
+            content = group[0]['content']
+            for doc in group[1:]:
+                # 分块没有重叠时直接拼接；有重叠时短于配置一半的匹配视为巧合
+                overlap = chunk_overlap_of(doc['metadata'])
+                content = _merge_text(
+                    content, doc['content'], max(self.max_overlap, overlap * 2), (overlap + 1) // 2 if overlap else 0
+                )
+            metadata = dict(group[0]['metadata'])
+            if len(group) > 1:
+                metadata['merged_chunks'] = [doc['metadata'].get('chunk_id') for doc in group]
+            segments.append({
+                'content': content,
+                'metadata': metadata,
+                'score': max(relevance(doc) for doc in group)
+            })
+        segments.sort(key=lambda segment: segment['score'], reverse=True)
+
+        packed = []
+        remaining = self.token_budget
+        for segment in segments:
+            tokens = estimate_tokens(segment['content'])
+            if tokens <= remaining:
+                packed.append(segment)
+                remaining -= tokens
+            elif remaining >= MIN_TRUNCATED_TOKENS:
+                segment['content'] = self._truncate(segment['content'], remaining)
+                packed.append(segment)
+                remaining = 0
+            if remaining <= 0:
+                break
+        return packed
+
+    def _group_adjacent(self, documents: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """去重，并把同一文件中 chunk_id 相邻的块分为一组"""
+        unique = {}
+        for doc in documents:
+            unique.setdefault(doc['content'], doc)
+
+        # 不同知识库中的同名文件是不同的文件
+        by_file: Dict[tuple, List[Dict[str, Any]]] = {}
+        for doc in unique.values():
+            key = (doc['metadata'].get('knowledge_base'), doc['metadata'].get('filename', ''))
+            by_file.setdefault(key, []).append(doc)
+
+        groups = []
+        for docs in by_file.values():
+            docs.sort(key=lambda doc: doc['metadata'].get('chunk_id', 0))
+            group = [docs[0]]
+            for doc in docs[1:]:
+                previous = group[-1]['metadata'].get('chunk_id')
+                current = doc['metadata'].get('chunk_id')
+                if previous is not None and current is not None and current == previous + 1:
+                    group.append(doc)
+                else:
+                    groups.append(group)
+                    group = [doc]
+            groups.append(group)
+        return groups
+
+    @staticmethod
+    def _truncate(text: str, token_budget: int) -> str:
+        """按 token 估算截断文本"""
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if estimate_tokens(text[:middle]) <= token_budget:
+                low = middle
+            else:
+                high = middle - 1
+        return text[:low]
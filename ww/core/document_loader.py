@@ -1,42 +1,55 @@
+import bisect
+import hashlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any
-import docx
-from pypdf import PdfReader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import TextLoader
-from .config import DEFAULT_CHUNK_SIZE, DEFAULT_CHUNK_OVERLAP
+from typing import List, Dict, Any, Generator, Iterable, Optional, Tuple
+from .config import PDF_PARSE_WORKERS, PDF_PARALLEL_MIN_PAGES, PDF_PAGES_PER_TASK
+from .chunking import Chunk, Chunker, chunking_settings, create_chunkers, parent_id
 from .logger import logger, log_error
 
+# 流式分块时缓冲区累积到多少个块的长度后再切分
+STREAM_BUFFER_CHUNKS = 4
+# 按 token 计长度时，估算缓冲区字符数所用的每 token 字符数（偏大，保证缓冲区够切出多个块）
+CHARS_PER_TOKEN = 4
+# 读取文本文件时每个块的最大字符数
+TEXT_BLOCK_SIZE = 64 * 1024
+
+# (文本块, 页码)；没有页码概念的格式页码为 None
+Block = Tuple[str, Optional[int]]
+
+class DocumentError(ValueError):
+    """文档本身无法入库（文件类型不支持、没有可提取的文本），重试也不会成功"""
+
+def _extract_pdf_pages(file_path: str, start: int, end: int) -> List[str]:
+    """在子进程中提取PDF指定页范围的文本"""
+    from pypdf import PdfReader
+    with open(file_path, 'rb') as file:
+        pdf = PdfReader(file)
+        return [pdf.pages[i].extract_text() or "" for i in range(start, end)]
+
 class DocumentLoader:
-    def __init__(self):
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=DEFAULT_CHUNK_SIZE,
-            chunk_overlap=DEFAULT_CHUNK_OVERLAP,
-            length_function=len,
-        )
+    def __init__(self, pdf_workers: int = PDF_PARSE_WORKERS, chunking: Dict[str, Dict[str, Any]] = None):
+        # 分块配置的覆盖项（按文件类型，结构同 CHUNKING_SETTINGS），分块器按文件类型创建后复用
+        self.chunking = chunking or {}
+        self._chunkers: Dict[str, Tuple[Dict[str, Any], Chunker, Optional[Chunker]]] = {}
+        self.pdf_workers = pdf_workers
+
+    def chunkers_for(self, file_type: str) -> Tuple[Dict[str, Any], Chunker, Optional[Chunker]]:
+        """文件类型的 (分块配置, 分块器, 子块分块器)"""
+        if file_type not in self._chunkers:
+            settings = chunking_settings(file_type, self.chunking)
+            self._chunkers[file_type] = (settings, *create_chunkers(settings))
+        return self._chunkers[file_type]
 
     def load_document(self, file_path: Path) -> List[Dict[str, Any]]:
         """加载文档并分块"""
         try:
-            file_extension = file_path.suffix.lower()
-            content = self._read_file(file_path, file_extension)
-            
-            # 分块处理
-            chunks = self.text_splitter.split_text(content)
-            
-            # 为每个块添加元数据
-            documents = []
-            for i, chunk in enumerate(chunks):
-                doc = {
-                    "content": chunk,
-                    "metadata": {
-                        "source": str(file_path),
-                        "filename": file_path.name,
-                        "chunk_id": i,
-                        "total_chunks": len(chunks)
-                    }
-                }
-                documents.append(doc)
+            documents = list(self.iter_documents(file_path))
+            if not documents:
+                raise DocumentError(f"文档中没有可提取的文本: {file_path.name}")
+            for doc in documents:
+                doc['metadata']['total_chunks'] = len(documents)
             
             logger.info(f"成功加载文档: {file_path.name}, 生成了 {len(documents)} 个块")
             return documents
@@ -45,36 +58,173 @@ class DocumentLoader:
             log_error(e, f"加载文档失败: {file_path}")
             raise
 
-    def _read_file(self, file_path: Path, file_extension: str) -> str:
-        """根据文件类型读取内容"""
+    def iter_documents(self, file_path: Path) -> Generator[Dict[str, Any], None, None]:
+        """流式加载文档，逐块产出（元数据中不含 total_chunks）
+
+        父子分块时产出的是子块，父块内容放在 parent_content 中（不写入元数据）。
+        """
+        file_hash = self.file_hash(file_path)
+        file_type = file_path.suffix.lower()
+        settings, chunker, child_chunker = self.chunkers_for(file_type)
+        buffer_chars = max(settings.get("parent_chunk_size") or 0, settings["chunk_size"]) * STREAM_BUFFER_CHUNKS
+        if settings["length_unit"] == "tokens":
+            buffer_chars *= CHARS_PER_TOKEN
+        blocks = self._read_file(file_path, file_type)
+
+        chunk_id = 0
+        for chunk, page in self._split_stream(blocks, chunker, buffer_chars):
+            if child_chunker is None:
+                pieces = [(chunk, None)]
+            else:
+                parent = {"content": chunk.content, "id": parent_id(chunk.content)}
+                pieces = [(child, parent) for child in child_chunker.split(chunk.content)]
+            for piece, parent in pieces:
+                metadata = {
+                    "source": str(file_path),
+                    "filename": file_path.name,
+                    "chunk_id": chunk_id,
+                    "file_hash": file_hash,
+                    # 上下文打包时据此判断相邻块之间是否有重叠文本
+                    "chunk_overlap": settings["chunk_overlap"],
+                    **(chunk.metadata or {})
+                }
+                if page is not None:
+                    metadata["page"] = page
+                document = {"content": piece.content, "metadata": metadata}
+                if parent is not None:
+                    metadata["parent_id"] = parent["id"]
+                    document["parent_content"] = parent["content"]
+                chunk_id += 1
+                yield document
+
+    @staticmethod
+    def file_hash(file_path: Path) -> str:
+        """计算文件内容的哈希"""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as file:
+            for block in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def _split_stream(blocks: Iterable[Block], chunker: Chunker,
+                      threshold: int) -> Generator[Tuple[Chunk, Optional[int]], None, None]:
+        """增量分块：缓冲区只保留少量文本，切分后保留最后一块与后续文本一起再切分
+
+        最后一块起始处的分块状态（如 Markdown 的标题路径）随剩余文本一起传给下一次切分。
+        """
+        parts: List[str] = []
+        offsets: List[int] = []
+        pages: List[Optional[int]] = []
+        size = 0
+        context = None
+
+        def page_at(index: int) -> Optional[int]:
+            position = bisect.bisect_right(offsets, max(index, 0)) - 1
+            return pages[max(position, 0)]
+
+        for text, page in blocks:
+            if not text:
+                continue
+            offsets.append(size)
+            pages.append(page)
+            parts.append(text)
+            size += len(text)
+            if size < threshold:
+                continue
+
+            buffer = "".join(parts)
+            chunks = chunker.split(buffer, context)
+            if not chunks:
+                parts, offsets, pages, size = [], [], [], 0
+                continue
+            for chunk in chunks[:-1]:
+                yield chunk, page_at(chunk.start)
+
+            # 最后一块可能被截断，与后续文本一起重新切分
+            last = chunks[-1]
+            start = last.start
+            remainder = buffer[start:]
+            context = last.context
+            keep = max(bisect.bisect_right(offsets, start) - 1, 0)
+            offsets = [0] + [offset - start for offset in offsets[keep + 1:]]
+            pages = pages[keep:]
+            parts = [remainder]
+            size = len(remainder)
+
+        if parts:
+            buffer = "".join(parts)
+            for chunk in chunker.split(buffer, context):
+                yield chunk, page_at(chunk.start)
+
+    def _read_file(self, file_path: Path, file_extension: str) -> Generator[Block, None, None]:
+        """根据文件类型逐块读取内容"""
         try:
             if file_extension == '.pdf':
-                return self._read_pdf(file_path)
+                yield from self._read_pdf(file_path)
             elif file_extension == '.docx':
-                return self._read_docx(file_path)
+                yield from self._read_docx(file_path)
             elif file_extension in ['.txt', '.md']:
-                return self._read_text(file_path)
+                yield from self._read_text(file_path)
             else:
-                raise ValueError(f"不支持的文件类型: {file_extension}")
+                raise DocumentError(f"不支持的文件类型: {file_extension}")
         except Exception as e:
             log_error(e, f"读取文件失败: {file_path}")
             raise
 
-    def _read_pdf(self, file_path: Path) -> str:
-        """读取PDF文件"""
-        text = ""
+    def _read_pdf(self, file_path: Path) -> Generator[Block, None, None]:
+        """逐页读取PDF文件，页数较多时按页并行提取"""
+        # 解析库在首次读取该格式时才导入，不读 PDF/DOCX 的进程不必加载
+        from pypdf import PdfReader
         with open(file_path, 'rb') as file:
             pdf = PdfReader(file)
-            for page in pdf.pages:
-                text += page.extract_text() + "\n"
-        return text
+            total_pages = len(pdf.pages)
+            if self.pdf_workers and self.pdf_workers > 1 and total_pages >= PDF_PARALLEL_MIN_PAGES:
+                parallel = True
+            else:
+                parallel = False
+                for i, page in enumerate(pdf.pages):
+                    yield (page.extract_text() or "") + "\n", i + 1
+        if parallel:
+            yield from self._read_pdf_parallel(file_path, total_pages)
+
+    def _read_pdf_parallel(self, file_path: Path, total_pages: int) -> Generator[Block, None, None]:
+        """在进程池中按页范围提取PDF，按顺序产出，在途任务数有上限以控制内存"""
+        starts = iter(range(0, total_pages, PDF_PAGES_PER_TASK))
+        with ProcessPoolExecutor(max_workers=self.pdf_workers) as pool:
+            window = deque()
+
+            def submit_next():
+                start = next(starts, None)
+                if start is not None:
+                    end = min(start + PDF_PAGES_PER_TASK, total_pages)
+                    window.append((start, pool.submit(_extract_pdf_pages, str(file_path), start, end)))
+
+            for _ in range(self.pdf_workers * 2):
+                submit_next()
+            while window:
+                start, future = window.popleft()
+                submit_next()
+                for offset, text in enumerate(future.result()):
+                    yield text + "\n", start + offset + 1
 
-    def _read_docx(self, file_path: Path) -> str:
-        """读取DOCX文件"""
+    def _read_docx(self, file_path: Path) -> Generator[Block, None, None]:
+        """逐段读取DOCX文件"""
+        import docx
         doc = docx.Document(file_path)
-        return "\n".join([paragraph.text for paragraph in doc.paragraphs])
+        for paragraph in doc.paragraphs:
+            yield paragraph.text + "\n", None
 
-    def _read_text(self, file_path: Path) -> str:
-        """读取文本文件"""
+    def _read_text(self, file_path: Path) -> Generator[Block, None, None]:
+        """按行分批读取文本文件"""
         with open(file_path, 'r', encoding='utf-8') as file:
-            return file.read() 
\ No newline at end of file
+            lines: List[str] = []
+            size = 0
+            for line in file:
+                lines.append(line)
+                size += len(line)
+                if size >= TEXT_BLOCK_SIZE:
+                    yield "".join(lines), None
+                    lines, size = [], 0
+            if lines:
+                yield "".join(lines), None
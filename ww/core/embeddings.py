@@ -0,0 +1,335 @@
+"""
+嵌入模型
+
+- EmbeddingProvider: 嵌入模型接口，同时兼容 Chroma 的 EmbeddingFunction 调用方式
+- DefaultEmbeddingProvider: Chroma 自带的本地 ONNX 模型（all-MiniLM-L6-v2）
+- OllamaEmbeddingProvider: Ollama 的嵌入接口
+- EmbeddingCache / CachedEmbeddingProvider: 以 (模型, 文本哈希) 为键的磁盘缓存，LRU 淘汰
+- EmbeddingBatcher: 把短时间窗口内到达的查询合并成一批计算（异步服务使用）
+"""
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Dict, Any, Optional
+from .config import OLLAMA_BASE_URL, EMBEDDING_SETTINGS, EMBEDDING_CACHE_DIR, EMBEDDING_CACHE_SETTINGS
+from .logger import logger, log_error
+
+if TYPE_CHECKING:
+    import ollama
+
+class EmbeddingProvider:
+    """嵌入模型接口"""
+    model_name = "unknown"
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """计算一组文本的向量"""
+        raise NotImplementedError
+
+    def __call__(self, input: List[str]) -> List[List[float]]:
+        # 兼容 Chroma 的 EmbeddingFunction 接口
+        return self.embed(list(input))
+
+    def stats(self) -> Dict[str, Any]:
+        """运行指标"""
+        return {"model": self.model_name}
+
+class DefaultEmbeddingProvider(EmbeddingProvider):
+    """Chroma 默认的本地 ONNX 嵌入模型"""
+
+    def __init__(self, batch_size: int = EMBEDDING_SETTINGS["batch_size"]):
+        self.model_name = "all-MiniLM-L6-v2"
+        self.batch_size = batch_size
+        from chromadb.utils import embedding_functions
+        self._function = embedding_functions.DefaultEmbeddingFunction()
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        embeddings = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = self._function(texts[start:start + self.batch_size])
+            embeddings.extend([float(x) for x in embedding] for embedding in batch)
+        return embeddings
+
+class OllamaEmbeddingProvider(EmbeddingProvider):
+    """Ollama 嵌入接口"""
+
+    def __init__(self, model_name: str, client: "ollama.Client" = None,
+                 batch_size: int = EMBEDDING_SETTINGS["batch_size"]):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        if client is None:
+            import ollama
+            client = ollama.Client(host=OLLAMA_BASE_URL)
+        self.client = client
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        embeddings = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
+            if hasattr(self.client, "embed"):
+                response = self.client.embed(model=self.model_name, input=batch)
+                embeddings.extend(response["embeddings"])
+            else:
+                # 旧版客户端只支持单条文本
+                for text in batch:
+                    embeddings.append(self.client.embeddings(model=self.model_name, prompt=text)["embedding"])
+        return embeddings
+
+# 累积多少条最近访问时间后写入一次
+TOUCH_BATCH_SIZE = 256
+
+class EmbeddingCache:
+    """以 (模型, 文本哈希) 为键的向量磁盘缓存，超出容量时按最近访问时间淘汰"""
+
+    def __init__(self, db_path: Path, max_entries: int = EMBEDDING_CACHE_SETTINGS["max_entries"],
+                 max_bytes: int = EMBEDDING_CACHE_SETTINGS["max_bytes"],
+                 touch_interval: float = EMBEDDING_CACHE_SETTINGS["touch_interval"]):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.touch_interval = touch_interval
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings (last_access)")
+        self._conn.commit()
+        # 条数与字节数在写入、淘汰时增减，不必每次写入都扫描整张表
+        self._count, self._bytes = self._totals()
+        # 待写入的最近访问时间：(模型, 哈希) → 时间
+        self._touched: Dict[tuple, float] = {}
+        self._touched_at = time.time()
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, model: str, hashes: List[str]) -> Dict[str, List[float]]:
+        """批量读取缓存，返回命中的 哈希 → 向量"""
+        found: Dict[str, List[float]] = {}
+        if not hashes:
+            return found
+        with self._lock:
+            unique = list(dict.fromkeys(hashes))
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector, last_access FROM embeddings "
+                    f"WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch]
+                ).fetchall()
+                now = time.time()
+                for text_hash, blob, last_access in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[text_hash] = vector.tolist()
+                    if now - last_access >= self.touch_interval:
+                        self._touched[(model, text_hash)] = now
+            if len(self._touched) >= TOUCH_BATCH_SIZE or (
+                    self._touched and time.time() - self._touched_at >= self.touch_interval):
+                self._flush_touched()
+                self._conn.commit()
+        return found
+
+    def put_many(self, model: str, items: Dict[str, List[float]]):
+        """批量写入缓存，并按容量淘汰"""
+        if not items:
+            return
+        now = time.time()
+        rows = [(model, text_hash, array("f", vector).tobytes(), now) for text_hash, vector in items.items()]
+        with self._lock:
+            # 覆盖已有条目时先减去原来的大小
+            existing = {}
+            hashes = list(items)
+            for start in range(0, len(hashes), 500):
+                batch = hashes[start:start + 500]
+                existing.update(self._conn.execute(
+                    f"SELECT text_hash, LENGTH(vector) FROM embeddings "
+                    f"WHERE model = ? AND text_hash IN ({','.join('?' * len(batch))})",
+                    [model, *batch]
+                ).fetchall())
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, last_access) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self._count += len(rows) - len(existing)
+            self._bytes += sum(len(row[2]) for row in rows) - sum(existing.values())
+            self._flush_touched()
+            self._conn.commit()
+            if self._count > self.max_entries or self._bytes > self.max_bytes:
+                self._evict()
+
+    def _totals(self) -> tuple:
+        return self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()
+
+    def _flush_touched(self):
+        """写入累积的最近访问时间（调用方持有锁并提交）"""
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_access = ? WHERE model = ? AND text_hash = ?",
+                [(now, model, text_hash) for (model, text_hash), now in self._touched.items()]
+            )
+            self._touched.clear()
+        self._touched_at = time.time()
+
+    def _evict(self):
+        """超出条数或字节上限时淘汰最久未访问的条目（调用方持有锁）"""
+        # 淘汰很少发生，此时重新统计一次（其他进程也可能写入同一缓存）
+        self._count, self._bytes = self._totals()
+        if self._count <= self.max_entries and self._bytes <= self.max_bytes:
+            return
+        # 一次多淘汰 10%，避免每次写入都触发淘汰
+        target = min(self.max_entries, int(self._count * self.max_bytes / max(self._bytes, 1)))
+        to_remove = self._count - int(target * 0.9)
+        removed_count, removed_bytes = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM "
+            "(SELECT vector FROM embeddings ORDER BY last_access LIMIT ?)",
+            (to_remove,)
+        ).fetchone()
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE rowid IN "
+            "(SELECT rowid FROM embeddings ORDER BY last_access LIMIT ?)",
+            (to_remove,)
+        )
+        self._conn.commit()
+        self._count -= removed_count
+        self._bytes -= removed_bytes
+        logger.info(f"向量缓存已淘汰 {removed_count} 条")
+
+    def size(self) -> int:
+        with self._lock:
+            return self._count
+
+class CachedEmbeddingProvider(EmbeddingProvider):
+    """带磁盘缓存的嵌入模型，只为未命中的文本调用底层模型"""
+
+    def __init__(self, provider: EmbeddingProvider, cache: EmbeddingCache):
+        self.provider = provider
+        self.model_name = provider.model_name
+        self.cache = cache
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        hashes = [self.cache.text_hash(text) for text in texts]
+        try:
+            cached = self.cache.get_many(self.model_name, hashes)
+        except Exception as e:
+            log_error(e, "读取向量缓存失败")
+            cached = {}
+
+        # 同一批中相同的文本只计算一次
+        missing: Dict[str, str] = {}
+        for text_hash, text in zip(hashes, texts):
+            if text_hash not in cached:
+                missing.setdefault(text_hash, text)
+        if missing:
+            computed = dict(zip(missing, self.provider.embed(list(missing.values()))))
+            try:
+                self.cache.put_many(self.model_name, computed)
+            except Exception as e:
+                log_error(e, "写入向量缓存失败")
+            cached.update(computed)
+
+        with self._lock:
+            self.misses += len(missing)
+            self.hits += len(texts) - len(missing)
+        return [cached[text_hash] for text_hash in hashes]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "model": self.model_name,
+                "cache_hits": self.hits,
+                "cache_misses": self.misses,
+                "cache_hit_rate": round(self.hits / total, 4) if total else 0.0
+            }
+
+class EmbeddingBatcher:
+    """异步微批：同一时间窗口内的查询合并为一次 embed 调用"""
+
+    def __init__(self, provider: EmbeddingProvider, window: float = 0.005, max_batch: int = 64):
+        self.provider = provider
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: List[tuple] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.batches = 0
+        self.requests = 0
+
+    async def embed(self, text: str) -> List[float]:
+        """计算单条文本的向量，与同一窗口内的其他请求合并计算"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        self.requests += 1
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            self.batches += 1
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch: List[tuple]):
+        texts = [text for text, _ in batch]
+        try:
+            embeddings = await asyncio.to_thread(self.provider.embed, texts)
+        except Exception as e:
+            log_error(e, "批量计算查询向量失败")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), embedding in zip(batch, embeddings):
+            if not future.done():
+                future.set_result(embedding)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "avg_batch_size": round(self.requests / self.batches, 2) if self.batches else 0.0
+        }
+
+def create_embedding_provider(settings: Dict = None, client: Optional["ollama.Client"] = None) -> EmbeddingProvider:
+    """按配置创建嵌入模型（默认带磁盘缓存）"""
+    settings = {**EMBEDDING_SETTINGS, **(settings or {})}
+    if settings["backend"] == "ollama":
+        provider = OllamaEmbeddingProvider(settings["model"], client, settings["batch_size"])
+    elif settings["backend"] == "default":
+        provider = DefaultEmbeddingProvider(settings["batch_size"])
+    else:
+        raise ValueError(f"不支持的嵌入模型后端: {settings['backend']}")
+
+    if EMBEDDING_CACHE_SETTINGS["enabled"]:
+        cache = EmbeddingCache(EMBEDDING_CACHE_DIR / "embeddings.sqlite3")
+        provider = CachedEmbeddingProvider(provider, cache)
+    logger.info(f"嵌入模型已创建: {settings['backend']} / {provider.model_name}")
+    return provider
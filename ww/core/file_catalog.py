@@ -0,0 +1,182 @@
+"""
+文件目录（catalog）
+
+以 SQLite 持久化保存每个文件在向量库中的块信息：
+文件名 → 块数量、内容哈希、入库时间（files 表），块ID 逐行保存在 file_chunks 表中，
+分批入库时每批只追加新的块ID，不必重写整个列表。
+列出文件、删除文件时直接查询该表，无需扫描整个 collection。
+父子分块时还保存父块内容（parents 表），检索命中子块后按 parent_id 取出。
+"""
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+
+class FileCatalog:
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                filename TEXT PRIMARY KEY,
+                chunk_ids TEXT NOT NULL,        -- 旧版本的块ID列表（JSON），已迁移到 file_chunks，新记录为空
+                chunk_count INTEGER NOT NULL,
+                content_hash TEXT,
+                ingested_at TEXT NOT NULL
+            )
+            """
+        )
+        # 块ID按插入顺序（rowid）返回
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS file_chunks (
+                filename TEXT NOT NULL,
+                chunk_id TEXT NOT NULL,
+                PRIMARY KEY (filename, chunk_id)
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS parents (
+                filename TEXT NOT NULL,
+                parent_id TEXT NOT NULL,
+                content TEXT NOT NULL,
+                PRIMARY KEY (filename, parent_id)
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_parent_id ON parents (parent_id)")
+        self._migrate_chunk_ids()
+        self._conn.commit()
+        self._has_parents = self._conn.execute("SELECT 1 FROM parents LIMIT 1").fetchone() is not None
+
+    def record(self, filename: str, chunk_ids: List[str], content_hash: str = None,
+               replace: bool = False, keep_hash: bool = False):
+        """记录文件的块ID；replace=False 时与已有记录合并
+
+        keep_hash=True 时保留原有的内容哈希（新文件为空），用于增量更新的中间批次：
+        更新中途失败时文件不会被视为已以新内容入库。
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT chunk_count, content_hash FROM files WHERE filename = ?", (filename,)
+            ).fetchone()
+            if keep_hash:
+                content_hash = row[1] if row else None
+            if replace:
+                self._conn.execute("DELETE FROM file_chunks WHERE filename = ?", (filename,))
+                count = 0
+            else:
+                count = row[0] if row else 0
+            # 已记录的块ID忽略，rowcount 只统计新插入的行
+            count += self._conn.executemany(
+                "INSERT OR IGNORE INTO file_chunks (filename, chunk_id) VALUES (?, ?)",
+                [(filename, chunk_id) for chunk_id in chunk_ids]
+            ).rowcount
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (filename, chunk_ids, chunk_count, content_hash, ingested_at) "
+                "VALUES (?, '', ?, ?, ?)",
+                (filename, count, content_hash, datetime.now().isoformat(timespec="seconds"))
+            )
+            self._conn.commit()
+
+    def remove(self, filename: str) -> List[str]:
+        """删除文件记录，返回其块ID列表"""
+        with self._lock:
+            ids = self._chunk_ids(filename)
+            self._conn.execute("DELETE FROM files WHERE filename = ?", (filename,))
+            self._conn.execute("DELETE FROM file_chunks WHERE filename = ?", (filename,))
+            self._conn.execute("DELETE FROM parents WHERE filename = ?", (filename,))
+            self._conn.commit()
+        return ids
+
+    def record_parents(self, filename: str, parents: Dict[str, str]):
+        """替换文件的父块（parent_id → 内容）"""
+        with self._lock:
+            self._conn.execute("DELETE FROM parents WHERE filename = ?", (filename,))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO parents (filename, parent_id, content) VALUES (?, ?, ?)",
+                [(filename, id, content) for id, content in parents.items()]
+            )
+            self._conn.commit()
+            if parents:
+                self._has_parents = True
+
+    def get_parents(self, parent_ids: List[str]) -> Dict[str, str]:
+        """按 parent_id 批量读取父块内容"""
+        unique = list(dict.fromkeys(parent_ids))
+        if not unique:
+            return {}
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT parent_id, content FROM parents WHERE parent_id IN ({','.join('?' * len(unique))})",
+                unique
+            ).fetchall()
+        return dict(rows)
+
+    @property
+    def has_parents(self) -> bool:
+        """是否有文件使用父子分块（没有时检索不必多取子块）"""
+        return self._has_parents
+
+    def get(self, filename: str) -> Optional[Dict[str, Any]]:
+        """获取单个文件的记录"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT filename, chunk_count, content_hash, ingested_at FROM files WHERE filename = ?", (filename,)
+            ).fetchone()
+            ids = self._chunk_ids(filename) if row else []
+        if not row:
+            return None
+        return {
+            "filename": row[0],
+            "chunk_ids": ids,
+            "chunk_count": row[1],
+            "content_hash": row[2],
+            "ingested_at": row[3]
+        }
+
+    def list_files(self) -> List[str]:
+        """列出所有文件名"""
+        with self._lock:
+            rows = self._conn.execute("SELECT filename FROM files ORDER BY filename").fetchall()
+        return [row[0] for row in rows]
+
+    def is_empty(self) -> bool:
+        """目录是否为空"""
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM files LIMIT 1").fetchone() is None
+
+    def clear(self):
+        """清空目录"""
+        with self._lock:
+            self._conn.execute("DELETE FROM files")
+            self._conn.execute("DELETE FROM file_chunks")
+            self._conn.execute("DELETE FROM parents")
+            self._conn.commit()
+            self._has_parents = False
+
+    def _chunk_ids(self, filename: str) -> List[str]:
+        """文件的块ID（按记录顺序，调用方持有锁）"""
+        rows = self._conn.execute(
+            "SELECT chunk_id FROM file_chunks WHERE filename = ? ORDER BY rowid", (filename,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def _migrate_chunk_ids(self):
+        """旧版本把块ID列表以 JSON 存在 files.chunk_ids 中，移到 file_chunks 表后清空该列"""
+        rows = self._conn.execute("SELECT filename, chunk_ids FROM files WHERE chunk_ids != ''").fetchall()
+        for filename, chunk_ids in rows:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO file_chunks (filename, chunk_id) VALUES (?, ?)",
+                [(filename, chunk_id) for chunk_id in json.loads(chunk_ids)]
+            )
+        if rows:
+            self._conn.execute("UPDATE files SET chunk_ids = '' WHERE chunk_ids != ''")
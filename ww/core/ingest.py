@@ -0,0 +1,190 @@
+"""
+批量入库
+
+对目录树中的文档进行批量解析、计算向量并写入向量库：
+- 解析（PDF/DOCX 等）在进程池中并行执行
+- 向量按固定批大小在线程池中计算
+- 写入按有界批次进行，单个文件失败不影响其他文件
+"""
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+from typing import List, Dict, Any, Callable, Iterable
+from .config import SUPPORTED_FILE_TYPES, DEFAULT_INGEST_PARAMS
+from .document_loader import DocumentLoader
+from .vector_store import VectorStore
+from .logger import logger, log_error, log_file_operation
+
+# 每个解析进程内复用的文档加载器（按分块配置区分）
+_worker_loaders: Dict[str, DocumentLoader] = {}
+
+def _parse_file(file_path: str, chunking: Dict = None) -> List[Dict[str, Any]]:
+    """在解析进程中加载并分块单个文件"""
+    key = json.dumps(chunking or {}, sort_keys=True)
+    if key not in _worker_loaders:
+        # 解析进程本身已并行，不再嵌套按页并行
+        _worker_loaders[key] = DocumentLoader(pdf_workers=1, chunking=chunking)
+    return _worker_loaders[key].load_document(Path(file_path))
+
+def find_documents(directory: Path, recursive: bool = True) -> List[Path]:
+    """查找目录中所有支持的文档"""
+    pattern = "**/*" if recursive else "*"
+    return sorted(
+        path for path in Path(directory).glob(pattern)
+        if path.is_file() and path.suffix.lower() in SUPPORTED_FILE_TYPES
+    )
+
+class IngestProgress:
+    """批量入库进度"""
+
+    def __init__(self, total_files: int):
+        self.total_files = total_files
+        self.processed_files = 0
+        self.failed_files: Dict[str, str] = {}
+        self.skipped_files = 0
+        self.chunks = 0
+        self.started_at = time.perf_counter()
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "total_files": self.total_files,
+            "processed_files": self.processed_files,
+            "skipped_files": self.skipped_files,
+            "failed_files": dict(self.failed_files),
+            "chunks": self.chunks,
+            "elapsed": round(self.elapsed, 3),
+            "chunks_per_second": round(self.chunks / self.elapsed, 1) if self.elapsed else 0.0
+        }
+
+class BulkIngestor:
+    def __init__(self, vector_store: VectorStore, ingest_params: Dict = None, chunking: Dict = None):
+        self.vector_store = vector_store
+        self.params = {**DEFAULT_INGEST_PARAMS, **(ingest_params or {})}
+        # 分块配置的覆盖项（按文件类型，各知识库可不同）
+        self.chunking = chunking
+
+    def ingest_directory(self, directory: Path, recursive: bool = True,
+                         progress_callback: Callable[[IngestProgress], None] = None) -> Dict[str, Any]:
+        """批量入库目录中的所有文档"""
+        files = find_documents(directory, recursive)
+        logger.info(f"在 {directory} 中找到 {len(files)} 个待入库文件")
+        return self.ingest_files(files, progress_callback)
+
+    def ingest_files(self, files: Iterable[Path],
+                     progress_callback: Callable[[IngestProgress], None] = None) -> Dict[str, Any]:
+        """批量入库文件列表，返回入库统计"""
+        files = [Path(f) for f in files]
+        progress = IngestProgress(len(files))
+
+        # 向量库以文件名区分文件，同名文件只入库第一个；内容未变化的文件直接跳过
+        seen = {}
+        queue = []
+        for file_path in files:
+            if file_path.name in seen:
+                progress.failed_files[str(file_path)] = f"文件名与 {seen[file_path.name]} 重复"
+                progress.processed_files += 1
+                continue
+            seen[file_path.name] = file_path
+            try:
+                if self.vector_store.is_indexed(file_path.name, DocumentLoader.file_hash(file_path)):
+                    progress.processed_files += 1
+                    progress.skipped_files += 1
+                    continue
+            except OSError as e:
+                self._fail(progress, file_path, e)
+                continue
+            queue.append(file_path)
+
+        buffer: List[Dict[str, Any]] = []
+        buffered_chunks = 0
+        max_pending = self.params["max_pending_files"]
+
+        with ProcessPoolExecutor(max_workers=self.params["parse_workers"]) as parse_pool, \
+                ThreadPoolExecutor(max_workers=self.params["embed_workers"]) as embed_pool:
+            pending = {}
+            while queue or pending:
+                # 限制同时解析的文件数，避免解析结果堆积占用内存
+                while queue and len(pending) < max_pending:
+                    file_path = queue.pop(0)
+                    pending[parse_pool.submit(
+                        _parse_file, str(file_path), self.chunking
+                    )] = file_path
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    file_path = pending.pop(future)
+                    try:
+                        documents = future.result()
+                        plan = self.vector_store.plan_update(file_path.name, documents)
+                    except Exception as e:
+                        # 解析或生成增量计划失败（如目录表读写出错）只影响这一个文件
+                        self._fail(progress, file_path, e)
+                        continue
+                    buffer.append(plan)
+                    buffered_chunks += len(plan['add'])
+
+                if buffered_chunks >= self.params["insert_batch_size"] or (not queue and not pending):
+                    self._flush(buffer, embed_pool, progress)
+                    buffer, buffered_chunks = [], 0
+
+                if progress_callback:
+                    progress_callback(progress)
+
+        report = progress.to_dict()
+        logger.info(
+            f"批量入库完成: {report['processed_files']}/{report['total_files']} 个文件, "
+            f"新增 {report['chunks']} 个块, 跳过 {report['skipped_files']} 个未变化文件, "
+            f"失败 {len(report['failed_files'])} 个, 用时 {report['elapsed']}s"
+        )
+        return report
+
+    def _flush(self, buffer: List[Dict[str, Any]], embed_pool: ThreadPoolExecutor,
+               progress: IngestProgress):
+        """为缓冲区中各文件新增的块计算向量，并按增量计划分批写入"""
+        # 跨文件合并计算向量，小文件也能填满批次；只有新增或变化的块需要计算
+        texts = [doc['content'] for plan in buffer for doc in plan['add']]
+        try:
+            embeddings = self._embed(texts, embed_pool)
+        except Exception as e:
+            log_error(e, "批量计算向量失败，改为逐个文件计算")
+            embeddings = None
+
+        offset = 0
+        for plan in buffer:
+            filename = plan['filename']
+            count = len(plan['add'])
+            try:
+                if embeddings is not None:
+                    file_embeddings = embeddings[offset:offset + count]
+                else:
+                    file_embeddings = self._embed([doc['content'] for doc in plan['add']], embed_pool)
+                self.vector_store.apply_update(
+                    plan, file_embeddings, batch_size=self.params["insert_batch_size"]
+                )
+                progress.processed_files += 1
+                progress.chunks += count
+                log_file_operation("批量入库", filename, "成功")
+            except Exception as e:
+                self._fail(progress, Path(filename), e)
+            offset += count
+
+    def _embed(self, texts: List[str], embed_pool: ThreadPoolExecutor) -> List[List[float]]:
+        """按固定批大小在线程池中计算向量"""
+        batch_size = self.params["embed_batch_size"]
+        batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+        embeddings = []
+        for batch_embeddings in embed_pool.map(self.vector_store.embed, batches):
+            embeddings.extend(batch_embeddings)
+        return embeddings
+
+    def _fail(self, progress: IngestProgress, file_path: Path, error: Exception):
+        """记录单个文件的失败，不中断整体流程"""
+        log_error(error, f"批量入库失败: {file_path}")
+        log_file_operation("批量入库", file_path.name, "失败")
+        progress.failed_files[str(file_path)] = str(error)
+        progress.processed_files += 1
@@ -0,0 +1,371 @@
+"""
+后台入库任务队列
+
+界面上传文件后只把任务写入 SQLite 任务表并立即返回，由后台线程池解析并入库：
+- 任务表持久化保存，页面刷新、会话结束都不影响已提交的任务；进程退出时执行中的任务
+  停止刷新心跳，超过 stale_after 后由任一进程重新执行
+- 同一知识库中同一文件已在排队（或以相同内容执行中）时不重复提交；
+  同一文件的任务不会同时执行
+- 失败的任务按指数退避重试，超过 max_attempts 后标记为失败，可手动重新提交
+- 每个进程同时执行的任务数由 workers 限制；多个进程可共用同一任务表，
+  领取任务在 BEGIN IMMEDIATE 事务中进行，一个任务只会被一个线程执行
+
+任务状态: pending（排队）→ running（执行中）→ done（完成）/ failed（失败）/ cancelled（已取消）。
+配置见 JOB_QUEUE_SETTINGS。
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+from .config import JOB_QUEUE_SETTINGS, DEFAULT_INGEST_PARAMS
+from .document_loader import DocumentLoader, DocumentError
+from .vector_store import VectorStore
+from .logger import logger, log_error, log_file_operation
+
+JOB_STATUSES = ["pending", "running", "done", "failed", "cancelled"]
+ACTIVE_STATUSES = ("pending", "running")
+FINISHED_STATUSES = ("done", "failed", "cancelled")
+
+# 重试也无法成功的错误（文件已删除、文件类型不支持、没有可提取的文本），直接标记为失败；
+# 其他错误（包括向量库、Ollama 的 ValueError）都按退避时间重试
+PERMANENT_ERRORS = (FileNotFoundError, IsADirectoryError, DocumentError)
+
+_COLUMNS = [
+    "id", "knowledge_base", "path", "filename", "file_hash", "status", "attempts", "progress",
+    "stage", "error", "result", "created_at", "started_at", "finished_at"
+]
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+class IngestJobQueue:
+    """持久化的入库任务队列
+
+    store_factory / loader_factory 按知识库名称返回向量库与文档加载器（通常为 core.resources 中的共享实例），
+    在执行任务时才调用。
+    """
+
+    def __init__(self, store_factory: Callable[[str], VectorStore],
+                 loader_factory: Callable[[str], DocumentLoader],
+                 db_path: Path = JOB_QUEUE_SETTINGS["db_path"], settings: Dict[str, Any] = None):
+        self.store_factory = store_factory
+        self.loader_factory = loader_factory
+        self.settings = {**JOB_QUEUE_SETTINGS, **(settings or {})}
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # 标识本进程中的队列实例，用于刷新自己执行中任务的心跳
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            str(self.db_path), check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                knowledge_base TEXT NOT NULL,
+                path TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                file_hash TEXT,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                progress REAL NOT NULL DEFAULT 0,
+                stage TEXT,
+                error TEXT,
+                result TEXT,
+                created_at TEXT NOT NULL,
+                started_at TEXT,
+                finished_at TEXT,
+                not_before REAL NOT NULL DEFAULT 0,
+                owner TEXT,
+                heartbeat REAL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, not_before)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_path ON jobs (knowledge_base, path)")
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    # ---------- 提交与查询 ----------
+
+    def submit(self, path: Path, knowledge_base: str) -> Dict[str, Any]:
+        """提交入库任务，立即返回任务信息（deduplicated 表示与已有任务合并）"""
+        path = Path(path).resolve()
+        file_hash = DocumentLoader.file_hash(path)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT id, status, file_hash FROM jobs WHERE knowledge_base = ? AND path = ? "
+                    "AND status IN (?, ?) ORDER BY id DESC",
+                    (knowledge_base, str(path), *ACTIVE_STATUSES)
+                ).fetchall()
+                job_id, deduplicated = None, False
+                for row in rows:
+                    # 排队中的任务执行时才读取文件，内容变化也只需一个任务；执行中的任务只合并相同内容
+                    if row["status"] == "pending" or row["file_hash"] == file_hash:
+                        job_id, deduplicated = row["id"], True
+                        if row["status"] == "pending" and row["file_hash"] != file_hash:
+                            self._conn.execute(
+                                "UPDATE jobs SET file_hash = ? WHERE id = ?", (file_hash, job_id)
+                            )
+                        break
+                if job_id is None:
+                    job_id = self._conn.execute(
+                        "INSERT INTO jobs (knowledge_base, path, filename, file_hash, status, created_at) "
+                        "VALUES (?, ?, ?, ?, 'pending', ?)",
+                        (knowledge_base, str(path), path.name, file_hash, _now())
+                    ).lastrowid
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        self._wakeup.set()
+        job = self.get(job_id)
+        job["deduplicated"] = deduplicated
+        return job
+
+    def submit_many(self, paths: List[Path], knowledge_base: str) -> List[Dict[str, Any]]:
+        """批量提交入库任务"""
+        return [self.submit(path, knowledge_base) for path in paths]
+
+    def get(self, job_id: int) -> Optional[Dict[str, Any]]:
+        """查询单个任务"""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return self._to_dict(row) if row else None
+
+    def list_jobs(self, knowledge_base: str = None, statuses: List[str] = None,
+                  limit: int = 50) -> List[Dict[str, Any]]:
+        """按提交时间倒序列出任务，可按知识库与状态过滤"""
+        conditions, params = [], []
+        if knowledge_base is not None:
+            conditions.append("knowledge_base = ?")
+            params.append(knowledge_base)
+        if statuses:
+            conditions.append(f"status IN ({', '.join('?' * len(statuses))})")
+            params.extend(statuses)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM jobs {where} ORDER BY id DESC LIMIT ?",
+                (*params, limit)
+            ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def counts(self, knowledge_base: str = None) -> Dict[str, int]:
+        """各状态的任务数"""
+        query = "SELECT status, COUNT(*) FROM jobs"
+        params = ()
+        if knowledge_base is not None:
+            query += " WHERE knowledge_base = ?"
+            params = (knowledge_base,)
+        with self._lock:
+            rows = self._conn.execute(query + " GROUP BY status", params).fetchall()
+        counts = dict.fromkeys(JOB_STATUSES, 0)
+        counts.update({status: count for status, count in rows})
+        return counts
+
+    def retry(self, job_id: int) -> bool:
+        """重新提交失败或已取消的任务，返回是否成功"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'pending', attempts = 0, progress = 0, stage = NULL, error = NULL, "
+                "not_before = 0, finished_at = NULL WHERE id = ? AND status IN ('failed', 'cancelled')",
+                (job_id,)
+            )
+        self._wakeup.set()
+        return cursor.rowcount > 0
+
+    def cancel(self, job_id: int) -> bool:
+        """取消排队中的任务（执行中的任务不能取消），返回是否成功"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'pending'",
+                (_now(), job_id)
+            )
+        return cursor.rowcount > 0
+
+    def clear_finished(self, knowledge_base: str = None) -> int:
+        """删除已结束的任务记录，返回删除数"""
+        query = f"DELETE FROM jobs WHERE status IN ({', '.join('?' * len(FINISHED_STATUSES))})"
+        params = FINISHED_STATUSES
+        if knowledge_base is not None:
+            query += " AND knowledge_base = ?"
+            params += (knowledge_base,)
+        with self._lock:
+            return self._conn.execute(query, params).rowcount
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    # ---------- 后台执行 ----------
+
+    def start(self):
+        """启动工作线程与心跳线程；重复调用无影响"""
+        if self._threads:
+            return
+        self._stop.clear()
+        for index in range(self.settings["workers"]):
+            self._threads.append(threading.Thread(
+                target=self._worker, name=f"ingest-job-{index}", daemon=True
+            ))
+        self._threads.append(threading.Thread(target=self._heartbeat, name="ingest-job-heartbeat", daemon=True))
+        for thread in self._threads:
+            thread.start()
+        logger.info(f"入库任务队列已启动: {self.settings['workers']} 个工作线程，任务表 {self.db_path}")
+
+    def stop(self, timeout: float = None):
+        """停止领取新任务并等待工作线程退出（执行中的任务会先完成）"""
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _worker(self):
+        while not self._stop.is_set():
+            try:
+                job = self._claim()
+            except Exception as e:
+                log_error(e, "领取入库任务失败")
+                job = None
+            if job is None:
+                self._wakeup.wait(self.settings["poll_interval"])
+                self._wakeup.clear()
+                continue
+            self._run(job)
+
+    def _heartbeat(self):
+        """定期刷新本进程执行中任务的心跳，使其他进程不会把它们当作中断的任务"""
+        while not self._stop.wait(self.settings["heartbeat_interval"]):
+            try:
+                with self._lock:
+                    self._conn.execute(
+                        "UPDATE jobs SET heartbeat = ? WHERE owner = ? AND status = 'running'",
+                        (time.time(), self.owner)
+                    )
+            except Exception as e:
+                log_error(e, "刷新入库任务心跳失败")
+
+    def _claim(self) -> Optional[Dict[str, Any]]:
+        """领取一个可执行的任务：到期的排队任务，或心跳已过期（所在进程已退出）的执行中任务"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # 同一文件已有执行中的任务（内容变化后重新提交）时，排队的任务等它结束后再执行，
+                # 避免两个任务同时更新同一文件的块
+                live_after = now - self.settings["stale_after"]
+                row = self._conn.execute(
+                    f"SELECT {', '.join(_COLUMNS)} FROM jobs "
+                    "WHERE (status = 'pending' AND not_before <= ? AND NOT EXISTS ("
+                    "SELECT 1 FROM jobs r WHERE r.status = 'running' AND r.heartbeat >= ? "
+                    "AND r.knowledge_base = jobs.knowledge_base AND r.path = jobs.path)) "
+                    "OR (status = 'running' AND heartbeat < ?) "
+                    "ORDER BY id LIMIT 1",
+                    (now, live_after, live_after)
+                ).fetchone()
+                abandoned = row is not None and row["status"] == "running"
+                if abandoned and row["attempts"] >= self.settings["max_attempts"]:
+                    # 多次执行都在中途中断（如解析时进程崩溃），不再重试
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                        ("执行进程多次中断", _now(), row["id"])
+                    )
+                    row = None
+                elif row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'running', attempts = attempts + 1, progress = 0, "
+                        "stage = '等待', owner = ?, heartbeat = ?, started_at = ? WHERE id = ?",
+                        (self.owner, now, _now(), row["id"])
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        job = self._to_dict(row)
+        job["attempts"] += 1
+        if abandoned:
+            logger.warning(f"入库任务 {job['id']} 的执行进程已无响应，重新执行: {job['filename']}")
+        return job
+
+    def _update(self, job_id: int, **fields):
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE jobs SET {assignments}, heartbeat = ? WHERE id = ? AND owner = ?",
+                (*fields.values(), time.time(), job_id, self.owner)
+            )
+
+    def _run(self, job: Dict[str, Any]):
+        """执行入库任务并记录结果，失败时按退避时间重新排队"""
+        path = Path(job["path"])
+        try:
+            result = self._ingest(job["id"], path, job["knowledge_base"])
+        except Exception as e:
+            log_error(e, f"入库任务失败 (第 {job['attempts']} 次): {path}")
+            permanent = isinstance(e, PERMANENT_ERRORS)
+            if permanent or job["attempts"] >= self.settings["max_attempts"]:
+                self._update(job["id"], status="failed", error=str(e), finished_at=_now())
+                log_file_operation("后台入库", job["filename"], "失败")
+            else:
+                delay = self.settings["retry_delay"] * 2 ** (job["attempts"] - 1)
+                self._update(job["id"], status="pending", error=str(e), stage=f"{delay:.0f} 秒后重试",
+                             not_before=time.time() + delay)
+            return
+        self._update(job["id"], status="done", progress=1.0, stage=None, error=None,
+                     result=json.dumps(result), finished_at=_now())
+        log_file_operation("后台入库", job["filename"], "成功")
+        self._prune()
+
+    def _ingest(self, job_id: int, path: Path, knowledge_base: str) -> Dict[str, Any]:
+        """解析文件、分批计算新增块的向量（更新进度）并写入向量库"""
+        vector_store = self.store_factory(knowledge_base)
+        document_loader = self.loader_factory(knowledge_base)
+        if vector_store.is_indexed(path.name, document_loader.file_hash(path)):
+            logger.info(f"文件未变化，跳过处理: {path.name}")
+            return {"skipped": True}
+
+        self._update(job_id, stage="解析", progress=0.05)
+        documents = document_loader.load_document(path)
+        plan = vector_store.plan_update(path.name, documents)
+
+        texts = [doc['content'] for doc in plan['add']]
+        batch_size = DEFAULT_INGEST_PARAMS["embed_batch_size"]
+        embeddings = []
+        for start in range(0, len(texts), batch_size):
+            self._update(job_id, stage=f"计算向量 {start}/{len(texts)}",
+                         progress=0.1 + 0.8 * start / len(texts))
+            embeddings.extend(vector_store.embed(texts[start:start + batch_size]))
+
+        self._update(job_id, stage="写入", progress=0.9)
+        stats = vector_store.apply_update(plan, embeddings, batch_size=DEFAULT_INGEST_PARAMS["insert_batch_size"])
+        return {"skipped": False, "chunks": len(documents), **stats}
+
+    def _prune(self):
+        """只保留最近 keep_finished 个已结束的任务"""
+        placeholders = ", ".join("?" * len(FINISHED_STATUSES))
+        with self._lock:
+            self._conn.execute(
+                f"DELETE FROM jobs WHERE status IN ({placeholders}) AND id NOT IN ("
+                f"SELECT id FROM jobs WHERE status IN ({placeholders}) ORDER BY id DESC LIMIT ?)",
+                (*FINISHED_STATUSES, *FINISHED_STATUSES, self.settings["keep_finished"])
+            )
@@ -0,0 +1,195 @@
+"""
+关键词倒排索引
+
+与 Chroma collection 并行维护的本地 BM25 索引（SQLite 持久化），
+用于精确匹配编号、型号、中文专有名词等稠密检索不擅长的内容。
+
+分词规则：
+- 中日韩文字：单字 + 相邻二元组
+- 其他：字母数字及以 - _ . / 连接的标识符（如 AB-1234、v2.1），同时收录其各组成部分
+
+检索时查询中连续的中日韩文字只取二元组（单字几乎出现在所有块中），按 term_df 表中的文档频率
+跳过过于常见的词，BM25 得分在 SQL 中聚合并取前 n 个。
+"""
+import math
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import Counter
+from pathlib import Path
+from typing import List, Tuple
+from .config import HYBRID_SEARCH_SETTINGS
+
+CJK_RANGES = (
+    "\u3040-\u30ff"   # 日文假名
+    "\u3400-\u4dbf"   # 扩展A
+    "\u4e00-\u9fff"   # 基本汉字
+    "\uac00-\ud7af"   # 韩文
+    "\uf900-\ufaff"   # 兼容汉字
+)
+_TOKEN_PATTERN = re.compile(rf"[{CJK_RANGES}]+|[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+_CJK_PATTERN = re.compile(rf"[{CJK_RANGES}]")
+
+def tokenize(text: str, query: bool = False) -> List[str]:
+    """CJK 感知的分词；query=True 时连续的中日韩文字只取二元组"""
+    tokens = []
+    for match in _TOKEN_PATTERN.finditer(unicodedata.normalize("NFKC", text).lower()):
+        token = match.group()
+        if _CJK_PATTERN.match(token):
+            if not query or len(token) == 1:
+                tokens.extend(token)
+            tokens.extend(token[i:i + 2] for i in range(len(token) - 1))
+        else:
+            tokens.append(token)
+            parts = re.split(r"[-_./]", token)
+            if len(parts) > 1:
+                tokens.extend(part for part in parts if part)
+    return tokens
+
+class KeywordIndex:
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.k1 = HYBRID_SEARCH_SETTINGS["bm25_k1"]
+        self.b = HYBRID_SEARCH_SETTINGS["bm25_b"]
+        self.max_df_ratio = HYBRID_SEARCH_SETTINGS["max_df_ratio"]
+        self.max_query_terms = HYBRID_SEARCH_SETTINGS["max_query_terms"]
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS chunks (
+                chunk_id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                length INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_chunks_filename ON chunks (filename);
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                chunk_id TEXT NOT NULL,
+                tf INTEGER NOT NULL,
+                PRIMARY KEY (term, chunk_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_postings_chunk ON postings (chunk_id);
+            CREATE TABLE IF NOT EXISTS term_df (
+                term TEXT PRIMARY KEY,
+                df INTEGER NOT NULL
+            ) WITHOUT ROWID;
+            """
+        )
+        # 旧版本的索引没有 term_df，从倒排表重建一次
+        if (self._conn.execute("SELECT 1 FROM term_df LIMIT 1").fetchone() is None
+                and self._conn.execute("SELECT 1 FROM postings LIMIT 1").fetchone() is not None):
+            self._conn.execute("INSERT INTO term_df (term, df) SELECT term, COUNT(*) FROM postings GROUP BY term")
+        self._conn.commit()
+        self._stats = None
+
+    def add(self, ids: List[str], texts: List[str], filenames: List[str]):
+        """索引一批块（已存在的块会被覆盖）"""
+        with self._lock:
+            self._delete_ids(ids)
+            chunk_rows, posting_rows = [], []
+            for chunk_id, text, filename in zip(ids, texts, filenames):
+                counts = Counter(tokenize(text))
+                chunk_rows.append((chunk_id, filename, sum(counts.values())))
+                posting_rows.extend((term, chunk_id, tf) for term, tf in counts.items())
+            self._conn.executemany("INSERT INTO chunks (chunk_id, filename, length) VALUES (?, ?, ?)", chunk_rows)
+            self._conn.executemany("INSERT INTO postings (term, chunk_id, tf) VALUES (?, ?, ?)", posting_rows)
+            self._update_df(Counter(term for term, _, _ in posting_rows).items(), 1)
+            self._conn.commit()
+            self._stats = None
+
+    def remove(self, ids: List[str]):
+        """删除指定块"""
+        with self._lock:
+            self._delete_ids(ids)
+            self._conn.commit()
+            self._stats = None
+
+    def remove_file(self, filename: str):
+        """删除文件的所有块"""
+        with self._lock:
+            self._update_df(self._conn.execute(
+                "SELECT term, COUNT(*) FROM postings WHERE chunk_id IN "
+                "(SELECT chunk_id FROM chunks WHERE filename = ?) GROUP BY term",
+                (filename,)
+            ).fetchall(), -1)
+            self._conn.execute(
+                "DELETE FROM postings WHERE chunk_id IN (SELECT chunk_id FROM chunks WHERE filename = ?)",
+                (filename,)
+            )
+            self._conn.execute("DELETE FROM chunks WHERE filename = ?", (filename,))
+            self._conn.commit()
+            self._stats = None
+
+    def search(self, query: str, n_results: int) -> List[Tuple[str, float]]:
+        """BM25 检索，返回 (块ID, 分数)，按分数降序"""
+        terms = list(set(tokenize(query, query=True)))
+        if not terms or n_results <= 0:
+            return []
+        with self._lock:
+            total, avg_length = self._get_stats()
+            if not total:
+                return []
+            placeholders = ",".join("?" * len(terms))
+            df_rows = self._conn.execute(
+                f"SELECT term, df FROM term_df WHERE term IN ({placeholders}) AND df > 0 ORDER BY df", terms
+            ).fetchall()
+            if not df_rows:
+                return []
+            # 过于常见的词 idf 接近 0，对排序几乎没有贡献，却要扫描大半个倒排表；全部常见时保留最少见的一个
+            max_df = max(1, int(total * self.max_df_ratio))
+            kept = [(term, df) for term, df in df_rows[:self.max_query_terms] if df <= max_df] or df_rows[:1]
+            weights = [(term, math.log(1 + (total - df + 0.5) / (df + 0.5))) for term, df in kept]
+            values = ",".join("(?, ?)" for _ in weights)
+            params = [value for weight in weights for value in weight]
+            rows = self._conn.execute(
+                f"WITH q(term, idf) AS (VALUES {values}) "
+                "SELECT p.chunk_id, SUM(q.idf * p.tf * ? / (p.tf + ? * (1 - ? + ? * c.length / ?))) AS score "
+                "FROM q JOIN postings p ON p.term = q.term JOIN chunks c ON c.chunk_id = p.chunk_id "
+                "GROUP BY p.chunk_id ORDER BY score DESC LIMIT ?",
+                params + [self.k1 + 1, self.k1, self.b, self.b, avg_length, n_results]
+            ).fetchall()
+        return [(chunk_id, score) for chunk_id, score in rows]
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM chunks LIMIT 1").fetchone() is None
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM postings")
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.execute("DELETE FROM term_df")
+            self._conn.commit()
+            self._stats = None
+
+    def _get_stats(self) -> Tuple[int, float]:
+        """文档总数与平均长度（调用方持有锁）"""
+        if self._stats is None:
+            total, avg_length = self._conn.execute("SELECT COUNT(*), AVG(length) FROM chunks").fetchone()
+            self._stats = (total, avg_length or 1.0)
+        return self._stats
+
+    def _delete_ids(self, ids: List[str]):
+        """删除块及其倒排记录（调用方持有锁）"""
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            self._update_df(self._conn.execute(
+                f"SELECT term, COUNT(*) FROM postings WHERE chunk_id IN ({placeholders}) GROUP BY term", batch
+            ).fetchall(), -1)
+            self._conn.execute(f"DELETE FROM postings WHERE chunk_id IN ({placeholders})", batch)
+            self._conn.execute(f"DELETE FROM chunks WHERE chunk_id IN ({placeholders})", batch)
+
+    def _update_df(self, term_counts, sign: int):
+        """按 (词, 块数) 增减文档频率，减到 0 的词删除（调用方持有锁）"""
+        term_counts = list(term_counts)
+        self._conn.executemany(
+            "INSERT INTO term_df (term, df) VALUES (?, ?) ON CONFLICT (term) DO UPDATE SET df = df + excluded.df",
+            [(term, sign * count) for term, count in term_counts]
+        )
+        if sign < 0:
+            self._conn.executemany("DELETE FROM term_df WHERE term = ? AND df <= 0", [(term,) for term, _ in term_counts])
@@ -0,0 +1,164 @@
+"""
+知识库
+
+每个知识库是一个独立的向量库目录（collection、文件目录、关键词索引）和文档目录，
+可单独配置分块参数与嵌入模型。不同团队的文档互不可见，同名文件也不会冲突；
+每个索引更小，检索和重建都更快。
+
+同时检索多个知识库时在线程池中并行查询，再按相关度合并结果，
+每个结果的 metadata 中记录所属知识库（knowledge_base）。
+启用重排序时每个知识库多取候选，合并后统一重排序，分数在各知识库之间可直接比较。
+批量检索（search_knowledge_bases_batch）时每个知识库一次处理一批查询。
+"""
+import contextvars
+import re
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+from .config import (
+    KNOWLEDGE_BASES, KNOWLEDGE_BASES_DIR, DEFAULT_KNOWLEDGE_BASE, KNOWLEDGE_BASE_SEARCH_WORKERS,
+    CHROMA_SETTINGS, DOCUMENTS_DIR, DEFAULT_SEARCH_PARAMS, RERANK_SETTINGS, VECTOR_BACKEND
+)
+from .context import relevance
+from .metrics import span
+from .rerank import Reranker
+from .vector_store import VectorStore
+
+_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+
+# 多个知识库的并行检索共用一个线程池
+_search_pool = ThreadPoolExecutor(max_workers=KNOWLEDGE_BASE_SEARCH_WORKERS, thread_name_prefix="kb-search")
+
+def list_knowledge_bases() -> List[str]:
+    """配置的知识库名称（默认知识库在前）"""
+    return sorted(KNOWLEDGE_BASES, key=lambda name: (name != DEFAULT_KNOWLEDGE_BASE, name))
+
+def knowledge_base_settings(name: str) -> Dict[str, Any]:
+    """知识库的完整配置：标题、目录、向量库后端、分块配置覆盖项（按文件类型）与嵌入模型配置（未设置的项使用全局配置）"""
+    if name not in KNOWLEDGE_BASES:
+        raise ValueError(f"未知的知识库: {name}")
+    if not _NAME_PATTERN.match(name):
+        raise ValueError(f"知识库名称只能包含字母、数字、下划线和连字符: {name}")
+    config = KNOWLEDGE_BASES[name]
+    if name == DEFAULT_KNOWLEDGE_BASE:
+        persist_directory = Path(CHROMA_SETTINGS["persist_directory"])
+        documents_dir = DOCUMENTS_DIR
+    else:
+        persist_directory = KNOWLEDGE_BASES_DIR / name / "vector_store"
+        documents_dir = KNOWLEDGE_BASES_DIR / name / "documents"
+    return {
+        "name": name,
+        "title": config.get("title", name),
+        "persist_directory": str(persist_directory),
+        "documents_dir": documents_dir,
+        "vector_backend": config.get("vector_backend", VECTOR_BACKEND),
+        "chunking": {file_type: dict(settings) for file_type, settings in config.get("chunking", {}).items()},
+        "embedding": dict(config.get("embedding", {}))
+    }
+
+def knowledge_base_title(name: str) -> str:
+    """知识库的显示名称"""
+    return KNOWLEDGE_BASES.get(name, {}).get("title", name)
+
+def validate_knowledge_bases(names: Sequence[str]) -> List[str]:
+    """检查知识库名称并去重（保持顺序）"""
+    unique = list(dict.fromkeys(names))
+    for name in unique:
+        knowledge_base_settings(name)
+    return unique
+
+def _tag(documents: List[Dict[str, Any]], name: str) -> List[Dict[str, Any]]:
+    """在结果的 metadata 中记录所属知识库（复制后修改，不影响检索缓存中的结果）"""
+    return [{**doc, 'metadata': {**doc['metadata'], 'knowledge_base': name}} for doc in documents]
+
+def search_knowledge_bases(stores: Dict[str, VectorStore], query: str,
+                           n_results: int = DEFAULT_SEARCH_PARAMS["n_results"],
+                           mode: str = DEFAULT_SEARCH_PARAMS["mode"],
+                           similarity_threshold: float = None,
+                           query_embeddings: Optional[Dict[str, List[float]]] = None,
+                           reranker: Optional[Reranker] = None) -> List[Dict[str, Any]]:
+    """并行检索多个知识库，按相关度合并后返回前 n_results 个结果
+
+    query_embeddings 为按嵌入模型名预先计算的查询向量，使用相同模型的知识库直接复用。
+    指定 reranker 时先取 RERANK_SETTINGS["candidates"] 个候选，重排序后保留前 n_results 个。
+    各知识库的分数在同一检索模式下计算，可直接比较；嵌入模型不同时向量相似度的尺度
+    可能不一致，建议使用混合检索（按排名融合的分数）。
+    """
+    query_embeddings = query_embeddings or {}
+    candidates = max(n_results, RERANK_SETTINGS["candidates"]) if reranker is not None else n_results
+
+    def search_one(name: str, store: VectorStore) -> List[Dict[str, Any]]:
+        documents = store.search(
+            query, candidates, mode, similarity_threshold,
+            query_embeddings.get(store.embedding_provider.model_name)
+        )
+        return _tag(documents, name)
+
+    if not stores:
+        return []
+    if len(stores) == 1:
+        (name, store), = stores.items()
+        merged = search_one(name, store)
+    else:
+        # 子线程中沿用当前上下文，各知识库的检索耗时记录到同一条请求追踪上
+        futures = [
+            _search_pool.submit(contextvars.copy_context().run, search_one, name, store)
+            for name, store in stores.items()
+        ]
+        merged = [doc for future in futures for doc in future.result()]
+        merged.sort(key=relevance, reverse=True)
+
+    if reranker is None:
+        return merged[:n_results]
+    return reranker.rerank(query, merged[:candidates], n_results)
+
+def search_knowledge_bases_batch(stores: Dict[str, VectorStore], queries: List[str],
+                                 n_results: int = DEFAULT_SEARCH_PARAMS["n_results"],
+                                 mode: str = DEFAULT_SEARCH_PARAMS["mode"],
+                                 similarity_threshold: float = None,
+                                 reranker: Optional[Reranker] = None) -> List[List[Dict[str, Any]]]:
+    """批量检索多个知识库，返回各查询的结果（与逐个调用 search_knowledge_bases 相同）
+
+    多个知识库使用相同的嵌入模型时，查询向量只计算一次；各知识库并行调用 VectorStore.search_batch。
+    """
+    candidates = max(n_results, RERANK_SETTINGS["candidates"]) if reranker is not None else n_results
+    if not stores or not queries:
+        return [[] for _ in queries]
+
+    # 只有一个知识库时由 search_batch 计算查询向量（命中检索缓存的查询不必计算）
+    query_embeddings: Dict[str, List[List[float]]] = {}
+    if len(stores) > 1 and mode != "keyword":
+        for store in stores.values():
+            model_name = store.embedding_provider.model_name
+            if model_name not in query_embeddings:
+                with span("query_embedding"):
+                    query_embeddings[model_name] = store.embed(queries)
+
+    def search_one(name: str, store: VectorStore) -> List[List[Dict[str, Any]]]:
+        found = store.search_batch(
+            queries, candidates, mode, similarity_threshold,
+            query_embeddings.get(store.embedding_provider.model_name)
+        )
+        return [_tag(documents, name) for documents in found]
+
+    if len(stores) == 1:
+        (name, store), = stores.items()
+        merged = search_one(name, store)
+    else:
+        futures = [
+            _search_pool.submit(contextvars.copy_context().run, search_one, name, store)
+            for name, store in stores.items()
+        ]
+        per_store = [future.result() for future in futures]
+        merged = []
+        for i in range(len(queries)):
+            documents = [doc for found in per_store for doc in found[i]]
+            documents.sort(key=relevance, reverse=True)
+            merged.append(documents)
+
+    if reranker is None:
+        return [documents[:n_results] for documents in merged]
+    return [
+        reranker.rerank(query, documents[:candidates], n_results)
+        for query, documents in zip(queries, merged)
+    ]
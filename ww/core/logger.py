@@ -1,44 +1,177 @@
+import json
+import os
+import re
 import sys
+import threading
+import time
+import uuid
+from contextvars import ContextVar
 from loguru import logger
 from datetime import datetime
 from pathlib import Path
-from .config import LOGS_DIR, MAX_LOG_SIZE, BACKUP_COUNT
+from typing import Any, Dict, List, Optional
+from .config import (
+    LOG_FILE, MAX_LOG_SIZE, BACKUP_COUNT, PROCESS_LOG_MAX_AGE_DAYS, CHAT_LOG_SETTINGS, METRICS_SETTINGS
+)
 
 # 配置日志系统
 logger.remove()  # 移除默认处理器
 
-# 添加控制台输出
+def _is_chat_record(record) -> bool:
+    return "chat_record" in record["extra"]
+
+def _is_trace_record(record) -> bool:
+    return "trace_record" in record["extra"]
+
+def _is_app_record(record) -> bool:
+    return not _is_chat_record(record) and not _is_trace_record(record)
+
+# 添加控制台输出（不含对话与追踪记录）
 logger.add(
     sys.stdout,
     format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>",
-    level="INFO"
+    level="INFO",
+    filter=_is_app_record
 )
 
-def get_chat_log_file() -> Path:
-    """获取当前对话的日志文件路径"""
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    return LOGS_DIR / f"chat_{timestamp}.log"
-
-def setup_chat_logger():
-    """设置新的对话日志文件"""
-    log_file = get_chat_log_file()
-    logger.add(
-        str(log_file),
-        format="{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {message}",
-        level="INFO",
-        encoding="utf-8",
-        rotation=MAX_LOG_SIZE,
-        retention=BACKUP_COUNT
-    )
-    logger.info(f"开始新的对话，日志文件：{log_file}")
-    return log_file
-
-def log_chat(user_input: str, ai_response: str, relevant_docs: list = None):
-    """记录对话日志"""
-    logger.info(f"用户输入: {user_input}")
-    logger.info(f"AI响应: {ai_response}")
-    if relevant_docs:
-        logger.info(f"相关文档: {relevant_docs}")
+# 文件输出在首次使用时添加，每个进程只添加一次（入库子进程不写文件）
+_sink_lock = threading.Lock()
+_file_sinks_added = False
+
+# 当前会话 ID（由界面或 API 在处理请求前设置）
+_chat_session: ContextVar[Optional[str]] = ContextVar("chat_session", default=None)
+
+def process_log_file(path: Path) -> Path:
+    """本进程使用的日志文件：chat.jsonl → chat.<进程名>.<PID>.jsonl
+
+    loguru 的 enqueue 只在进程内串行写入，多个进程写同一文件并各自轮转会互相覆盖，
+    因此对话与追踪日志每个进程一个文件。
+    """
+    path = Path(path)
+    script = sys.argv[0] if sys.argv and not sys.argv[0].startswith("-") else ""
+    name = re.sub(r"[^\w-]", "_", Path(script).stem) or "python"
+    return path.with_name(f"{path.stem}.{name}.{os.getpid()}{path.suffix}")
+
+def _prune_process_logs(path: Path):
+    """删除其他进程留下的、超过 PROCESS_LOG_MAX_AGE_DAYS 未写入的日志文件（含轮转出的旧文件）"""
+    path = Path(path)
+    cutoff = time.time() - PROCESS_LOG_MAX_AGE_DAYS * 86400
+    for old in path.parent.glob(f"{path.stem}.*{path.suffix}"):
+        try:
+            if old.stat().st_mtime < cutoff:
+                old.unlink()
+        except OSError:
+            # 仍被其他进程打开（Windows）或已被删除
+            pass
+
+def _ensure_file_sinks():
+    """添加应用日志与对话日志的文件输出
+
+    写文件由 loguru 的后台线程完成（enqueue），调用方只负责把记录放入队列；
+    文件按大小轮转并限制保留数量。对话与追踪日志每个进程一个文件（见 process_log_file）。
+    """
+    global _file_sinks_added
+    if _file_sinks_added:
+        return
+    with _sink_lock:
+        if _file_sinks_added:
+            return
+        logger.add(
+            str(LOG_FILE),
+            format="{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {message}",
+            level="INFO",
+            encoding="utf-8",
+            rotation=MAX_LOG_SIZE,
+            retention=BACKUP_COUNT,
+            enqueue=True,
+            filter=_is_app_record
+        )
+        _prune_process_logs(CHAT_LOG_SETTINGS["file"])
+        logger.add(
+            str(process_log_file(CHAT_LOG_SETTINGS["file"])),
+            format="{message}",
+            level="INFO",
+            encoding="utf-8",
+            rotation=MAX_LOG_SIZE,
+            retention=BACKUP_COUNT,
+            enqueue=True,
+            filter=_is_chat_record
+        )
+        if METRICS_SETTINGS.get("trace_file"):
+            _prune_process_logs(METRICS_SETTINGS["trace_file"])
+            logger.add(
+                str(process_log_file(METRICS_SETTINGS["trace_file"])),
+                format="{message}",
+                level="INFO",
+                encoding="utf-8",
+                rotation=MAX_LOG_SIZE,
+                retention=BACKUP_COUNT,
+                enqueue=True,
+                filter=_is_trace_record
+            )
+        _file_sinks_added = True
+
+def setup_chat_logger() -> str:
+    """开始一个新的对话会话，返回会话 ID
+
+    同一进程的各会话共用本进程的对话日志文件，记录中以 session_id 区分。
+    """
+    _ensure_file_sinks()
+    session_id = datetime.now().strftime("%Y%m%d_%H%M%S_") + uuid.uuid4().hex[:6]
+    logger.info(f"开始新的对话，会话 ID：{session_id}")
+    return session_id
+
+def set_chat_session(session_id: Optional[str]):
+    """设置当前上下文的会话 ID，之后的对话记录都归属于该会话"""
+    _chat_session.set(session_id)
+
+def _truncate(text: str, limit: int) -> str:
+    if text is None or len(text) <= limit:
+        return text
+    return text[:limit] + f"…[截断 {len(text) - limit} 字]"
+
+def _doc_summary(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """文档的 ID、来源与分数（不含内容）"""
+    metadata = doc.get("metadata", {})
+    summary = {
+        "id": doc.get("id"),
+        "filename": metadata.get("filename"),
+        "chunk_id": metadata.get("chunk_id")
+    }
+    if "knowledge_base" in metadata:
+        summary["knowledge_base"] = metadata["knowledge_base"]
+    if "page" in metadata:
+        summary["page"] = metadata["page"]
+    for key in ("rerank_score", "score", "similarity", "distance", "bm25_score"):
+        if key in doc:
+            summary[key] = round(doc[key], 4)
+    return summary
+
+def log_chat(user_input: str, ai_response: str, relevant_docs: list = None,
+             model: str = None, trace_id: str = None, cached: bool = False):
+    """记录对话日志（结构化 JSONL，由后台线程写入，不阻塞流式输出）"""
+    _ensure_file_sinks()
+    docs: List[Dict[str, Any]] = relevant_docs or []
+    record = {
+        "time": datetime.now().isoformat(timespec="milliseconds"),
+        "session_id": _chat_session.get(),
+        "trace_id": trace_id,
+        "model": model,
+        "cached": cached,
+        "user_input": _truncate(user_input, CHAT_LOG_SETTINGS["max_input_chars"]),
+        "response": _truncate(ai_response, CHAT_LOG_SETTINGS["max_response_chars"]),
+        "response_chars": len(ai_response or ""),
+        "documents": [_doc_summary(doc) for doc in docs[:CHAT_LOG_SETTINGS["max_docs"]]],
+        "document_count": len(docs)
+    }
+    logger.bind(chat_record=True).info(json.dumps(record, ensure_ascii=False, default=str))
+
+def log_trace(record: Dict[str, Any]):
+    """记录请求追踪（JSONL，与对话日志一样写入本进程的文件，由后台线程写入并按大小轮转）"""
+    if not METRICS_SETTINGS.get("trace_file"):
+        return
+    _ensure_file_sinks()
+    logger.bind(trace_record=True).info(json.dumps(record, ensure_ascii=False, default=str))
 
 def log_file_operation(operation: str, file_name: str, status: str):
     """记录文件操作日志"""
@@ -46,4 +179,4 @@ def log_file_operation(operation: str, file_name: str, status: str):
 
 def log_error(error: Exception, context: str = None):
     """记录错误日志"""
-    logger.error(f"错误: {str(error)} | 上下文: {context}") 
\ No newline at end of file
+    logger.error(f"错误: {str(error)} | 上下文: {context}")
@@ -0,0 +1,269 @@
+"""
+向量库离线维护
+
+频繁删除后 HNSW 索引文件中会留下大量已删除的节点，检索变慢、占用变大；
+修改 HNSW 建索引参数后也需要重建才能生效。mmap 后端删除的行同样只做标记，
+修改量化或分区参数后也需要重建。rebuild_vector_store 会：
+1. 按当前配置（HNSW_SETTINGS 或 MMAP_INDEX_SETTINGS）在相邻目录（<向量库目录>.rebuild）中新建向量库，
+   分页复制所有块（向量、内容、元数据），文件目录与关键词索引用 SQLite 备份接口复制；
+   mmap 后端复制后重新训练分区并按分区重排。指定 target_backend 时可在两种后端之间转换
+2. 以原向量库中抽样的块向量为查询，与暴力检索结果对比，
+   分别测量新旧索引的 recall@k 与检索延迟
+3. 校验块数后切换目录：原目录改名为 <向量库目录>.old，新目录改名为原目录；
+   切换中断时，下次运行会先恢复原目录
+
+运行前需停止使用该向量库的界面与 API 服务。
+"""
+import os
+import random
+import shutil
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+import chromadb
+import numpy as np
+from .config import (
+    CHROMA_SETTINGS, HNSW_SETTINGS, FILE_CATALOG_NAME, KEYWORD_INDEX_NAME,
+    VECTOR_BACKEND, MMAP_INDEX_SETTINGS
+)
+from .vector_store import COLLECTION_NAME, CATALOG_REBUILD_PAGE_SIZE, hnsw_metadata, open_collection
+from .logger import logger, log_error
+
+REBUILD_SUFFIX = ".rebuild"
+BACKUP_SUFFIX = ".old"
+
+def _sibling(directory: Path, suffix: str) -> Path:
+    return directory.with_name(directory.name + suffix)
+
+def _directory_size(directory: Path) -> int:
+    return sum(path.stat().st_size for path in directory.rglob("*") if path.is_file())
+
+def _close_clients(*collections):
+    """释放 Chroma 客户端与 mmap 索引持有的文件（Windows 下打开的文件无法改名）"""
+    for collection in collections:
+        if hasattr(collection, "close"):
+            collection.close()
+    try:
+        chromadb.api.client.SharedSystemClient.clear_system_cache()
+    except AttributeError:
+        pass
+
+def _open_existing(directory: Path, backend: str):
+    """打开已有的 collection（chroma 后端不存在时报错）"""
+    if backend == "chroma":
+        return chromadb.PersistentClient(path=str(directory)).get_collection(COLLECTION_NAME, embedding_function=None)
+    return open_collection(str(directory), backend)
+
+def _max_batch_size(client) -> int:
+    """Chroma 单次写入的最大条数（不同版本的接口不同）"""
+    if hasattr(client, "get_max_batch_size"):
+        return client.get_max_batch_size()
+    return getattr(client, "max_batch_size", CATALOG_REBUILD_PAGE_SIZE)
+
+def recover_interrupted_swap(directory: Path) -> bool:
+    """上次切换目录中断时恢复原向量库，并清理未完成的重建目录；返回是否做了恢复"""
+    backup = _sibling(directory, BACKUP_SUFFIX)
+    recovered = False
+    if not directory.exists() and backup.exists():
+        os.rename(backup, directory)
+        logger.warning(f"检测到未完成的切换，已恢复原向量库: {directory}")
+        recovered = True
+    rebuild = _sibling(directory, REBUILD_SUFFIX)
+    if rebuild.exists():
+        shutil.rmtree(rebuild)
+    return recovered
+
+def collection_status(persist_directory: str = None, backend: str = VECTOR_BACKEND) -> Dict[str, Any]:
+    """向量库概况：块数、索引参数（HNSW 参数的当前值与配置，或 mmap 索引的量化与分区参数）、磁盘占用"""
+    directory = Path(persist_directory or CHROMA_SETTINGS["persist_directory"])
+    if backend != "chroma":
+        collection = open_collection(str(directory), backend)
+        status = {"directory": str(directory), **collection.stats(), "disk_bytes": _directory_size(directory)}
+        _close_clients(collection)
+        return status
+    client = chromadb.PersistentClient(path=str(directory))
+    collection = client.get_collection(COLLECTION_NAME, embedding_function=None)
+    stored = {key: value for key, value in (collection.metadata or {}).items() if key.startswith("hnsw:")}
+    wanted = hnsw_metadata()
+    status = {
+        "directory": str(directory),
+        "backend": backend,
+        "count": collection.count(),
+        "hnsw": stored,
+        "configured_hnsw": wanted,
+        "pending_changes": {key: value for key, value in wanted.items() if stored.get(key) != value},
+        "segment_directories": sum(1 for path in directory.iterdir() if path.is_dir()),
+        "disk_bytes": _directory_size(directory)
+    }
+    _close_clients()
+    return status
+
+def _copy_sqlite(source: Path, target: Path):
+    """用 SQLite 备份接口复制数据库（包含 WAL 中尚未合并的内容）"""
+    if not source.exists():
+        return
+    with sqlite3.connect(str(source)) as src, sqlite3.connect(str(target)) as dst:
+        src.backup(dst)
+
+def _scores(space: str, queries: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+    """按距离类型计算相似度分数（越大越近）"""
+    if space == "cosine":
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return queries @ vectors.T
+    if space == "ip":
+        return queries @ vectors.T
+    # l2：||q||² 对同一查询是常数，可省略
+    return 2 * queries @ vectors.T - np.sum(vectors ** 2, axis=1)
+
+def _ground_truth(collection, queries: np.ndarray, k: int, space: str) -> List[set]:
+    """分页扫描 collection，暴力计算每个查询的 top-k 块ID"""
+    best_scores = np.full((len(queries), 0), -np.inf)
+    best_ids = np.empty((len(queries), 0), dtype=object)
+    offset = 0
+    while True:
+        page = collection.get(include=["embeddings"], limit=CATALOG_REBUILD_PAGE_SIZE, offset=offset)
+        if not page['ids']:
+            break
+        scores = _scores(space, queries, np.asarray(page['embeddings'], dtype=np.float32))
+        ids = np.asarray(page['ids'], dtype=object)
+        best_scores = np.concatenate([best_scores, scores], axis=1)
+        best_ids = np.concatenate([best_ids, np.broadcast_to(ids, scores.shape)], axis=1)
+        if best_scores.shape[1] > k:
+            keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(best_scores, keep, axis=1)
+            best_ids = np.take_along_axis(best_ids, keep, axis=1)
+        offset += len(page['ids'])
+    return [set(row) for row in best_ids.tolist()]
+
+def _evaluate(collection, queries: np.ndarray, truth: List[set], k: int) -> Dict[str, Any]:
+    """在 collection 上执行查询，统计 recall@k 与延迟"""
+    timings, recalls = [], []
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        result = collection.query(query_embeddings=[query.tolist()], n_results=k, include=[])
+        timings.append(time.perf_counter() - start)
+        recalls.append(len(set(result['ids'][0]) & expected) / len(expected) if expected else 1.0)
+    timings.sort()
+    return {
+        f"recall@{k}": round(sum(recalls) / len(recalls), 4) if recalls else None,
+        "p50_ms": round(timings[len(timings) // 2] * 1000, 3) if timings else None,
+        "p99_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000, 3) if timings else None
+    }
+
+def rebuild_vector_store(persist_directory: str = None, settings: Dict[str, Any] = None,
+                         queries: int = 200, k: int = 10, keep_backup: bool = False,
+                         dry_run: bool = False, seed: int = 42,
+                         progress_callback: Callable[[int, int], None] = None,
+                         backend: str = VECTOR_BACKEND, target_backend: str = None) -> Dict[str, Any]:
+    """按索引配置重建并压缩向量库，返回重建报告
+
+    settings 为新索引的配置（chroma: HNSW_SETTINGS 结构；mmap: MMAP_INDEX_SETTINGS 结构）。
+    target_backend 与 backend 不同时把向量库转换为另一种后端（之后需把知识库的 vector_backend 改为新后端）。
+    dry_run 时只构建和评估新索引，不替换原向量库。
+    """
+    target_backend = target_backend or backend
+    directory = Path(persist_directory or CHROMA_SETTINGS["persist_directory"])
+    recover_interrupted_swap(directory)
+    rebuild_dir = _sibling(directory, REBUILD_SUFFIX)
+    backup_dir = _sibling(directory, BACKUP_SUFFIX)
+    if backup_dir.exists():
+        raise RuntimeError(f"上次重建的备份仍在，请确认后删除: {backup_dir}")
+    report: Dict[str, Any] = {"directory": str(directory), "backend": target_backend}
+    if target_backend == "chroma":
+        settings = settings or HNSW_SETTINGS
+        report["hnsw"] = hnsw_metadata(settings)
+    else:
+        settings = {**MMAP_INDEX_SETTINGS, **(settings or {})}
+        report["mmap"] = settings
+    if target_backend != backend:
+        report["converted_from"] = backend
+    started = time.perf_counter()
+    source = target = None
+
+    try:
+        source = _open_existing(directory, backend)
+        total = source.count()
+        report["count"] = total
+        report["disk_bytes_before"] = _directory_size(directory)
+        metadata = {key: value for key, value in (source.metadata or {}).items() if not key.startswith("hnsw:")}
+
+        if target_backend == "chroma":
+            metadata.update(hnsw_metadata(settings))
+            space = metadata.get("hnsw:space", "l2")
+            target_client = chromadb.PersistentClient(path=str(rebuild_dir))
+            target = target_client.create_collection(COLLECTION_NAME, metadata=metadata, embedding_function=None)
+            page_size = min(CATALOG_REBUILD_PAGE_SIZE, _max_batch_size(target_client))
+        else:
+            target = open_collection(str(rebuild_dir), target_backend, metadata=metadata, settings=settings)
+            space = target.space
+            page_size = CATALOG_REBUILD_PAGE_SIZE
+
+        # 复制所有块，同时取出抽样位置的向量作为评估查询
+        sample = set(random.Random(seed).sample(range(total), min(queries, total)))
+        query_vectors = []
+        offset = 0
+        while offset < total:
+            page = source.get(include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset)
+            if not page['ids']:
+                break
+            embeddings = np.asarray(page['embeddings'], dtype=np.float32)
+            target.add(
+                ids=page['ids'],
+                embeddings=embeddings.tolist(),
+                documents=page['documents'],
+                metadatas=page['metadatas']
+            )
+            query_vectors.extend(embeddings[i] for i in range(len(page['ids'])) if offset + i in sample)
+            offset += len(page['ids'])
+            if progress_callback:
+                progress_callback(offset, total)
+        copied = target.count()
+        if copied != total:
+            raise RuntimeError(f"复制后的块数 {copied} 与原向量库 {total} 不一致")
+        if target_backend == "mmap":
+            # 按配置重新训练分区，并按分区重排各行
+            target.compact()
+        report["copy_seconds"] = round(time.perf_counter() - started, 2)
+
+        for name in (FILE_CATALOG_NAME, KEYWORD_INDEX_NAME):
+            _copy_sqlite(directory / name, rebuild_dir / name)
+
+        # 评估新旧索引的召回率与延迟
+        if query_vectors:
+            query_matrix = np.vstack(query_vectors)
+            truth = _ground_truth(target, query_matrix, k, space)
+            report["before"] = _evaluate(source, query_matrix, truth, k)
+            report["after"] = _evaluate(target, query_matrix, truth, k)
+            report["queries"] = len(query_vectors)
+    except Exception as e:
+        log_error(e, "重建向量库失败")
+        _close_clients(source, target)
+        shutil.rmtree(rebuild_dir, ignore_errors=True)
+        raise
+
+    _close_clients(source, target)
+    report["disk_bytes_after"] = _directory_size(rebuild_dir)
+    if dry_run:
+        shutil.rmtree(rebuild_dir, ignore_errors=True)
+        report["swapped"] = False
+        return report
+
+    # 切换目录：任何一步失败都回到原向量库
+    os.rename(directory, backup_dir)
+    try:
+        os.rename(rebuild_dir, directory)
+    except OSError:
+        os.rename(backup_dir, directory)
+        raise
+    report["swapped"] = True
+    if not keep_backup:
+        shutil.rmtree(backup_dir, ignore_errors=True)
+    else:
+        report["backup"] = str(backup_dir)
+    report["seconds"] = round(time.perf_counter() - started, 2)
+    logger.info(f"向量库重建完成: {total} 个块，耗时 {report['seconds']}s")
+    if target_backend != backend:
+        logger.warning(f"向量库已转换为 {target_backend} 后端，请把知识库的 vector_backend 设置为 {target_backend}")
+    return report
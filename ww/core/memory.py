@@ -0,0 +1,126 @@
+"""
+会话记忆
+
+保存多轮对话并控制其 token 数：最近的若干轮原样保留，
+超出预算时把较早的轮次折叠进滚动摘要。
+发给模型的消息顺序为 [system(指令 + 摘要), 历史轮次..., 当前问题]，
+在摘要不变时前缀保持稳定，Ollama 可以复用已计算的 KV 缓存。
+"""
+import threading
+from typing import List, Dict, Callable
+from .config import MEMORY_SETTINGS
+from .context import estimate_tokens
+from .logger import logger, log_error
+
+SYSTEM_PROMPT = "你是一个智能助手，请基于提供的文档信息和对话上下文，给出准确、详细的回答。"
+
+# 摘要函数：(已有摘要, 需要折叠的消息) → 新摘要
+Summarizer = Callable[[str, List[Dict[str, str]]], str]
+
+class ConversationMemory:
+    def __init__(self, token_budget: int = MEMORY_SETTINGS["token_budget"],
+                 keep_recent_turns: int = MEMORY_SETTINGS["keep_recent_turns"]):
+        self.token_budget = token_budget
+        self.keep_recent_turns = keep_recent_turns
+        self.summary = ""
+        self.messages: List[Dict[str, str]] = []
+        self.auto_summarize = True
+        self._lock = threading.Lock()
+        self._summarizing = False
+        # clear() 时加一，后台摘要完成时据此判断期间是否清空过
+        self._generation = 0
+
+    @classmethod
+    def from_messages(cls, messages: List[Dict[str, str]], **kwargs) -> "ConversationMemory":
+        """由客户端保存的消息列表创建（如 API 请求中携带的历史）
+
+        这种记忆只用于单次请求，不做后台摘要，超出预算的较早轮次直接丢弃。
+        """
+        memory = cls(**kwargs)
+        memory.auto_summarize = False
+        memory.messages = [
+            {"role": message["role"], "content": message["content"]}
+            for message in messages if message.get("role") in ("user", "assistant")
+        ]
+        total = sum(estimate_tokens(message["content"]) for message in memory.messages)
+        while len(memory.messages) > 2 and total > memory.token_budget:
+            for message in memory.messages[:2]:
+                total -= estimate_tokens(message["content"])
+            memory.messages = memory.messages[2:]
+        return memory
+
+    def add_turn(self, user_input: str, response: str):
+        """记录一轮对话（只保存原始问题，不保存检索到的文档）"""
+        with self._lock:
+            self.messages.append({"role": "user", "content": user_input})
+            self.messages.append({"role": "assistant", "content": response})
+
+    def build_messages(self, user_content: str) -> List[Dict[str, str]]:
+        """构建发送给模型的消息列表"""
+        with self._lock:
+            system = SYSTEM_PROMPT
+            if self.summary:
+                system += f"\n\n此前对话摘要：\n{self.summary}"
+            return [{"role": "system", "content": system}, *self.messages,
+                    {"role": "user", "content": user_content}]
+
+    def is_empty(self) -> bool:
+        return not self.messages and not self.summary
+
+    def token_count(self) -> int:
+        with self._lock:
+            return estimate_tokens(self.summary) + sum(estimate_tokens(m["content"]) for m in self.messages)
+
+    def needs_summary(self) -> bool:
+        return len(self.messages) > self.keep_recent_turns * 2 and self.token_count() > self.token_budget
+
+    def summarize(self, summarizer: Summarizer):
+        """把较早的轮次折叠进摘要，直到历史回到预算的一半以内（至少保留最近几轮）"""
+        with self._lock:
+            if self._summarizing:
+                return
+            self._summarizing = True
+            keep = self.keep_recent_turns * 2
+            target = self.token_budget // 2
+            total = estimate_tokens(self.summary) + sum(estimate_tokens(m["content"]) for m in self.messages)
+            count = 0
+            while len(self.messages) - count > keep and total > target:
+                total -= estimate_tokens(self.messages[count]["content"])
+                count += 1
+            # 按整轮折叠
+            count -= count % 2
+            old_summary, folded = self.summary, self.messages[:count]
+            generation = self._generation
+        try:
+            if not folded:
+                return
+            summary = summarizer(old_summary, folded)
+            with self._lock:
+                if self._generation != generation:
+                    # 摘要期间对话被清空，结果已过时
+                    return
+                # 摘要期间可能有新的轮次加入，只移除已折叠的部分
+                self.summary = summary.strip()
+                self.messages = self.messages[len(folded):]
+            logger.info(f"已将 {len(folded) // 2} 轮对话折叠进摘要")
+        except Exception as e:
+            log_error(e, "对话摘要失败")
+        finally:
+            with self._lock:
+                self._summarizing = False
+
+    def summarize_in_background(self, summarizer: Summarizer):
+        """在后台线程中摘要，不阻塞当前回答"""
+        if self.auto_summarize and self.needs_summary() and not self._summarizing:
+            threading.Thread(target=self.summarize, args=(summarizer,), daemon=True).start()
+
+    def clear(self):
+        with self._lock:
+            self.summary = ""
+            self.messages = []
+            self._generation += 1
+
+    def to_messages(self) -> List[Dict[str, str]]:
+        """当前保留的历史消息（不含摘要）"""
+        with self._lock:
+            return list(self.messages)
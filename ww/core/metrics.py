@@ -0,0 +1,292 @@
+"""
+请求级延迟追踪与指标
+
+- span(name)：记录一个阶段的耗时（检索、查询向量、构建提示词、生成等），
+  写入同名直方图，并挂到当前请求的追踪记录上
+- trace(name)：一次请求的追踪记录，结束时保留在最近请求列表中，并交给日志后台线程写入 JSONL 文件（按大小轮转）
+- record_generation：记录 Ollama 返回的 eval_count/eval_duration/prompt_eval_duration，
+  换算成生成速度（token/秒）、提示词处理耗时等
+- 指标可导出为 Prometheus 文本格式（HTTP API 的 /metrics），或由看板读取分位数
+"""
+import bisect
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from .config import METRICS_SETTINGS
+from .logger import log_trace
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+# 指标说明：名称 → (类型, 说明, 桶)
+METRIC_DEFINITIONS = {
+    "retrieval_seconds": ("histogram", "VectorStore.search 耗时（秒）", "latency"),
+    "retrieval_batch_seconds": ("histogram", "VectorStore.search_batch 一批查询的耗时（秒）", "latency"),
+    "query_embedding_seconds": ("histogram", "查询向量计算耗时（秒）", "latency"),
+    "rerank_seconds": ("histogram", "重排序耗时（秒）", "latency"),
+    "build_prompt_seconds": ("histogram", "提示词构建耗时（秒）", "latency"),
+    "ttft_seconds": ("histogram", "从发起生成到首个 token 的耗时（秒）", "latency"),
+    "generation_seconds": ("histogram", "一次生成的总耗时（从发起请求到最后一个 token，秒）", "latency"),
+    "prompt_eval_seconds": ("histogram", "Ollama 处理提示词的耗时（秒）", "latency"),
+    "model_load_seconds": ("histogram", "Ollama 加载模型的耗时（秒）", "latency"),
+    "decode_tokens_per_second": ("histogram", "生成速度（token/秒）", "throughput"),
+    "prompt_tokens_total": ("counter", "提示词 token 总数", None),
+    "eval_tokens_total": ("counter", "生成 token 总数", None),
+    "rerank_fallbacks_total": ("counter", "重排序超时或失败、按原检索顺序返回的次数", None),
+    "requests_total": ("counter", "请求总数", None),
+    "errors_total": ("counter", "失败的请求数", None)
+}
+
+def _label_key(labels: Optional[Dict[str, Any]]) -> LabelKey:
+    return tuple(sorted((key, str(value)) for key, value in (labels or {}).items()))
+
+def _format_labels(key: LabelKey, extra: Dict[str, str] = None) -> str:
+    items = list(key) + list((extra or {}).items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in items) + "}"
+
+class Histogram:
+    """累积桶直方图，另保留最近的样本用于计算分位数"""
+
+    def __init__(self, buckets: List[float], recent_samples: int = METRICS_SETTINGS["recent_samples"]):
+        self.buckets = sorted(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.recent: deque = deque(maxlen=recent_samples)
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.recent:
+            return None
+        values = sorted(self.recent)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+class MetricsRegistry:
+    """进程内的指标注册表（线程安全）"""
+
+    def __init__(self, settings: Dict[str, Any] = None):
+        self.settings = settings or METRICS_SETTINGS
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._traces: deque = deque(maxlen=self.settings["recent_traces"])
+
+    def observe(self, name: str, value: float, labels: Dict[str, Any] = None):
+        """记录一个直方图样本"""
+        if not self.settings["enabled"]:
+            return
+        kind = METRIC_DEFINITIONS.get(name, ("histogram", "", "latency"))[2] or "latency"
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(
+                    self.settings[f"{kind}_buckets"], self.settings["recent_samples"]
+                )
+            histogram.observe(value)
+
+    def increment(self, name: str, value: float = 1, labels: Dict[str, Any] = None):
+        """计数器加值"""
+        if not self.settings["enabled"]:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """各直方图的样本数、均值与 p50/p95（按标签合并），供看板展示"""
+        with self._lock:
+            result = {}
+            for name, series in self._histograms.items():
+                for key, histogram in series.items():
+                    label = ",".join(value for _, value in key)
+                    result[f"{name}[{label}]" if label else name] = {
+                        "count": histogram.count,
+                        "mean": histogram.sum / histogram.count if histogram.count else None,
+                        "p50": histogram.quantile(0.5),
+                        "p95": histogram.quantile(0.95)
+                    }
+            return result
+
+    def counters(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                f"{name}[{','.join(value for _, value in key)}]" if key else name: value
+                for name, series in self._counters.items() for key, value in series.items()
+            }
+
+    def recent_traces(self) -> List[Dict[str, Any]]:
+        """最近的请求追踪记录（新的在前）"""
+        with self._lock:
+            return list(reversed(self._traces))
+
+    def to_prometheus(self) -> str:
+        """导出为 Prometheus 文本格式"""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# HELP {name} {METRIC_DEFINITIONS.get(name, ('', name))[1]}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(key, {'le': str(bound)})} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(key, {'le': '+Inf'})} {histogram.count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {histogram.sum}")
+                    lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# HELP {name} {METRIC_DEFINITIONS.get(name, ('', name))[1]}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def finish_trace(self, record: Dict[str, Any]):
+        """保存一次请求的追踪记录，并放入日志队列写入 JSONL 文件"""
+        if not self.settings["enabled"]:
+            return
+        with self._lock:
+            self._traces.append(record)
+        log_trace(record)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self._traces.clear()
+
+metrics = MetricsRegistry()
+
+class Trace:
+    """一次请求的追踪记录：各阶段耗时与附加属性"""
+
+    def __init__(self, name: str, **attributes):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attributes: Dict[str, Any] = dict(attributes)
+        self.spans: List[Dict[str, Any]] = []
+        self.started_at = datetime.now().isoformat(timespec="milliseconds")
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add_span(self, name: str, start: float, duration: float, **attributes):
+        with self._lock:
+            self.spans.append({
+                "name": name,
+                "offset": round(start - self._start, 4),
+                "duration": round(duration, 4),
+                **attributes
+            })
+
+    def set(self, **attributes):
+        with self._lock:
+            self.attributes.update(attributes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "trace_id": self.trace_id,
+                "name": self.name,
+                "started_at": self.started_at,
+                "duration": round(time.perf_counter() - self._start, 4),
+                **self.attributes,
+                "spans": list(self.spans)
+            }
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+@contextmanager
+def trace(name: str, **attributes) -> Iterator[Trace]:
+    """开始一次请求的追踪；其中的 span 都记录到这条追踪上，结束时写出"""
+    record = Trace(name, **attributes)
+    token = _current_trace.set(record)
+    metrics.increment("requests_total", labels={"request": name})
+    try:
+        yield record
+    except BaseException as e:
+        if not isinstance(e, GeneratorExit):
+            record.set(error=repr(e))
+            metrics.increment("errors_total", labels={"request": name})
+        raise
+    finally:
+        try:
+            _current_trace.reset(token)
+        except ValueError:
+            # 在其他上下文中结束（如异步生成器被垃圾回收时关闭）
+            pass
+        metrics.finish_trace(record.to_dict())
+
+@contextmanager
+def span(name: str, labels: Dict[str, Any] = None, **attributes) -> Iterator[Dict[str, Any]]:
+    """记录一个阶段的耗时：写入直方图 {name}_seconds，并挂到当前请求的追踪上
+
+    产出的字典可在阶段内补充属性（如结果数）。
+    """
+    record = current_trace()
+    extra: Dict[str, Any] = dict(attributes)
+    start = time.perf_counter()
+    try:
+        yield extra
+    finally:
+        duration = time.perf_counter() - start
+        metrics.observe(f"{name}_seconds", duration, labels)
+        if record is not None:
+            record.add_span(name, start, duration, **(labels or {}), **extra)
+
+def record_generation(model: str, final_chunk: Any, ttft: Optional[float]) -> Dict[str, Any]:
+    """记录一次生成的指标
+
+    final_chunk 为 Ollama 流式响应的最后一段（done=True），其中各 *_duration 以纳秒计。
+    """
+    labels = {"model": model}
+    stats: Dict[str, Any] = {"model": model}
+    if ttft is not None:
+        metrics.observe("ttft_seconds", ttft, labels)
+        stats["ttft_seconds"] = round(ttft, 4)
+
+    if final_chunk is not None:
+        eval_count = final_chunk.get("eval_count") or 0
+        eval_duration = (final_chunk.get("eval_duration") or 0) / 1e9
+        prompt_eval_count = final_chunk.get("prompt_eval_count") or 0
+        prompt_eval_duration = (final_chunk.get("prompt_eval_duration") or 0) / 1e9
+        load_duration = (final_chunk.get("load_duration") or 0) / 1e9
+        metrics.increment("eval_tokens_total", eval_count, labels)
+        metrics.increment("prompt_tokens_total", prompt_eval_count, labels)
+        if prompt_eval_duration:
+            metrics.observe("prompt_eval_seconds", prompt_eval_duration, labels)
+        if load_duration >= 0.5:
+            # 模型已驻留时 load_duration 只有几毫秒，只统计实际加载
+            metrics.observe("model_load_seconds", load_duration, labels)
+        stats.update({
+            "eval_count": eval_count,
+            "eval_seconds": round(eval_duration, 4),
+            "prompt_eval_count": prompt_eval_count,
+            "prompt_eval_seconds": round(prompt_eval_duration, 4),
+            "load_seconds": round(load_duration, 4)
+        })
+        if eval_count and eval_duration:
+            tokens_per_second = eval_count / eval_duration
+            metrics.observe("decode_tokens_per_second", tokens_per_second, labels)
+            stats["tokens_per_second"] = round(tokens_per_second, 2)
+
+    record = current_trace()
+    if record is not None:
+        record.set(generation=stats)
+    return stats
@@ -0,0 +1,657 @@
+"""
+内存映射向量索引（VectorStore 的 mmap 后端）
+
+Chroma 把 float32 向量与 HNSW 图常驻内存，块数很多时内存是主要开销。本后端：
+- 向量按 float16 或 int8（按向量缩放的对称量化）保存在矩阵文件中，用 numpy.memmap 读取：
+  打开时不读入数据，由操作系统页缓存按需加载，多个进程映射同一文件时共享物理页
+- 可选 IVF 分区：块数达到 nlist × MIN_POINTS_PER_CENTROID 后用 k-means 训练分区中心，
+  检索只扫描离查询最近的 nprobe 个分区
+- 可选精确重算：另存 float32 向量（只在磁盘上），量化打分的前若干候选按原始向量重新计算距离
+- 块ID、内容、元数据保存在 SQLite 中，row 为块在矩阵文件中的行号
+
+删除只把行标记为无效（alive 文件），空间在 python maintain.py rebuild 时回收；
+重建时同时重新训练分区，并按分区重排各行，使同一分区的行在文件中连续。
+
+提供 VectorStore 用到的 Chroma collection 接口子集（add/update/delete/get/query/count），
+距离与 Chroma 的定义相同（cosine: 1 - 余弦相似度；ip: 1 - 内积；l2: 欧氏距离的平方）。
+"""
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+import numpy as np
+from .config import MMAP_INDEX_SETTINGS
+from .logger import logger
+
+DB_NAME = "index.sqlite3"
+CENTROIDS_FILE = "centroids.npy"
+# 每个分区至少需要的训练向量数，块数不足 nlist × 该值时不分区
+MIN_POINTS_PER_CENTROID = 39
+KMEANS_ITERATIONS = 10
+# SQLite 单条语句的参数个数上限
+SQL_BATCH = 900
+
+QUANTIZED_DTYPES = {"float16": np.float16, "int8": np.int8}
+SPACES = ("cosine", "ip", "l2")
+
+Rows = Union[slice, np.ndarray]
+
+def _nearest(vectors: np.ndarray, centroids: np.ndarray, block: int = 8192) -> np.ndarray:
+    """每个向量最近的中心（argmin ||x - c||² = argmax x·c - ||c||²/2），分批计算以限制内存"""
+    half_norms = 0.5 * np.sum(centroids ** 2, axis=1)
+    result = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), block):
+        scores = vectors[start:start + block] @ centroids.T - half_norms
+        result[start:start + block] = np.argmax(scores, axis=1)
+    return result
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+def train_centroids(sample: np.ndarray, nlist: int, spherical: bool = False,
+                    iterations: int = KMEANS_ITERATIONS, seed: int = 0) -> np.ndarray:
+    """k-means 训练分区中心；spherical 时中心归一化（余弦距离）"""
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = _nearest(sample, centroids)
+        counts = np.bincount(assign, minlength=nlist)
+        order = np.argsort(assign, kind="stable")
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        nonempty = counts > 0
+        sums = np.add.reduceat(sample[order], starts[nonempty], axis=0)
+        centroids[nonempty] = sums / counts[nonempty, None]
+        # 空分区用随机样本重新初始化
+        empty = np.flatnonzero(~nonempty)
+        if len(empty):
+            centroids[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+        if spherical:
+            centroids = _normalize(centroids)
+    return centroids.astype(np.float32)
+
+class MmapCollection:
+    """内存映射的量化向量矩阵 + SQLite 元数据"""
+
+    def __init__(self, directory: Path, space: str = "cosine", metadata: Optional[Dict[str, Any]] = None,
+                 settings: Optional[Dict[str, Any]] = None):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # 写操作串行执行；检索在各线程自己的只读连接上查询，不等待写入
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._readers: List[sqlite3.Connection] = []
+        self._conn = sqlite3.connect(str(self.directory / DB_NAME), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS chunks (
+                row INTEGER PRIMARY KEY,
+                id TEXT NOT NULL UNIQUE,
+                filename TEXT,
+                document TEXT,
+                metadata TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_filename ON chunks (filename)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.commit()
+
+        settings = {**MMAP_INDEX_SETTINGS, **(settings or {})}
+        self._meta = {key: json.loads(value) for key, value in self._conn.execute("SELECT key, value FROM meta")}
+        if not self._meta:
+            if settings["dtype"] not in QUANTIZED_DTYPES:
+                raise ValueError(f"不支持的向量类型: {settings['dtype']}")
+            if space not in SPACES:
+                raise ValueError(f"不支持的距离类型: {space}")
+            self._meta = {
+                "space": space,
+                "dtype": settings["dtype"],
+                "rescore": bool(settings["rescore"]),
+                "dim": None,
+                "metadata": dict(metadata or {})
+            }
+            self._save_meta()
+        else:
+            stored = {key: self._meta[key] for key in ("space", "dtype", "rescore")}
+            wanted = {"space": space, "dtype": settings["dtype"], "rescore": bool(settings["rescore"])}
+            if stored != wanted:
+                logger.warning(
+                    f"向量索引 {self.directory} 的参数 {stored} 与配置 {wanted} 不一致，"
+                    f"运行 python maintain.py rebuild 重建后生效"
+                )
+        # 创建索引时确定的参数以已保存的为准
+        self.settings = {**settings, "dtype": self._meta["dtype"], "rescore": self._meta["rescore"]}
+        self.space = self._meta["space"]
+        # (文件名, 是否可写) → (映射时的文件大小, 数组)
+        self._maps: Dict[Tuple[str, bool], Tuple[int, np.ndarray]] = {}
+        self._centroids: Optional[np.ndarray] = None
+        self._partition_cache: Optional[Tuple[Any, Tuple[np.ndarray, np.ndarray, int]]] = None
+        self._load_centroids()
+
+    # ---- 元数据与文件 ----
+
+    def _reader(self) -> sqlite3.Connection:
+        """当前线程的只读连接（WAL 模式下读不阻塞写）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.directory / DB_NAME), check_same_thread=False)
+            self._local.conn = conn
+            with self._lock:
+                self._readers.append(conn)
+        return conn
+
+    def _save_meta(self):
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                [(key, json.dumps(value, ensure_ascii=False)) for key, value in self._meta.items()]
+            )
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        """创建时传入的 collection 元数据（如嵌入模型名）"""
+        return dict(self._meta["metadata"])
+
+    @property
+    def dim(self) -> Optional[int]:
+        return self._meta["dim"]
+
+    def _layout(self, name: str) -> Tuple[Any, int]:
+        """矩阵文件的 (元素类型, 每行元素数)"""
+        if name == "vectors":
+            return QUANTIZED_DTYPES[self._meta["dtype"]], self.dim
+        if name == "full":
+            return np.float32, self.dim
+        if name == "scales":
+            return np.float32, 1
+        if name == "partitions":
+            return np.int32, 1
+        if name == "alive":
+            return np.uint8, 1
+        raise ValueError(name)
+
+    def _path(self, name: str) -> Path:
+        return self.directory / f"{name}.bin"
+
+    def _map(self, name: str, writable: bool = False) -> np.ndarray:
+        """映射矩阵文件；文件变大（本进程或其他进程写入）后重新映射"""
+        path = self._path(name)
+        size = path.stat().st_size if path.exists() else 0
+        cached = self._maps.get((name, writable))
+        if cached is not None and cached[0] == size:
+            return cached[1]
+        dtype, width = self._layout(name)
+        rows = size // (np.dtype(dtype).itemsize * width) if width else 0
+        shape = (rows, width) if name in ("vectors", "full") else (rows,)
+        if rows == 0:
+            array = np.empty(shape, dtype=dtype)
+        else:
+            array = np.memmap(path, dtype=dtype, mode="r+" if writable else "r", shape=shape)
+        self._maps[(name, writable)] = (size, array)
+        return array
+
+    def _write(self, name: str, start: int, values: np.ndarray):
+        """从第 start 行开始写入（写到固定位置，中断后重写不会错位）"""
+        dtype, width = self._layout(name)
+        data = np.ascontiguousarray(values, dtype=dtype)
+        path = self._path(name)
+        with open(path, "r+b" if path.exists() else "wb") as f:
+            f.seek(start * np.dtype(dtype).itemsize * width)
+            f.write(data.tobytes())
+
+    def _rows(self) -> int:
+        """矩阵的总行数（含已删除的行）"""
+        path = self._path("alive")
+        return path.stat().st_size if path.exists() else 0
+
+    def _set_alive(self, rows: Sequence[int], value: int):
+        if len(rows) == 0:
+            return
+        alive = self._map("alive", writable=True)
+        alive[np.asarray(rows, dtype=np.int64)] = value
+        alive.flush()
+
+    def _load_centroids(self):
+        path = self.directory / CENTROIDS_FILE
+        if self._centroids is None and path.exists():
+            self._centroids = np.load(path)
+
+    # ---- 向量编码 ----
+
+    def _prepare(self, embeddings) -> np.ndarray:
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim != 2:
+            raise ValueError("向量应为二维数组")
+        return _normalize(vectors) if self.space == "cosine" else vectors
+
+    def _encode(self, vectors: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """量化为 (编码, 每行缩放系数)"""
+        if self._meta["dtype"] == "float16":
+            return vectors.astype(np.float16), None
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+
+    def _dequantize(self, rows: Rows) -> np.ndarray:
+        vectors = np.asarray(self._map("vectors")[rows], dtype=np.float32)
+        if self._meta["dtype"] == "int8":
+            vectors *= np.asarray(self._map("scales")[rows], dtype=np.float32)[:, None]
+        return vectors
+
+    def _vectors(self, rows: Rows) -> np.ndarray:
+        """按行读取向量：有 float32 副本时读原始向量，否则反量化"""
+        if self._meta["rescore"]:
+            return np.asarray(self._map("full")[rows], dtype=np.float32)
+        return self._dequantize(rows)
+
+    def _scores(self, query: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+        """相似度分数（越大越近）：cosine/ip 为内积，l2 为 2q·x - ||x||²"""
+        scores = vectors @ query
+        if self.space == "l2":
+            scores = 2 * scores - np.einsum("ij,ij->i", vectors, vectors)
+        return scores
+
+    def _distances(self, query: np.ndarray, scores: np.ndarray) -> np.ndarray:
+        if self.space == "l2":
+            return float(query @ query) - scores
+        return 1.0 - scores
+
+    # ---- 分区 ----
+
+    def train(self, nlist: Optional[int] = None, seed: int = 0):
+        """训练分区中心并为所有行分配分区"""
+        nlist = nlist or self.settings["nlist"]
+        with self._lock:
+            live = self._live_rows()
+            if len(live) < nlist:
+                raise ValueError(f"块数 {len(live)} 少于分区数 {nlist}")
+            rng = np.random.default_rng(seed)
+            sample_rows = np.sort(rng.choice(live, min(len(live), self.settings["train_sample"]), replace=False))
+            centroids = train_centroids(self._vectors(sample_rows), nlist, self.space == "cosine", seed=seed)
+
+            total = self._rows()
+            block = self.settings["scan_block_rows"]
+            partitions = np.empty(total, dtype=np.int32)
+            for start in range(0, total, block):
+                end = min(start + block, total)
+                partitions[start:end] = _nearest(self._vectors(slice(start, end)), centroids)
+            # 先写分区再写中心：看到中心的进程一定能读到分区
+            self._write("partitions", 0, partitions)
+            temporary = self.directory / (CENTROIDS_FILE + ".tmp")
+            with open(temporary, "wb") as f:
+                np.save(f, centroids)
+            os.replace(temporary, self.directory / CENTROIDS_FILE)
+            self._centroids = centroids
+            self._partition_cache = None
+            logger.info(f"向量索引分区训练完成: {nlist} 个分区，样本 {len(sample_rows)} 个")
+
+    def _maybe_train(self):
+        nlist = self.settings["nlist"]
+        if not nlist or self._centroids is not None:
+            return
+        if int(np.count_nonzero(self._map("alive"))) >= nlist * MIN_POINTS_PER_CENTROID:
+            self.train(nlist)
+
+    def _partition_index(self) -> Optional[Tuple[np.ndarray, np.ndarray, int]]:
+        """(按分区排序的行号, 各分区的起止位置, 已分配分区的行数)；未分区时为 None"""
+        self._load_centroids()
+        if self._centroids is None:
+            return None
+        partitions = self._map("partitions")
+        key = (len(partitions), id(self._centroids))
+        cached = self._partition_cache
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        order = np.argsort(partitions, kind="stable")
+        bounds = np.searchsorted(partitions[order], np.arange(len(self._centroids) + 1))
+        index = (order, bounds, len(partitions))
+        self._partition_cache = (key, index)
+        return index
+
+    def _candidate_blocks(self, query: np.ndarray, total: int) -> Iterator[Rows]:
+        """按批产出要扫描的行：未分区时全量扫描，否则只扫描最近的 nprobe 个分区"""
+        block = self.settings["scan_block_rows"]
+        index = self._partition_index()
+        covered = 0
+        if index is not None:
+            order, bounds, covered = index
+            centroids = self._centroids
+            nprobe = min(self.settings["nprobe"], len(centroids))
+            closeness = centroids @ query - 0.5 * np.sum(centroids ** 2, axis=1)
+            probes = np.argpartition(-closeness, nprobe - 1)[:nprobe]
+            # 排序后按文件中的顺序读取
+            rows = np.sort(np.concatenate([order[bounds[p]:bounds[p + 1]] for p in probes]))
+            # 其他进程正在写入的行（分区已写、尚未完成）不扫描
+            rows = rows[rows < total]
+            for start in range(0, len(rows), block):
+                yield rows[start:start + block]
+        # 尚未分配分区的行（如其他进程训练之前写入的）总是扫描
+        for start in range(covered, total, block):
+            yield slice(start, min(start + block, total))
+
+    # ---- Chroma collection 接口 ----
+
+    def count(self) -> int:
+        return self._reader().execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def add(self, ids: List[str], embeddings, documents: Optional[List[str]] = None,
+            metadatas: Optional[List[Dict[str, Any]]] = None):
+        """追加块；已存在的块ID跳过（与 Chroma 相同）"""
+        if not ids:
+            return
+        documents = documents or [None] * len(ids)
+        metadatas = metadatas or [{} for _ in ids]
+        with self._lock:
+            vectors = self._prepare(embeddings)
+            if self.dim is None:
+                self._meta["dim"] = int(vectors.shape[1])
+                self._save_meta()
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"向量维度 {vectors.shape[1]} 与索引维度 {self.dim} 不一致")
+            self._load_centroids()
+
+            # BEGIN IMMEDIATE 同时作为跨进程的写锁，行号在锁内确定
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                existing = set()
+                for start in range(0, len(ids), SQL_BATCH):
+                    batch = ids[start:start + SQL_BATCH]
+                    existing.update(row[0] for row in self._conn.execute(
+                        f"SELECT id FROM chunks WHERE id IN ({','.join('?' * len(batch))})", batch
+                    ))
+                keep, seen = [], set()
+                for i, id in enumerate(ids):
+                    if id not in existing and id not in seen:
+                        keep.append(i)
+                        seen.add(id)
+                if len(keep) < len(ids):
+                    logger.warning(f"跳过 {len(ids) - len(keep)} 个已存在的块ID")
+                start = self._rows()
+                rows = list(range(start, start + len(keep)))
+                if keep:
+                    selected = vectors[keep]
+                    codes, scales = self._encode(selected)
+                    self._write("vectors", start, codes)
+                    if scales is not None:
+                        self._write("scales", start, scales)
+                    if self._meta["rescore"]:
+                        self._write("full", start, selected)
+                    if self._centroids is not None:
+                        self._write("partitions", start, _nearest(selected, self._centroids))
+                    # 提交前新行标记为无效，提交后才能被检索到
+                    self._write("alive", start, np.zeros(len(keep), dtype=np.uint8))
+                    self._conn.executemany(
+                        "INSERT INTO chunks (row, id, filename, document, metadata) VALUES (?, ?, ?, ?, ?)",
+                        [
+                            (row, ids[i], (metadatas[i] or {}).get("filename"), documents[i],
+                             json.dumps(metadatas[i] or {}, ensure_ascii=False))
+                            for row, i in zip(rows, keep)
+                        ]
+                    )
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+            self._set_alive(rows, 1)
+            self._maybe_train()
+
+    def update(self, ids: List[str], metadatas: Optional[List[Dict[str, Any]]] = None,
+               documents: Optional[List[str]] = None, embeddings=None):
+        """更新元数据或内容（向量不可更新，需删除后重新添加）"""
+        if embeddings is not None:
+            raise ValueError("mmap 后端不支持更新向量，请删除后重新添加")
+        with self._lock, self._conn:
+            if metadatas is not None:
+                self._conn.executemany(
+                    "UPDATE chunks SET metadata = ?, filename = ? WHERE id = ?",
+                    [(json.dumps(metadata or {}, ensure_ascii=False), (metadata or {}).get("filename"), id)
+                     for id, metadata in zip(ids, metadatas)]
+                )
+            if documents is not None:
+                self._conn.executemany(
+                    "UPDATE chunks SET document = ? WHERE id = ?", list(zip(documents, ids))
+                )
+
+    @staticmethod
+    def _filename_filter(where: Dict[str, Any]) -> str:
+        """只支持 {"filename": 值} 或 {"filename": {"$eq": 值}}"""
+        if set(where) == {"filename"}:
+            value = where["filename"]
+            if isinstance(value, dict) and set(value) == {"$eq"}:
+                value = value["$eq"]
+            if isinstance(value, str):
+                return value
+        raise ValueError(f"mmap 后端只支持按 filename 过滤: {where}")
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None):
+        """删除块：从 SQLite 中删除并把所在行标记为无效"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows: List[int] = []
+                if ids:
+                    for start in range(0, len(ids), SQL_BATCH):
+                        batch = ids[start:start + SQL_BATCH]
+                        placeholders = ",".join("?" * len(batch))
+                        rows.extend(row[0] for row in self._conn.execute(
+                            f"SELECT row FROM chunks WHERE id IN ({placeholders})", batch
+                        ))
+                        self._conn.execute(f"DELETE FROM chunks WHERE id IN ({placeholders})", batch)
+                if where:
+                    filename = self._filename_filter(where)
+                    rows.extend(row[0] for row in self._conn.execute(
+                        "SELECT row FROM chunks WHERE filename = ?", (filename,)
+                    ))
+                    self._conn.execute("DELETE FROM chunks WHERE filename = ?", (filename,))
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+            self._set_alive(rows, 0)
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None,
+            include: Sequence[str] = ("documents", "metadatas"),
+            limit: Optional[int] = None, offset: Optional[int] = None) -> Dict[str, Any]:
+        """按ID、文件名或分页（按行号顺序）读取块"""
+        records = []
+        conn = self._reader()
+        select = "SELECT row, id, document, metadata FROM chunks"
+        if ids is not None:
+            for start in range(0, len(ids), SQL_BATCH):
+                batch = ids[start:start + SQL_BATCH]
+                records.extend(conn.execute(
+                    f"{select} WHERE id IN ({','.join('?' * len(batch))}) ORDER BY row", batch
+                ))
+        elif where:
+            records = conn.execute(
+                f"{select} WHERE filename = ? ORDER BY row LIMIT ? OFFSET ?",
+                (self._filename_filter(where), -1 if limit is None else limit, offset or 0)
+            ).fetchall()
+        else:
+            records = conn.execute(
+                f"{select} ORDER BY row LIMIT ? OFFSET ?", (-1 if limit is None else limit, offset or 0)
+            ).fetchall()
+        return self._format(records, include)
+
+    def _format(self, records: List[tuple], include: Sequence[str],
+                distances: Optional[List[float]] = None) -> Dict[str, Any]:
+        result: Dict[str, Any] = {"ids": [record[1] for record in records]}
+        if "documents" in include:
+            result["documents"] = [record[2] for record in records]
+        if "metadatas" in include:
+            result["metadatas"] = [json.loads(record[3]) for record in records]
+        if "embeddings" in include:
+            rows = np.asarray([record[0] for record in records], dtype=np.int64)
+            result["embeddings"] = self._vectors(rows) if len(rows) else np.empty((0, self.dim or 0), np.float32)
+        if distances is not None and "distances" in include:
+            result["distances"] = distances
+        return result
+
+    def query(self, query_embeddings, n_results: int = 10,
+              include: Sequence[str] = ("documents", "metadatas", "distances")) -> Dict[str, Any]:
+        """近邻检索，返回结构与 Chroma 相同（每个查询一个列表）"""
+        result: Dict[str, List[Any]] = {"ids": []}
+        for key in ("documents", "metadatas", "distances"):
+            if key in include:
+                result[key] = []
+        for embedding in query_embeddings:
+            rows, distances = self._search(np.asarray(embedding, dtype=np.float32), n_results)
+            records = self._records(rows)
+            found = [(records[row], distance) for row, distance in zip(rows, distances) if row in records]
+            formatted = self._format([record for record, _ in found], include,
+                                     [distance for _, distance in found])
+            for key in result:
+                result[key].append(formatted[key])
+        return result
+
+    def _records(self, rows: List[int]) -> Dict[int, tuple]:
+        records = {}
+        conn = self._reader()
+        for start in range(0, len(rows), SQL_BATCH):
+            batch = rows[start:start + SQL_BATCH]
+            for record in conn.execute(
+                f"SELECT row, id, document, metadata FROM chunks WHERE row IN ({','.join('?' * len(batch))})",
+                batch
+            ):
+                records[record[0]] = record
+        return records
+
+    def _search(self, query: np.ndarray, n_results: int) -> Tuple[List[int], List[float]]:
+        """量化打分取候选，有 float32 副本时对候选精确重算；返回 (行号, 距离)，按距离升序"""
+        total = self._rows()
+        if self.dim is None and total:
+            # 索引由其他进程写入了第一批向量
+            stored = self._reader().execute("SELECT value FROM meta WHERE key = 'dim'").fetchone()
+            self._meta["dim"] = json.loads(stored[0]) if stored else None
+        if total == 0 or self.dim is None or n_results <= 0:
+            return [], []
+        query = self._prepare(query[None, :])[0]
+        keep = n_results * self.settings["rescore_factor"] if self._meta["rescore"] else n_results
+        alive = self._map("alive")
+
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for rows in self._candidate_blocks(query, total):
+            scores = self._scores(query, self._dequantize(rows))
+            row_ids = np.arange(rows.start, rows.stop) if isinstance(rows, slice) else rows
+            live = alive[rows] == 1
+            scores, row_ids = scores[live], row_ids[live]
+            best_scores = np.concatenate([best_scores, scores])
+            best_rows = np.concatenate([best_rows, row_ids])
+            if len(best_scores) > keep:
+                top = np.argpartition(-best_scores, keep - 1)[:keep]
+                best_scores, best_rows = best_scores[top], best_rows[top]
+
+        if self._meta["rescore"] and len(best_rows):
+            order = np.argsort(best_rows)
+            best_rows = best_rows[order]
+            best_scores = self._scores(query, self._vectors(best_rows))
+        top = np.argsort(-best_scores, kind="stable")[:n_results]
+        distances = self._distances(query, best_scores[top])
+        return best_rows[top].tolist(), [float(distance) for distance in distances]
+
+    # ---- 维护 ----
+
+    def _live_rows(self) -> np.ndarray:
+        return np.flatnonzero(self._map("alive"))
+
+    def compact(self):
+        """回收已删除的行，按需重新训练分区，并按分区重排各行
+
+        以 SQLite 中的块为准（也修复中断写入留下的不一致）；会替换矩阵文件，
+        只能在没有其他进程使用该索引时调用（maintain.py rebuild 对新建的索引调用）。
+        """
+        with self._lock:
+            live = np.asarray([row for (row,) in self._conn.execute("SELECT row FROM chunks ORDER BY row")],
+                              dtype=np.int64)
+            nlist = self.settings["nlist"]
+            if nlist and len(live) >= nlist * MIN_POINTS_PER_CENTROID and (
+                    self._centroids is None or len(self._centroids) != nlist):
+                self.train(nlist)
+            elif not nlist and self._centroids is not None:
+                # 配置改为不分区
+                self._centroids = None
+                (self.directory / CENTROIDS_FILE).unlink()
+                self._path("partitions").unlink(missing_ok=True)
+
+            if self._centroids is not None:
+                partitions = self._map("partitions")
+                assigned = np.empty(len(live), dtype=np.int32)
+                covered = live < len(partitions)
+                assigned[covered] = partitions[live[covered]]
+                if not covered.all():
+                    assigned[~covered] = _nearest(self._vectors(live[~covered]), self._centroids)
+                order = np.argsort(assigned, kind="stable")
+                live, assigned = live[order], assigned[order]
+
+            names = ["vectors"] + (["scales"] if self._meta["dtype"] == "int8" else []) + \
+                (["full"] if self._meta["rescore"] else [])
+            block = self.settings["scan_block_rows"]
+            temporary = {name: self.directory / f"{name}.bin.tmp" for name in names + ["partitions", "alive"]}
+            for name in names:
+                dtype, _ = self._layout(name)
+                source = self._map(name)
+                with open(temporary[name], "wb") as f:
+                    for start in range(0, len(live), block):
+                        f.write(np.ascontiguousarray(source[live[start:start + block]], dtype=dtype).tobytes())
+            source = partitions = None
+            if self._centroids is not None:
+                temporary["partitions"].write_bytes(assigned.astype(np.int32).tobytes())
+            temporary["alive"].write_bytes(np.ones(len(live), dtype=np.uint8).tobytes())
+
+            # 新行号：按 live 中的位置；先改成负数避免主键冲突
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS remap (old INTEGER PRIMARY KEY, new INTEGER)")
+                self._conn.execute("DELETE FROM remap")
+                self._conn.executemany("INSERT INTO remap (old, new) VALUES (?, ?)",
+                                       [(int(old), new) for new, old in enumerate(live)])
+                self._conn.execute("UPDATE chunks SET row = -1 - (SELECT new FROM remap WHERE old = chunks.row)")
+                self._conn.execute("UPDATE chunks SET row = -1 - row")
+                self._conn.execute("DROP TABLE remap")
+                self._maps.clear()
+                for name, path in temporary.items():
+                    if path.exists():
+                        os.replace(path, self._path(name))
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+            self._partition_cache = None
+            logger.info(f"向量索引压缩完成: {len(live)} 行")
+
+    def stats(self) -> Dict[str, Any]:
+        """索引概况：行数、已删除行数、量化与分区参数、各文件大小"""
+        total = self._rows()
+        live = int(np.count_nonzero(self._map("alive")))
+        self._load_centroids()
+        return {
+            "backend": "mmap",
+            "space": self.space,
+            "dtype": self._meta["dtype"],
+            "rescore": self._meta["rescore"],
+            "dim": self.dim,
+            "count": self.count(),
+            "rows": total,
+            "deleted_rows": total - live,
+            "nlist": 0 if self._centroids is None else len(self._centroids),
+            "configured_nlist": self.settings["nlist"],
+            "nprobe": self.settings["nprobe"],
+            "file_bytes": {
+                path.name: path.stat().st_size for path in sorted(self.directory.iterdir()) if path.is_file()
+            }
+        }
+
+    def close(self):
+        """释放文件映射与数据库连接（Windows 下映射中的文件无法替换）"""
+        with self._lock:
+            self._maps.clear()
+            self._partition_cache = None
+            for conn in self._readers:
+                conn.close()
+            self._readers.clear()
+            self._conn.close()
@@ -0,0 +1,155 @@
+"""
+模型生命周期管理
+
+- 启动时预加载默认模型
+- 切换模型时在后台预热新模型，加载完成前由原模型继续回答
+- 按模型配置 keep_alive
+- 汇报 Ollama 中驻留的模型及其加载耗时、内存占用
+"""
+import threading
+import time
+from datetime import datetime
+from typing import TYPE_CHECKING, List, Dict, Any, Optional, Union
+from .config import DEFAULT_KEEP_ALIVE, MODEL_KEEP_ALIVE, PRELOAD_MODELS
+from .logger import logger, log_error
+
+if TYPE_CHECKING:
+    import ollama
+
+# 驻留模型列表（ollama ps）的缓存时间（秒）
+RESIDENT_CACHE_SECONDS = 5.0
+
+class ModelManager:
+    def __init__(self, client: "ollama.Client"):
+        self.client = client
+        self._lock = threading.Lock()
+        # 模型 → {"status": loading/ready/failed, "load_seconds", "loaded_at", "error"}
+        self._states: Dict[str, Dict[str, Any]] = {}
+        self._resident: Optional[Dict[str, Dict[str, Any]]] = {}
+        self._resident_checked_at = float("-inf")
+
+    @staticmethod
+    def keep_alive_for(model: str) -> Union[str, int]:
+        """模型的保活时间"""
+        return MODEL_KEEP_ALIVE.get(model, DEFAULT_KEEP_ALIVE)
+
+    def load(self, model: str) -> float:
+        """同步加载模型（空提示词触发加载），返回耗时（秒）"""
+        with self._lock:
+            self._states[model] = {"status": "loading", "started_at": time.monotonic()}
+        start = time.perf_counter()
+        try:
+            self.client.generate(model=model, prompt="", keep_alive=self.keep_alive_for(model))
+        except Exception as e:
+            with self._lock:
+                self._states[model] = {"status": "failed", "error": str(e)}
+            log_error(e, f"加载模型失败: {model}")
+            raise
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._states[model] = {
+                "status": "ready",
+                "load_seconds": round(elapsed, 2),
+                "loaded_at": datetime.now().isoformat(timespec="seconds")
+            }
+            self._resident_checked_at = float("-inf")
+        logger.info(f"模型已加载: {model}，耗时 {elapsed:.1f}s")
+        return elapsed
+
+    def warm(self, model: str) -> bool:
+        """在后台线程中预热模型；已驻留或正在加载时不重复加载，返回是否启动了预热"""
+        if self.is_ready(model):
+            return False
+        with self._lock:
+            if self._states.get(model, {}).get("status") == "loading":
+                return False
+            self._states[model] = {"status": "loading", "started_at": time.monotonic()}
+
+        def run():
+            try:
+                self.load(model)
+            except Exception:
+                pass
+
+        threading.Thread(target=run, name=f"warm-{model}", daemon=True).start()
+        logger.info(f"开始后台预热模型: {model}")
+        return True
+
+    def preload(self, models: List[str] = None):
+        """预加载配置中的模型（后台执行）"""
+        for model in models or PRELOAD_MODELS:
+            self.warm(model)
+
+    def status(self, model: str) -> str:
+        """模型状态：ready / loading / failed / unloaded"""
+        if self.is_ready(model):
+            return "ready"
+        with self._lock:
+            return self._states.get(model, {}).get("status", "unloaded")
+
+    def is_ready(self, model: str) -> bool:
+        """模型是否已驻留在 Ollama 中"""
+        resident = self._get_resident()
+        if resident is None:
+            # 无法获取驻留列表时以本地记录为准
+            with self._lock:
+                return self._states.get(model, {}).get("status") == "ready"
+        return model in resident
+
+    def serving_model(self, requested: str, previous: Optional[str] = None) -> str:
+        """实际用于回答的模型：新模型未就绪时继续使用已就绪的原模型，并在后台预热新模型"""
+        if requested == previous or self.is_ready(requested):
+            return requested
+        self.warm(requested)
+        if previous and self.is_ready(previous):
+            logger.info(f"模型 {requested} 加载中，暂由 {previous} 回答")
+            return previous
+        return requested
+
+    def resident_models(self) -> List[Dict[str, Any]]:
+        """驻留模型列表：名称、内存占用、过期时间，以及本进程记录的加载耗时"""
+        resident = self._get_resident(force=True) or {}
+        with self._lock:
+            states = dict(self._states)
+        models = []
+        for name, info in resident.items():
+            models.append({
+                "name": name,
+                "size": info.get("size"),
+                "size_vram": info.get("size_vram"),
+                "expires_at": str(info.get("expires_at", "")),
+                "keep_alive": self.keep_alive_for(name),
+                "load_seconds": states.get(name, {}).get("load_seconds"),
+                "loaded_at": states.get(name, {}).get("loaded_at")
+            })
+        for name, state in states.items():
+            if name not in resident and state.get("status") == "loading":
+                models.append({"name": name, "status": "loading"})
+        return models
+
+    def _get_resident(self, force: bool = False) -> Optional[Dict[str, Dict[str, Any]]]:
+        """查询 Ollama 中驻留的模型（短时间内缓存结果，查询失败时返回 None）
+
+        失败同样缓存 RESIDENT_CACHE_SECONDS 秒（force 也不重试），
+        避免 Ollama 不可用期间每次调用都等待连接超时。
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now - self._resident_checked_at < RESIDENT_CACHE_SECONDS and (not force or self._resident is None):
+                return self._resident
+        try:
+            response = self.client.ps()
+        except Exception as e:
+            log_error(e, "获取驻留模型失败")
+            with self._lock:
+                self._resident = None
+                self._resident_checked_at = now
+            return None
+        resident = {}
+        for model in response.get("models", []):
+            info = dict(model)
+            resident[info.get("name") or info.get("model")] = info
+        with self._lock:
+            self._resident = resident
+            self._resident_checked_at = now
+        return resident
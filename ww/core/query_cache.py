@@ -0,0 +1,157 @@
+"""
+查询结果缓存
+
+- TTLCache: 线程安全的 LRU 缓存，支持过期时间和条数上限
+- 第一级：检索结果缓存，按规范化后的查询缓存 VectorStore.search 的结果
+- 第二级：AnswerCache，按 (模型, 参数, 提示词哈希) 缓存完整回答，
+  可选按查询向量相似度查找近似重复的问题
+
+文档变化时（add_documents/delete_documents）两级缓存都会被清空。
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, Hashable, List, Optional, Tuple
+from .config import QUERY_CACHE_SETTINGS
+from .logger import logger
+
+if TYPE_CHECKING:
+    import numpy as np
+
+def normalize_query(query: str) -> str:
+    """规范化查询：全角转半角、小写、合并空白"""
+    query = unicodedata.normalize("NFKC", query).strip().lower()
+    return re.sub(r"\s+", " ", query)
+
+class TTLCache:
+    """带过期时间的 LRU 缓存"""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+class AnswerCache:
+    """完整回答缓存：精确匹配提示词，或按查询向量相似度匹配近似问题"""
+
+    def __init__(self, max_entries: int = QUERY_CACHE_SETTINGS["answer_max_entries"],
+                 ttl: float = QUERY_CACHE_SETTINGS["answer_ttl"],
+                 similarity_threshold: Optional[float] = QUERY_CACHE_SETTINGS["semantic_threshold"]):
+        self.exact = TTLCache(max_entries, ttl)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        # 近似查找：作用域 → 有序的 (过期时间, 归一化向量, 回答)
+        self._semantic: Dict[str, "OrderedDict[str, Tuple[float, np.ndarray, str]]"] = {}
+        self._lock = threading.Lock()
+        self.semantic_hits = 0
+
+    @staticmethod
+    def make_key(model: str, params: Dict, prompt: str) -> str:
+        payload = json.dumps([model, params], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256((payload + "\n" + prompt).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def make_scope(model: str, params: Dict, scope: str) -> str:
+        return json.dumps([model, params, scope], sort_keys=True, ensure_ascii=False)
+
+    def lookup(self, key: str, scope: str = None, query_embedding: List[float] = None) -> Optional[str]:
+        """查找缓存的回答：先精确匹配，再按相似度匹配"""
+        answer = self.exact.get(key)
+        if answer is not None or not self._semantic_enabled(scope, query_embedding):
+            return answer
+
+        import numpy as np
+        vector = self._normalize(query_embedding)
+        now = time.monotonic()
+        with self._lock:
+            entries = self._semantic.get(scope)
+            if not entries:
+                return None
+            best_score, best_answer = -1.0, None
+            for entry_key, (expires, entry_vector, entry_answer) in list(entries.items()):
+                if expires < now:
+                    del entries[entry_key]
+                    continue
+                score = float(np.dot(vector, entry_vector))
+                if score > best_score:
+                    best_score, best_answer = score, entry_answer
+            if best_answer is not None and best_score >= self.similarity_threshold:
+                self.semantic_hits += 1
+                logger.info(f"命中近似问题缓存，相似度 {best_score:.3f}")
+                return best_answer
+        return None
+
+    def store(self, key: str, answer: str, scope: str = None, query_embedding: List[float] = None):
+        """缓存回答"""
+        self.exact.set(key, answer)
+        if not self._semantic_enabled(scope, query_embedding):
+            return
+        with self._lock:
+            entries = self._semantic.setdefault(scope, OrderedDict())
+            entries[key] = (time.monotonic() + self.ttl, self._normalize(query_embedding), answer)
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def clear(self):
+        self.exact.clear()
+        with self._lock:
+            self._semantic.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.exact.stats()
+        stats["semantic_hits"] = self.semantic_hits
+        return stats
+
+    def _semantic_enabled(self, scope: Optional[str], query_embedding: Optional[List[float]]) -> bool:
+        return self.similarity_threshold is not None and scope is not None and query_embedding is not None
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> "np.ndarray":
+        import numpy as np
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
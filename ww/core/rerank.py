@@ -0,0 +1,247 @@
+"""
+重排序
+
+检索阶段多取候选（RERANK_SETTINGS["candidates"]），在这里重新打分后只保留前几个：
+- CrossEncoderReranker: 本地 ONNX 交叉编码器，CPU 上按批打分（onnxruntime 与 tokenizers 随 chromadb 安装）
+- OllamaReranker: 让 Ollama 中的小模型给每个候选打 0~10 分，多个请求并行
+
+重排序有耗时上限，超时或出错时按原检索顺序返回，不影响回答。
+"""
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Dict, Any, Optional
+from .config import OLLAMA_BASE_URL, RERANK_SETTINGS, QUERY_CACHE_SETTINGS
+from .metrics import metrics, span
+from .models import ModelManager
+from .query_cache import TTLCache, normalize_query
+from .logger import logger, log_error
+
+if TYPE_CHECKING:
+    import ollama
+
+OLLAMA_RERANK_PROMPT = """请判断文档与问题的相关程度，只输出 0 到 10 之间的一个整数，10 表示文档能直接回答问题。
+
+问题：{query}
+
+文档：{document}
+
+相关度："""
+
+_SCORE_PATTERN = re.compile(r"\d+(?:\.\d+)?")
+
+class Reranker:
+    """重排序模型接口"""
+    backend = "unknown"
+    model_name = "unknown"
+
+    def __init__(self):
+        # 打分在线程中执行，调用方按耗时上限等待
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="rerank")
+        # (问题, 块ID) → 分数，重复的问题不必重新打分
+        self._cache = TTLCache(QUERY_CACHE_SETTINGS["retrieval_max_entries"] * 10,
+                               QUERY_CACHE_SETTINGS["retrieval_ttl"])
+
+    def score(self, query: str, texts: List[str], deadline: Optional[float] = None) -> List[float]:
+        """计算每个文本与问题的相关度（越大越相关）；超过 deadline（time.monotonic）时抛出 TimeoutError"""
+        raise NotImplementedError
+
+    def warm_up(self):
+        """加载模型（需要加载的后端在首次打分前调用，加载时间不计入耗时上限）"""
+
+    def rerank(self, query: str, documents: List[Dict[str, Any]], top_n: int,
+               timeout: float = RERANK_SETTINGS["timeout"]) -> List[Dict[str, Any]]:
+        """按相关度重排序，返回前 top_n 个（带 rerank_score）；超时或出错时按原顺序返回前 top_n 个"""
+        if len(documents) <= 1:
+            return documents[:top_n]
+        # 耗时上限从模型加载完成后开始计算，否则首次重排序总会超时
+        self.warm_up()
+        deadline = time.monotonic() + timeout
+        with span("rerank", labels={"backend": self.backend}) as info:
+            info.update(candidates=len(documents))
+            normalized = normalize_query(query)
+            scores = [self._cache.get((normalized, doc.get('id'))) if doc.get('id') else None
+                      for doc in documents]
+            missing = [i for i, score in enumerate(scores) if score is None]
+            if missing:
+                future = self._executor.submit(
+                    self.score, query, [documents[i]['content'] for i in missing], deadline
+                )
+                try:
+                    computed = future.result(timeout=max(deadline - time.monotonic(), 0.0))
+                except (FutureTimeoutError, TimeoutError):
+                    future.cancel()
+                    return self._fallback(documents, top_n, "timeout", info)
+                except Exception as e:
+                    log_error(e, "重排序失败")
+                    return self._fallback(documents, top_n, "error", info)
+                for i, score in zip(missing, computed):
+                    scores[i] = score
+                    if documents[i].get('id'):
+                        self._cache.set((normalized, documents[i]['id']), score)
+
+            ranked = sorted(
+                ({**doc, 'rerank_score': score} for doc, score in zip(documents, scores)),
+                key=lambda doc: doc['rerank_score'],
+                reverse=True
+            )
+            info.update(scored=len(missing), results=min(top_n, len(ranked)))
+            return ranked[:top_n]
+
+    @staticmethod
+    def _fallback(documents: List[Dict[str, Any]], top_n: int, reason: str,
+                  info: Dict[str, Any]) -> List[Dict[str, Any]]:
+        logger.warning(f"重排序未完成（{reason}），按原检索顺序返回")
+        metrics.increment("rerank_fallbacks_total", labels={"reason": reason})
+        info.update(fallback=reason, results=min(top_n, len(documents)))
+        return documents[:top_n]
+
+class CrossEncoderReranker(Reranker):
+    """本地 ONNX 交叉编码器，模型在 warm_up 或首次重排序时加载"""
+    backend = "cross_encoder"
+
+    def __init__(self, model_path: str = RERANK_SETTINGS["model_path"],
+                 batch_size: int = RERANK_SETTINGS["batch_size"],
+                 max_length: int = RERANK_SETTINGS["max_length"],
+                 num_threads: Optional[int] = RERANK_SETTINGS["num_threads"]):
+        super().__init__()
+        self.model_path = Path(model_path)
+        self.model_name = self.model_path.name
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.num_threads = num_threads
+        self._session = None
+        self._tokenizer = None
+        self._input_names = set()
+        self._load_error: Optional[Exception] = None
+        self._load_lock = threading.Lock()
+
+    def warm_up(self):
+        """加载模型与分词器；失败时只记录错误，之后的打分按出错回退"""
+        try:
+            self._load()
+        except Exception:
+            pass
+
+    def _load(self):
+        """加载模型与分词器；失败后不再重试，每次打分直接报错"""
+        with self._load_lock:
+            if self._session is not None:
+                return
+            if self._load_error is not None:
+                raise RuntimeError(f"交叉编码器不可用: {self._load_error}")
+            try:
+                import onnxruntime
+                from tokenizers import Tokenizer
+                model_file = next(
+                    (path for path in (self.model_path / "model.onnx", self.model_path / "onnx" / "model.onnx")
+                     if path.exists()),
+                    None
+                )
+                if model_file is None:
+                    raise FileNotFoundError(f"在 {self.model_path} 中找不到 model.onnx")
+                options = onnxruntime.SessionOptions()
+                if self.num_threads:
+                    options.intra_op_num_threads = self.num_threads
+                session = onnxruntime.InferenceSession(
+                    str(model_file), options, providers=["CPUExecutionProvider"]
+                )
+                tokenizer = Tokenizer.from_file(str(self.model_path / "tokenizer.json"))
+                tokenizer.enable_truncation(max_length=self.max_length)
+                if tokenizer.padding is None:
+                    pad_token = next(
+                        (token for token in ("[PAD]", "<pad>") if tokenizer.token_to_id(token) is not None), None
+                    )
+                    tokenizer.enable_padding(
+                        pad_id=tokenizer.token_to_id(pad_token) if pad_token else 0,
+                        pad_token=pad_token or "[PAD]"
+                    )
+            except Exception as e:
+                self._load_error = e
+                log_error(e, f"加载交叉编码器失败: {self.model_path}")
+                raise
+            self._input_names = {item.name for item in session.get_inputs()}
+            self._tokenizer = tokenizer
+            self._session = session
+            logger.info(f"交叉编码器已加载: {model_file}")
+
+    def score(self, query: str, texts: List[str], deadline: Optional[float] = None) -> List[float]:
+        import numpy as np
+        self._load()
+        scores = [0.0] * len(texts)
+        # 按长度排序后分批，同一批内的补齐更少
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        for start in range(0, len(order), self.batch_size):
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError("重排序超时")
+            batch = order[start:start + self.batch_size]
+            encodings = self._tokenizer.encode_batch([(query, texts[i]) for i in batch])
+            inputs = {
+                "input_ids": np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+                "attention_mask": np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64),
+                "token_type_ids": np.array([encoding.type_ids for encoding in encodings], dtype=np.int64)
+            }
+            logits = self._session.run(None, {name: value for name, value in inputs.items()
+                                              if name in self._input_names})[0]
+            logits = np.asarray(logits, dtype=np.float32).reshape(len(batch), -1)
+            # 单输出模型直接取 logit；二分类模型取“相关”与“不相关”的 logit 之差
+            values = logits[:, 0] if logits.shape[1] == 1 else logits[:, 1] - logits[:, 0]
+            for i, value in zip(batch, 1.0 / (1.0 + np.exp(-values))):
+                scores[i] = float(value)
+        return scores
+
+class OllamaReranker(Reranker):
+    """用 Ollama 中的小模型逐个打分（并行请求，每次只生成几个 token）"""
+    backend = "ollama"
+
+    def __init__(self, model_name: str = RERANK_SETTINGS["ollama_model"], client: "ollama.Client" = None,
+                 workers: int = RERANK_SETTINGS["ollama_workers"],
+                 max_chars: int = RERANK_SETTINGS["max_chars"]):
+        super().__init__()
+        self.model_name = model_name
+        if client is None:
+            import ollama
+            client = ollama.Client(host=OLLAMA_BASE_URL)
+        self.client = client
+        self.max_chars = max_chars
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rerank-ollama")
+
+    def _score_one(self, query: str, text: str) -> float:
+        response = self.client.generate(
+            model=self.model_name,
+            prompt=OLLAMA_RERANK_PROMPT.format(query=query, document=text[:self.max_chars]),
+            options={"temperature": 0, "num_predict": 4},
+            keep_alive=ModelManager.keep_alive_for(self.model_name)
+        )
+        match = _SCORE_PATTERN.search(response.get('response', ''))
+        return min(float(match.group()), 10.0) / 10.0 if match else 0.0
+
+    def score(self, query: str, texts: List[str], deadline: Optional[float] = None) -> List[float]:
+        futures = [self._pool.submit(self._score_one, query, text) for text in texts]
+        try:
+            return [
+                future.result(timeout=None if deadline is None else max(deadline - time.monotonic(), 0.0))
+                for future in futures
+            ]
+        except FutureTimeoutError:
+            raise TimeoutError("重排序超时")
+        finally:
+            # 超时或出错时取消尚未开始的请求
+            for future in futures:
+                future.cancel()
+
+def create_reranker(settings: Dict = None, client: Optional["ollama.Client"] = None) -> Reranker:
+    """按配置创建重排序模型"""
+    settings = {**RERANK_SETTINGS, **(settings or {})}
+    if settings["backend"] == "cross_encoder":
+        reranker = CrossEncoderReranker(
+            settings["model_path"], settings["batch_size"], settings["max_length"], settings["num_threads"]
+        )
+    elif settings["backend"] == "ollama":
+        reranker = OllamaReranker(settings["ollama_model"], client, settings["ollama_workers"], settings["max_chars"])
+    else:
+        raise ValueError(f"不支持的重排序后端: {settings['backend']}")
+    logger.info(f"重排序模型已创建: {settings['backend']} / {reranker.model_name}")
+    return reranker
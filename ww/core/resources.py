@@ -0,0 +1,127 @@
+"""
+进程级共享资源
+
+Streamlit 每次交互都会重新执行 app/main.py，这里把打开开销较大的对象
+（向量库、文档加载器、Ollama 客户端、入库任务队列）缓存在进程内，供所有会话共享。
+向量库与文档加载器按知识库分别创建，配置相同嵌入模型的知识库共用一个嵌入模型实例。
+会话相关的状态（当前模型、模型参数、对话历史）保存在各自的会话中，
+调用时再传入，不写入共享对象。
+"""
+import json
+import threading
+from typing import TYPE_CHECKING, Any, Callable, Dict, Sequence
+from .document_loader import DocumentLoader
+from .vector_store import VectorStore
+from .embeddings import EmbeddingProvider, create_embedding_provider
+from .rerank import Reranker, create_reranker
+from .chat import ChatManager
+from .config import OLLAMA_BASE_URL, QUERY_CACHE_SETTINGS, EMBEDDING_SETTINGS, DEFAULT_KNOWLEDGE_BASE
+from .knowledge_base import knowledge_base_settings
+from .query_cache import AnswerCache
+from .job_queue import IngestJobQueue
+from .models import ModelManager
+from .logger import logger
+
+if TYPE_CHECKING:
+    import ollama
+
+_lock = threading.RLock()
+_instances: Dict[str, Any] = {}
+
+def _get_or_create(key: str, factory: Callable[[], Any]) -> Any:
+    """按键获取共享实例，不存在时加锁创建"""
+    instance = _instances.get(key)
+    if instance is None:
+        with _lock:
+            instance = _instances.get(key)
+            if instance is None:
+                instance = factory()
+                _instances[key] = instance
+                logger.info(f"共享资源已创建: {key}")
+    return instance
+
+def get_document_loader(knowledge_base: str = DEFAULT_KNOWLEDGE_BASE) -> DocumentLoader:
+    """获取知识库共享的文档加载器（按该知识库的分块配置）"""
+    chunking = knowledge_base_settings(knowledge_base)["chunking"]
+    return _get_or_create(f"document_loader:{knowledge_base}", lambda: DocumentLoader(chunking=chunking))
+
+def get_embedding_provider(knowledge_base: str = DEFAULT_KNOWLEDGE_BASE) -> EmbeddingProvider:
+    """获取知识库使用的共享嵌入模型"""
+    embedding = {**EMBEDDING_SETTINGS, **knowledge_base_settings(knowledge_base)["embedding"]}
+    key = "embedding_provider:" + json.dumps(embedding, sort_keys=True)
+    return _get_or_create(key, lambda: create_embedding_provider(embedding, client=get_ollama_client()))
+
+def get_vector_store(knowledge_base: str = DEFAULT_KNOWLEDGE_BASE) -> VectorStore:
+    """获取知识库共享的向量存储，文档变化时清空回答缓存"""
+    def create():
+        settings = knowledge_base_settings(knowledge_base)
+        store = VectorStore(
+            persist_directory=settings["persist_directory"],
+            embedding_provider=get_embedding_provider(knowledge_base),
+            backend=settings["vector_backend"]
+        )
+        store.add_change_listener(_clear_answer_cache)
+        return store
+    return _get_or_create(f"vector_store:{knowledge_base}", create)
+
+def get_vector_stores(knowledge_bases: Sequence[str]) -> Dict[str, VectorStore]:
+    """获取多个知识库的共享向量存储（按名称）"""
+    return {name: get_vector_store(name) for name in knowledge_bases}
+
+def get_reranker() -> Reranker:
+    """获取共享的重排序模型（创建时即加载交叉编码器，首次重排序不必等待加载）"""
+    def create():
+        reranker = create_reranker(client=get_ollama_client())
+        reranker.warm_up()
+        return reranker
+    return _get_or_create("reranker", create)
+
+def get_ollama_client() -> "ollama.Client":
+    """获取共享的Ollama客户端"""
+    def create():
+        import ollama
+        return ollama.Client(host=OLLAMA_BASE_URL)
+    return _get_or_create("ollama_client", create)
+
+def get_answer_cache() -> AnswerCache:
+    """获取共享的回答缓存，任一知识库的文档变化时自动清空"""
+    return _get_or_create("answer_cache", AnswerCache)
+
+def _clear_answer_cache():
+    cache = _instances.get("answer_cache")
+    if cache is not None:
+        cache.clear()
+
+def get_model_manager() -> ModelManager:
+    """获取共享的模型管理器，首次创建时在后台预加载配置的模型"""
+    def create():
+        manager = ModelManager(get_ollama_client())
+        manager.preload()
+        return manager
+    return _get_or_create("model_manager", create)
+
+def get_chat_manager() -> ChatManager:
+    """获取共享的对话管理器（模型与参数在每次调用时按会话传入）"""
+    return _get_or_create("chat_manager", lambda: ChatManager(
+        client=get_ollama_client(),
+        answer_cache=get_answer_cache() if QUERY_CACHE_SETTINGS["enabled"] else None,
+        embedding_provider=get_embedding_provider(),
+        model_manager=get_model_manager()
+    ))
+
+def get_job_queue() -> IngestJobQueue:
+    """获取共享的后台入库任务队列，首次创建时启动工作线程（继续执行此前未完成的任务）"""
+    def create():
+        queue = IngestJobQueue(get_vector_store, get_document_loader)
+        queue.start()
+        return queue
+    return _get_or_create("job_queue", create)
+
+def reset_resources():
+    """丢弃所有共享实例，下次获取时重新创建"""
+    with _lock:
+        queue = _instances.get("job_queue")
+        if queue is not None:
+            queue.stop()
+        _instances.clear()
+    logger.info("共享资源已重置")
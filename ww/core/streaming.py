@@ -0,0 +1,55 @@
+"""
+流式输出缓冲
+
+逐 token 刷新界面时，每个 token 都要把越来越长的完整回答重新发送并渲染一次，
+总开销随回答长度平方增长。这里把片段先攒起来，按时间或片段数合并后再输出：
+- StreamBuffer: 累积片段（新增片段存在列表中，刷新时才拼接），判断何时需要刷新
+- coalesce: 把逐 token 的流合并成较大的片段，供不需要逐 token 输出的调用方使用
+
+节奏见 STREAM_RENDER_SETTINGS。
+"""
+import time
+from typing import Iterable, Iterator, List
+from .config import STREAM_RENDER_SETTINGS
+
+class StreamBuffer:
+    """累积流式片段，按时间或片段数决定何时刷新"""
+
+    def __init__(self, interval: float = STREAM_RENDER_SETTINGS["interval"],
+                 max_pieces: int = STREAM_RENDER_SETTINGS["max_pieces"]):
+        self.interval = interval
+        self.max_pieces = max_pieces
+        self._pending: List[str] = []   # 上次刷新后新增的片段
+        self._text = ""                 # 已刷新的文本
+        self._last_flush = time.monotonic()
+
+    def append(self, piece: str) -> bool:
+        """追加片段，返回是否到了刷新的时候"""
+        if piece:
+            self._pending.append(piece)
+        return bool(self._pending) and (
+            len(self._pending) >= self.max_pieces or time.monotonic() - self._last_flush >= self.interval
+        )
+
+    def take(self) -> str:
+        """取出上次刷新后新增的文本并标记刷新（增量输出时使用，不累积完整文本）"""
+        piece = "".join(self._pending)
+        self._pending.clear()
+        self._last_flush = time.monotonic()
+        return piece
+
+    def flush(self) -> str:
+        """标记刷新，返回到目前为止的完整文本"""
+        self._text += self.take()
+        return self._text
+
+def coalesce(stream: Iterable[str], interval: float = STREAM_RENDER_SETTINGS["interval"],
+             max_pieces: int = STREAM_RENDER_SETTINGS["max_pieces"]) -> Iterator[str]:
+    """把逐 token 的流合并成较大的片段，流结束时输出剩余部分；拼接起来与原始流相同"""
+    buffer = StreamBuffer(interval, max_pieces)
+    for piece in stream:
+        if buffer.append(piece):
+            yield buffer.take()
+    rest = buffer.take()
+    if rest:
+        yield rest
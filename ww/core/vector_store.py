@@ -1,75 +1,543 @@
-from typing import List, Dict, Any
-import chromadb
-from chromadb.config import Settings
-from .config import CHROMA_SETTINGS
+import hashlib
+from pathlib import Path
+from typing import List, Dict, Any, Callable, Optional
+from .config import (
+    CHROMA_SETTINGS, HNSW_SETTINGS, HNSW_BUILD_PARAMS, FILE_CATALOG_NAME, KEYWORD_INDEX_NAME,
+    QUERY_CACHE_SETTINGS, HYBRID_SEARCH_SETTINGS, DEFAULT_SEARCH_PARAMS, PARENT_FETCH_FACTOR,
+    VECTOR_BACKENDS, VECTOR_BACKEND, MMAP_INDEX_NAME
+)
+from .embeddings import EmbeddingProvider, create_embedding_provider
+from .keyword_index import KeywordIndex
+from .query_cache import TTLCache, normalize_query
+from .file_catalog import FileCatalog
+from .metrics import span
 from .logger import logger, log_error
 
+# 重建文件目录/关键词索引时每次从 collection 读取的条数
+CATALOG_REBUILD_PAGE_SIZE = 5000
+
+# 检索模式
+SEARCH_MODES = ["hybrid", "vector", "keyword"]
+
+COLLECTION_NAME = "documents"
+
+def hnsw_metadata(settings: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """HNSW 配置转换为 collection 元数据（hnsw:*），未设置的参数使用 Chroma 默认值"""
+    return {
+        f"hnsw:{name}": value
+        for name, value in (settings or HNSW_SETTINGS).items() if value is not None
+    }
+
+def make_chunk_ids(filename: str, contents: List[str]) -> List[str]:
+    """按内容哈希生成块ID，同一文件内内容相同的块追加序号区分"""
+    ids = []
+    seen: Dict[str, int] = {}
+    for content in contents:
+        digest = hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+        occurrence = seen.get(digest, 0)
+        seen[digest] = occurrence + 1
+        ids.append(f"{filename}_{digest}" if occurrence == 0 else f"{filename}_{digest}_{occurrence}")
+    return ids
+
+def open_collection(persist_directory: str, backend: str = VECTOR_BACKEND,
+                    metadata: Optional[Dict[str, Any]] = None, settings: Optional[Dict[str, Any]] = None,
+                    embedding_function: Any = None):
+    """打开（不存在时创建）向量库目录中的 collection
+
+    chroma 后端返回 Chroma collection；mmap 后端返回接口相同的 MmapCollection。
+    settings 为后端配置（chroma: HNSW_SETTINGS 结构；mmap: MMAP_INDEX_SETTINGS 结构）。
+    """
+    if backend == "chroma":
+        # chromadb 导入较慢，创建向量库时才导入
+        import chromadb
+        client = chromadb.PersistentClient(path=str(persist_directory))
+        return client.get_or_create_collection(
+            name=COLLECTION_NAME,
+            metadata={**hnsw_metadata(settings), **(metadata or {})},
+            embedding_function=embedding_function
+        )
+    if backend == "mmap":
+        from .mmap_index import MmapCollection
+        return MmapCollection(
+            Path(persist_directory) / MMAP_INDEX_NAME, HNSW_SETTINGS["space"], metadata, settings
+        )
+    raise ValueError(f"不支持的向量库后端: {backend}（可选: {', '.join(VECTOR_BACKENDS)}）")
+
 class VectorStore:
-    def __init__(self):
-        # 使用持久化设置创建客户端
-        self.client = chromadb.PersistentClient(path=CHROMA_SETTINGS["persist_directory"])
+    def __init__(self, persist_directory: str = None, embedding_provider: EmbeddingProvider = None,
+                 backend: str = None):
+        self.persist_directory = persist_directory or CHROMA_SETTINGS["persist_directory"]
+        self.backend = backend or VECTOR_BACKEND
+        # 嵌入模型：入库和检索都由它计算向量
+        self.embedding_provider = embedding_provider or create_embedding_provider()
         # 获取或创建collection
-        self.collection = self.client.get_or_create_collection(
-            name="documents",
-            metadata={"hnsw:space": "cosine"}
+        self.collection = open_collection(
+            self.persist_directory, self.backend,
+            metadata={"embedding_model": self.embedding_provider.model_name},
+            embedding_function=self.embedding_provider
         )
-        logger.info("向量存储初始化完成")
+        if self.backend == "chroma":
+            self._sync_hnsw_settings()
+        stored_model = (self.collection.metadata or {}).get("embedding_model")
+        if stored_model and stored_model != self.embedding_provider.model_name:
+            logger.warning(
+                f"向量库使用的嵌入模型 {stored_model} 与当前模型 "
+                f"{self.embedding_provider.model_name} 不一致，检索结果可能不准确"
+            )
+        # 文件目录：记录每个文件对应的块，避免全量扫描 collection
+        self.catalog = FileCatalog(Path(self.persist_directory) / FILE_CATALOG_NAME)
+        if self.catalog.is_empty() and self.collection.count() > 0:
+            self.rebuild_catalog()
+        # 关键词倒排索引，用于混合检索
+        self.keyword_index = KeywordIndex(Path(self.persist_directory) / KEYWORD_INDEX_NAME)
+        if self.keyword_index.is_empty() and self.collection.count() > 0:
+            self.rebuild_keyword_index()
+        # 检索结果缓存，文档变化时清空
+        self.retrieval_cache = TTLCache(
+            QUERY_CACHE_SETTINGS["retrieval_max_entries"],
+            QUERY_CACHE_SETTINGS["retrieval_ttl"]
+        ) if QUERY_CACHE_SETTINGS["enabled"] else None
+        self._change_listeners: List[Callable[[], None]] = []
+        self._generation = 0
+        logger.info(f"向量存储初始化完成（{self.backend}）")
+
+    def _sync_hnsw_settings(self):
+        """已有 collection 的 HNSW 参数与配置不一致时：运行参数直接更新，建索引参数提示重建"""
+        stored = dict(self.collection.metadata or {})
+        wanted = hnsw_metadata()
+        changed = {key: value for key, value in wanted.items() if stored.get(key) != value}
+        if not changed:
+            return
+        build_keys = {f"hnsw:{name}" for name in HNSW_BUILD_PARAMS}
+        stale = {key: stored.get(key) for key in build_keys & changed.keys()}
+        if stale:
+            logger.warning(
+                f"向量库的 HNSW 建索引参数与配置不一致（当前 {stale}），"
+                f"运行 python maintain.py rebuild 重建后生效"
+            )
+        runtime = {key: value for key, value in changed.items() if key not in build_keys}
+        if runtime:
+            try:
+                self.collection.modify(metadata={**stored, **runtime})
+                logger.info(f"已更新 HNSW 运行参数: {runtime}（重新打开向量库后生效）")
+            except Exception as e:
+                log_error(e, "更新 HNSW 运行参数失败")
+
+    def rebuild_keyword_index(self):
+        """从 collection 分页重建关键词索引（仅在索引缺失时调用）"""
+        try:
+            self.keyword_index.clear()
+            offset = 0
+            while True:
+                page = self.collection.get(
+                    include=["documents", "metadatas"],
+                    limit=CATALOG_REBUILD_PAGE_SIZE,
+                    offset=offset
+                )
+                if not page['ids']:
+                    break
+                self.keyword_index.add(
+                    page['ids'],
+                    page['documents'],
+                    [metadata['filename'] for metadata in page['metadatas']]
+                )
+                offset += len(page['ids'])
+            logger.info(f"关键词索引重建完成，共 {offset} 个块")
+        except Exception as e:
+            log_error(e, "重建关键词索引失败")
+            raise
+
+    def add_change_listener(self, listener: Callable[[], None]):
+        """注册文档变化时的回调（用于让依赖文档内容的缓存失效）"""
+        self._change_listeners.append(listener)
 
-    def add_documents(self, documents: List[Dict[str, Any]]):
-        """添加文档到向量存储"""
+    def _notify_change(self):
+        """文档发生变化：清空检索缓存并通知监听者"""
+        self._generation += 1
+        if self.retrieval_cache is not None:
+            self.retrieval_cache.clear()
+        for listener in self._change_listeners:
+            try:
+                listener()
+            except Exception as e:
+                log_error(e, "文档变化回调失败")
+
+    def rebuild_catalog(self):
+        """从 collection 元数据分页重建文件目录（仅在目录缺失时调用）"""
+        try:
+            files: Dict[str, List[str]] = {}
+            offset = 0
+            while True:
+                page = self.collection.get(
+                    include=["metadatas"],
+                    limit=CATALOG_REBUILD_PAGE_SIZE,
+                    offset=offset
+                )
+                if not page['ids']:
+                    break
+                for id, metadata in zip(page['ids'], page['metadatas']):
+                    files.setdefault(metadata['filename'], []).append(id)
+                offset += len(page['ids'])
+
+            self.catalog.clear()
+            for filename, ids in files.items():
+                self.catalog.record(filename, ids, replace=True)
+            logger.info(f"文件目录重建完成，共 {len(files)} 个文件")
+        except Exception as e:
+            log_error(e, "重建文件目录失败")
+            raise
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """计算文本向量"""
+        return self.embedding_provider.embed(texts)
+
+    def add_documents(self, documents: List[Dict[str, Any]], embeddings: List[List[float]] = None,
+                      record_hash: bool = True):
+        """添加文档到向量存储（可传入预先计算好的向量）
+
+        record_hash=False 时文件目录中只追加块ID、不更新内容哈希（由 apply_update 在全部完成后写入）
+        """
         try:
-            ids = [f"{doc['metadata']['filename']}_{doc['metadata']['chunk_id']}" 
-                  for doc in documents]
             texts = [doc['content'] for doc in documents]
             metadatas = [doc['metadata'] for doc in documents]
+            ids = [doc.get('id') for doc in documents]
+            if None in ids:
+                ids = make_chunk_ids(documents[0]['metadata']['filename'], texts)
+            if embeddings is None:
+                embeddings = self.embed(texts)
             
             self.collection.add(
                 ids=ids,
                 documents=texts,
-                metadatas=metadatas
+                metadatas=metadatas,
+                embeddings=embeddings
             )
+
+            # 同步文件目录
+            files: Dict[str, List[int]] = {}
+            for i, metadata in enumerate(metadatas):
+                files.setdefault(metadata['filename'], []).append(i)
+            for filename, indexes in files.items():
+                content_hash = metadatas[indexes[0]].get('file_hash') or hashlib.sha256(
+                    "\n".join(texts[i] for i in indexes).encode("utf-8")
+                ).hexdigest()
+                self.catalog.record(filename, [ids[i] for i in indexes], content_hash,
+                                    keep_hash=not record_hash)
+            self.keyword_index.add(ids, texts, [metadata['filename'] for metadata in metadatas])
+            self._notify_change()
             logger.info(f"成功添加 {len(documents)} 个文档块到向量存储")
         except Exception as e:
             log_error(e, "添加文档到向量存储失败")
             raise
 
-    def search(self, query: str, n_results: int = 5) -> List[Dict[str, Any]]:
-        """搜索相似文档"""
+    def plan_update(self, filename: str, documents: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """对比文件目录，计算增量更新计划（需新增、保留、删除的块）"""
+        entry = self.catalog.get(filename)
+        file_hash = documents[0]['metadata'].get('file_hash') if documents else None
+        ids = make_chunk_ids(filename, [doc['content'] for doc in documents])
+        for id, doc in zip(ids, documents):
+            doc['id'] = id
+
+        old_ids = set(entry['chunk_ids']) if entry else set()
+        new_ids = set(ids)
+        return {
+            "filename": filename,
+            "file_hash": file_hash,
+            "ids": ids,
+            "unchanged": bool(entry) and file_hash is not None and entry['content_hash'] == file_hash,
+            "add": [doc for doc in documents if doc['id'] not in old_ids],
+            "keep": [doc for doc in documents if doc['id'] in old_ids],
+            "remove": [id for id in (entry['chunk_ids'] if entry else []) if id not in new_ids],
+            # 父子分块时的父块内容（parent_id → 内容）
+            "parents": {
+                doc['metadata']['parent_id']: doc['parent_content']
+                for doc in documents if 'parent_content' in doc
+            }
+        }
+
+    def apply_update(self, plan: Dict[str, Any], embeddings: List[List[float]] = None,
+                     batch_size: int = None) -> Dict[str, int]:
+        """执行增量更新计划；embeddings 与 plan["add"] 一一对应，可为空"""
+        filename = plan['filename']
+        stats = {"added": 0, "kept": len(plan['keep']), "removed": 0}
+        if plan['unchanged']:
+            logger.info(f"文件 {filename} 未变化，跳过入库")
+            return stats
         try:
-            results = self.collection.query(
-                query_texts=[query],
-                n_results=n_results
+            to_add = plan['add']
+            batch_size = batch_size or max(len(to_add), 1)
+            for start in range(0, len(to_add), batch_size):
+                # 新的内容哈希只在最后的 catalog.record 中写入，中途失败时下次仍会重新入库
+                self.add_documents(
+                    to_add[start:start + batch_size],
+                    embeddings[start:start + batch_size] if embeddings is not None else None,
+                    record_hash=False
+                )
+            stats["added"] = len(to_add)
+
+            # 保留的块只更新元数据（序号、哈希），不重新计算向量
+            if plan['keep']:
+                self.collection.update(
+                    ids=[doc['id'] for doc in plan['keep']],
+                    metadatas=[doc['metadata'] for doc in plan['keep']]
+                )
+            if plan['remove']:
+                self.collection.delete(ids=plan['remove'])
+                self.keyword_index.remove(plan['remove'])
+                stats["removed"] = len(plan['remove'])
+                self._notify_change()
+
+            if plan['ids']:
+                self.catalog.record(filename, plan['ids'], plan['file_hash'], replace=True)
+                self.catalog.record_parents(filename, plan.get('parents', {}))
+            else:
+                self.catalog.remove(filename)
+            logger.info(
+                f"文件 {filename} 增量更新完成: 新增 {stats['added']}, "
+                f"保留 {stats['kept']}, 删除 {stats['removed']}"
             )
-            
+            return stats
+        except Exception as e:
+            log_error(e, f"增量更新失败: {filename}")
+            raise
+
+    def is_indexed(self, filename: str, file_hash: str) -> bool:
+        """文件是否已以相同内容入库"""
+        entry = self.catalog.get(filename)
+        return bool(entry) and entry['content_hash'] == file_hash
+
+    def index_documents(self, filename: str, documents: List[Dict[str, Any]]) -> Dict[str, int]:
+        """增量索引单个文件：未变化的文件跳过，只为新增或变化的块计算向量"""
+        return self.apply_update(self.plan_update(filename, documents))
+
+    def search(self, query: str, n_results: int = 5,
+               mode: str = DEFAULT_SEARCH_PARAMS["mode"],
+               similarity_threshold: float = None,
+               query_embedding: List[float] = None) -> List[Dict[str, Any]]:
+        """搜索相似文档
+
+        mode: vector 纯向量检索；keyword 纯 BM25 关键词检索；
+        hybrid 两路各取候选后按倒数排名融合（RRF）
+        similarity_threshold: 过滤向量相似度（1 - 余弦距离）低于该值的结果，
+        关键词命中的结果不受影响
+        query_embedding: 预先计算好的查询向量（如由调用方合并批量计算）
+        父子分块入库的文件，命中子块时返回父块内容（原子块内容在 child_content 中），
+        同一父块只返回一次
+        """
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"不支持的检索模式: {mode}")
+        with span("retrieval", labels={"mode": mode}) as info:
+            cache_key = (normalize_query(query), n_results, mode)
+            if self.retrieval_cache is not None:
+                cached = self.retrieval_cache.get(cache_key)
+                if cached is not None:
+                    logger.info(f"命中检索缓存，返回 {len(cached)} 个相关文档")
+                    info.update(cached=True, results=len(cached))
+                    return self._apply_threshold(cached, similarity_threshold)
+            generation = self._generation
+            # 同一父块的子块会合并，多取一些子块
+            fetch = n_results * PARENT_FETCH_FACTOR if self.catalog.has_parents else n_results
+            try:
+                if mode == "vector":
+                    documents = self._vector_search(query, fetch, query_embedding)
+                elif mode == "keyword":
+                    documents = self._keyword_search(query, fetch)
+                else:
+                    documents = self._hybrid_search(query, fetch, query_embedding)
+                if self.catalog.has_parents:
+                    documents = self._expand_parents(documents)[:n_results]
+                
+                # 查询期间文档发生变化时不缓存可能过期的结果
+                if self.retrieval_cache is not None and generation == self._generation:
+                    self.retrieval_cache.set(cache_key, documents)
+                logger.info(f"成功搜索到 {len(documents)} 个相关文档")
+                info.update(cached=False, results=len(documents))
+                return self._apply_threshold(documents, similarity_threshold)
+            except Exception as e:
+                log_error(e, "搜索文档失败")
+                raise
+
+    def search_batch(self, queries: List[str], n_results: int = 5,
+                     mode: str = DEFAULT_SEARCH_PARAMS["mode"],
+                     similarity_threshold: float = None,
+                     query_embeddings: List[List[float]] = None) -> List[List[Dict[str, Any]]]:
+        """批量搜索，结果与逐个调用 search 相同（按 queries 的顺序）
+
+        未命中检索缓存的查询一次计算查询向量，向量检索合并为一次 collection.query；
+        关键词检索与混合检索的融合仍逐个查询进行。
+        query_embeddings: 预先计算好的查询向量，与 queries 一一对应
+        """
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"不支持的检索模式: {mode}")
+        with span("retrieval_batch", labels={"mode": mode}) as info:
+            keys = [(normalize_query(query), n_results, mode) for query in queries]
+            results: List[Optional[List[Dict[str, Any]]]] = [None] * len(queries)
+            if self.retrieval_cache is not None:
+                for i, key in enumerate(keys):
+                    results[i] = self.retrieval_cache.get(key)
+            pending = [i for i, documents in enumerate(results) if documents is None]
+            generation = self._generation
+            fetch = n_results * PARENT_FETCH_FACTOR if self.catalog.has_parents else n_results
+            try:
+                if not pending:
+                    found = []
+                elif mode == "keyword":
+                    found = [self._keyword_search(queries[i], fetch) for i in pending]
+                else:
+                    if query_embeddings is not None:
+                        embeddings = [query_embeddings[i] for i in pending]
+                    else:
+                        with span("query_embedding"):
+                            embeddings = self.embed([queries[i] for i in pending])
+                    if mode == "vector":
+                        found = self._vector_query(embeddings, fetch)
+                    else:
+                        candidates = fetch * HYBRID_SEARCH_SETTINGS["candidate_factor"]
+                        found = [
+                            self._fuse(queries[i], fetch, vector_docs)
+                            for i, vector_docs in zip(pending, self._vector_query(embeddings, candidates))
+                        ]
+                for i, documents in zip(pending, found):
+                    if self.catalog.has_parents:
+                        documents = self._expand_parents(documents)[:n_results]
+                    if self.retrieval_cache is not None and generation == self._generation:
+                        self.retrieval_cache.set(keys[i], documents)
+                    results[i] = documents
+                logger.info(f"批量搜索完成: {len(queries)} 个查询，其中 {len(queries) - len(pending)} 个命中检索缓存")
+                info.update(queries=len(queries), cached=len(queries) - len(pending))
+                return [self._apply_threshold(documents, similarity_threshold) for documents in results]
+            except Exception as e:
+                log_error(e, "批量搜索文档失败")
+                raise
+
+    @staticmethod
+    def _apply_threshold(documents: List[Dict[str, Any]], similarity_threshold: float = None) -> List[Dict[str, Any]]:
+        """按相似度阈值过滤，返回副本以免调用方修改缓存内容"""
+        filtered = []
+        for doc in documents:
+            doc = dict(doc)
+            if 'distance' in doc:
+                doc['similarity'] = 1.0 - doc['distance']
+                if (similarity_threshold is not None and doc['similarity'] < similarity_threshold
+                        and 'bm25_score' not in doc):
+                    continue
+            filtered.append(doc)
+        if similarity_threshold is not None and len(filtered) < len(documents):
+            logger.info(f"相似度阈值 {similarity_threshold} 过滤掉 {len(documents) - len(filtered)} 个文档")
+        return filtered
+
+    def _expand_parents(self, documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """子块换成所在父块的内容，同一父块只保留排名最前的一个；父块缺失时保留子块"""
+        parents = self.catalog.get_parents(
+            [doc['metadata']['parent_id'] for doc in documents if doc['metadata'].get('parent_id')]
+        )
+        expanded = []
+        seen = set()
+        for doc in documents:
+            id = doc['metadata'].get('parent_id')
+            if id in seen:
+                continue
+            if id in parents:
+                seen.add(id)
+                doc = {**doc, 'content': parents[id], 'child_content': doc['content']}
+            expanded.append(doc)
+        return expanded
+
+    def _vector_search(self, query: str, n_results: int,
+                       query_embedding: List[float] = None) -> List[Dict[str, Any]]:
+        """向量检索"""
+        if query_embedding is None:
+            with span("query_embedding"):
+                query_embedding = self.embed([query])[0]
+        return self._vector_query([query_embedding], n_results)[0]
+
+    def _vector_query(self, query_embeddings: List[List[float]], n_results: int) -> List[List[Dict[str, Any]]]:
+        """用一次 collection.query 检索多个查询向量，返回各查询的结果"""
+        results = self.collection.query(
+            query_embeddings=query_embeddings,
+            n_results=n_results
+        )
+        
+        found = []
+        for q in range(len(query_embeddings)):
             documents = []
-            for i in range(len(results['documents'][0])):
+            for i in range(len(results['documents'][q])):
                 doc = {
-                    'content': results['documents'][0][i],
-                    'metadata': results['metadatas'][0][i],
-                    'distance': results['distances'][0][i]
+                    'id': results['ids'][q][i],
+                    'content': results['documents'][q][i],
+                    'metadata': results['metadatas'][q][i],
+                    'distance': results['distances'][q][i]
                 }
                 documents.append(doc)
-            
-            logger.info(f"成功搜索到 {len(documents)} 个相关文档")
-            return documents
-        except Exception as e:
-            log_error(e, "搜索文档失败")
-            raise
+            found.append(documents)
+        return found
+
+    def _keyword_search(self, query: str, n_results: int) -> List[Dict[str, Any]]:
+        """BM25 关键词检索"""
+        hits = self.keyword_index.search(query, n_results)
+        documents = self._get_by_ids([chunk_id for chunk_id, _ in hits])
+        for doc, (_, score) in zip(documents, hits):
+            doc['bm25_score'] = score
+        return documents
+
+    def _hybrid_search(self, query: str, n_results: int,
+                       query_embedding: List[float] = None) -> List[Dict[str, Any]]:
+        """混合检索：向量与 BM25 各取候选，按倒数排名融合"""
+        candidates = n_results * HYBRID_SEARCH_SETTINGS["candidate_factor"]
+        return self._fuse(query, n_results, self._vector_search(query, candidates, query_embedding))
+
+    def _fuse(self, query: str, n_results: int, vector_docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """取 BM25 候选，与向量检索的候选按倒数排名融合"""
+        candidates = n_results * HYBRID_SEARCH_SETTINGS["candidate_factor"]
+        rrf_k = HYBRID_SEARCH_SETTINGS["rrf_k"]
+
+        keyword_hits = self.keyword_index.search(query, candidates)
+
+        scores: Dict[str, float] = {}
+        for rank, doc in enumerate(vector_docs):
+            scores[doc['id']] = scores.get(doc['id'], 0.0) + 1.0 / (rrf_k + rank + 1)
+        for rank, (chunk_id, _) in enumerate(keyword_hits):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (rrf_k + rank + 1)
+        top_ids = sorted(scores, key=scores.get, reverse=True)[:n_results]
+
+        by_id = {doc['id']: doc for doc in vector_docs}
+        bm25_scores = dict(keyword_hits)
+        missing = [chunk_id for chunk_id in top_ids if chunk_id not in by_id]
+        for doc in self._get_by_ids(missing):
+            by_id[doc['id']] = doc
+
+        documents = []
+        for chunk_id in top_ids:
+            doc = by_id.get(chunk_id)
+            if doc is None:
+                continue
+            doc['score'] = scores[chunk_id]
+            if chunk_id in bm25_scores:
+                doc['bm25_score'] = bm25_scores[chunk_id]
+            documents.append(doc)
+        return documents
+
+    def _get_by_ids(self, ids: List[str]) -> List[Dict[str, Any]]:
+        """按ID读取块内容，保持传入顺序"""
+        if not ids:
+            return []
+        results = self.collection.get(ids=ids, include=["documents", "metadatas"])
+        found = {
+            id: {'id': id, 'content': content, 'metadata': metadata}
+            for id, content, metadata in zip(results['ids'], results['documents'], results['metadatas'])
+        }
+        return [found[id] for id in ids if id in found]
 
     def delete_documents(self, filename: str):
         """删除指定文件的所有文档块"""
         try:
-            # 获取所有文档的元数据
-            results = self.collection.get()
-            
-            # 找到匹配的文档ID
-            ids_to_delete = [
-                id for id, metadata in zip(results['ids'], results['metadatas'])
-                if metadata['filename'] == filename
-            ]
+            # 从文件目录取出块ID，按元数据过滤删除，无需读取全部文档
+            ids_to_delete = self.catalog.remove(filename)
+            self.collection.delete(where={"filename": filename})
+            self.keyword_index.remove_file(filename)
+            self._notify_change()
             
             if ids_to_delete:
-                self.collection.delete(ids=ids_to_delete)
                 logger.info(f"成功删除文件 {filename} 的所有文档块")
             else:
                 logger.warning(f"未找到文件 {filename} 的文档块")
@@ -81,9 +549,7 @@ class VectorStore:
     def get_all_files(self) -> List[str]:
         """获取所有已存储的文件名"""
         try:
-            results = self.collection.get()
-            unique_files = set(metadata['filename'] for metadata in results['metadatas'])
-            return list(unique_files)
+            return self.catalog.list_files()
         except Exception as e:
             log_error(e, "获取文件列表失败")
             raise 
\ No newline at end of file
@@ -0,0 +1,65 @@
+"""
+批量入库命令行
+
+用法: python ingest.py <目录> [--knowledge-base 名称] [--no-recursive] [--parse-workers N] [--embed-workers N]
+"""
+import argparse
+import sys
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent
+sys.path.append(str(project_root))
+
+from core.config import DEFAULT_INGEST_PARAMS, DEFAULT_KNOWLEDGE_BASE, initialize
+from core.embeddings import create_embedding_provider
+from core.ingest import BulkIngestor
+from core.knowledge_base import list_knowledge_bases, knowledge_base_settings
+from core.vector_store import VectorStore
+from core.logger import logger
+
+def main():
+    parser = argparse.ArgumentParser(description="批量入库目录中的文档")
+    parser.add_argument("directory", type=Path, help="文档目录")
+    parser.add_argument("--knowledge-base", default=DEFAULT_KNOWLEDGE_BASE, choices=list_knowledge_bases(),
+                        help="写入的知识库")
+    parser.add_argument("--no-recursive", action="store_true", help="不递归子目录")
+    parser.add_argument("--parse-workers", type=int, default=DEFAULT_INGEST_PARAMS["parse_workers"])
+    parser.add_argument("--embed-workers", type=int, default=DEFAULT_INGEST_PARAMS["embed_workers"])
+    parser.add_argument("--embed-batch-size", type=int, default=DEFAULT_INGEST_PARAMS["embed_batch_size"])
+    parser.add_argument("--insert-batch-size", type=int, default=DEFAULT_INGEST_PARAMS["insert_batch_size"])
+    parser.add_argument("--max-pending-files", type=int, default=DEFAULT_INGEST_PARAMS["max_pending_files"])
+    args = parser.parse_args()
+    initialize()
+
+    settings = knowledge_base_settings(args.knowledge_base)
+    vector_store = VectorStore(
+        persist_directory=settings["persist_directory"],
+        embedding_provider=create_embedding_provider(settings["embedding"]),
+        backend=settings["vector_backend"]
+    )
+    ingestor = BulkIngestor(vector_store, {
+        "parse_workers": args.parse_workers,
+        "embed_workers": args.embed_workers,
+        "embed_batch_size": args.embed_batch_size,
+        "insert_batch_size": args.insert_batch_size,
+        "max_pending_files": args.max_pending_files
+    }, chunking=settings["chunking"])
+
+    def report_progress(progress):
+        logger.info(
+            f"进度: {progress.processed_files}/{progress.total_files} 个文件, "
+            f"新增 {progress.chunks} 个块, 跳过 {progress.skipped_files} 个, 失败 {len(progress.failed_files)} 个"
+        )
+
+    report = ingestor.ingest_directory(
+        args.directory,
+        recursive=not args.no_recursive,
+        progress_callback=report_progress
+    )
+    for file_path, error in report["failed_files"].items():
+        logger.warning(f"入库失败: {file_path} | {error}")
+    return 1 if report["failed_files"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+"""
+向量库维护命令行
+
+用法:
+    python maintain.py [--knowledge-base 名称] status
+    python maintain.py [--knowledge-base 名称] rebuild [--dry-run] [--keep-backup] [--queries 200] [--k 10]
+                                                       [--to-backend chroma|mmap]
+
+rebuild 按 core/config.py 中的 HNSW_SETTINGS（mmap 后端为 MMAP_INDEX_SETTINGS）重建并压缩向量库，
+并报告新旧索引的召回率与检索延迟；--to-backend 把向量库转换为另一种后端。运行前请停止界面与 API 服务。
+每个知识库是独立的向量库，可分别维护。
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent
+sys.path.append(str(project_root))
+
+from core.config import DEFAULT_KNOWLEDGE_BASE, VECTOR_BACKENDS, initialize
+from core.knowledge_base import list_knowledge_bases, knowledge_base_settings
+from core.maintenance import collection_status, rebuild_vector_store
+from core.logger import logger
+
+def main():
+    parser = argparse.ArgumentParser(description="向量库维护")
+    parser.add_argument("--knowledge-base", default=DEFAULT_KNOWLEDGE_BASE, choices=list_knowledge_bases(),
+                        help="维护的知识库")
+    parser.add_argument("--directory", help="向量库目录（指定时忽略 --knowledge-base）")
+    parser.add_argument("--backend", choices=VECTOR_BACKENDS, help="向量库后端（默认使用知识库的配置）")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("status", help="查看块数、索引参数与磁盘占用")
+    rebuild = subparsers.add_parser("rebuild", help="按当前索引配置重建并压缩向量库")
+    rebuild.add_argument("--dry-run", action="store_true", help="只构建和评估新索引，不替换原向量库")
+    rebuild.add_argument("--keep-backup", action="store_true", help="保留原向量库（<目录>.old）")
+    rebuild.add_argument("--queries", type=int, default=200, help="评估召回率使用的查询数")
+    rebuild.add_argument("--k", type=int, default=10, help="评估 recall@k 的 k")
+    rebuild.add_argument("--to-backend", choices=VECTOR_BACKENDS, help="转换为另一种向量库后端")
+    args = parser.parse_args()
+    initialize()
+    settings = knowledge_base_settings(args.knowledge_base)
+    directory = args.directory or settings["persist_directory"]
+    backend = args.backend or settings["vector_backend"]
+
+    if args.command == "status":
+        report = collection_status(directory, backend)
+    else:
+        def report_progress(copied: int, total: int):
+            logger.info(f"已复制 {copied}/{total} 个块")
+
+        report = rebuild_vector_store(
+            directory,
+            queries=args.queries,
+            k=args.k,
+            keep_backup=args.keep_backup,
+            dry_run=args.dry_run,
+            progress_callback=report_progress,
+            backend=backend,
+            target_backend=args.to_backend
+        )
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
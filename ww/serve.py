@@ -0,0 +1,25 @@
+"""
+启动 HTTP API 服务
+
+用法: python serve.py [--host 0.0.0.0] [--port 8000]
+
+服务以单进程运行，以便所有请求共享同一个向量库和嵌入模型；
+需要更多吞吐时在负载均衡后面部署多个实例。
+"""
+import argparse
+import sys
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent
+sys.path.append(str(project_root))
+
+import uvicorn
+from core.config import API_SETTINGS
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="启动 HTTP API 服务")
+    parser.add_argument("--host", default=API_SETTINGS["host"])
+    parser.add_argument("--port", type=int, default=API_SETTINGS["port"])
+    args = parser.parse_args()
+    uvicorn.run("api.server:app", host=args.host, port=args.port, workers=1)